@@ -1,59 +1,239 @@
+import io
 import os
-from Bio import Entrez, Medline
+import json
+import time
+import sqlite3
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from Bio import Medline
+
+from abstract_corpus import CorpusWriter
 
 # Your email
-Entrez.email = "your@email.here"  # Replace with your email
-
-def search_pubmed(search_term, max_results):
-    """Search articles in PubMed."""
-    handle = Entrez.esearch(db="pubmed", term=search_term, retmax=max_results, sort="relevance")
-    result = Entrez.read(handle)
-    handle.close()
-    return result["IdList"]
-
-def download_abstracts(id_list, download_path):
-    """Download abstracts for a list of PubMed IDs."""
-    handle = Entrez.efetch(db="pubmed", id=','.join(id_list), rettype="medline", retmode="text")
-    records = Medline.parse(handle)
-    for record in records:
-        pubmed_id = record.get("PMID", "No_PMID")
-        abstract_text = record.get("AB", "No abstract available")
-        filename = os.path.join(download_path, f"PMID_{pubmed_id}_abstract.txt")
-        with open(filename, 'w', encoding='utf-8') as file:
-            file.write(abstract_text)
-    handle.close()
-
-# Define your expanded search term
-search_term = (
-    '("inflammatory bowel disease" OR IBD OR "Crohn\'s disease" OR "ulcerative colitis" OR '
-    '"indeterminate colitis" OR "IBD-unclassified" OR "pouchitis" OR "colitis") AND '
-    '(genes OR proteins OR mRNA OR cytokines OR enzymes OR alleles OR SNP OR '
-    '"single nucleotide polymorphism" OR transcriptome OR proteome OR "gene expression" OR '
-    '"protein expression" OR "signaling pathway" OR "immune response" OR microbiome OR '
-    '"innate immunity" OR "adaptive immunity" OR "inflammatory markers") AND '
-    '("not associated" OR "no association" OR "lack of association" OR "unrelated" OR '
-    '"not correlated" OR "no correlation" OR "lack of correlation" OR '
-    '"not linked" OR "no link" OR "lack of link" OR '
-    '"not connected" OR "no connection" OR "lack of connection" OR '
-    '"not related" OR "unrelated" OR "lack of relation" OR '
-    '"no significant difference" OR "no significant association" OR '
-    '"no significant correlation" OR "not statistically significant" OR '
-    '"negative results" OR "inconclusive results" OR "no evidence" OR '
-    '"failed to show" OR "did not demonstrate" OR "not supported" OR '
-    '"no role" OR "does not play a role" OR "not involved" OR '
-    '"GWAS" OR "genome-wide association study" OR "meta-analysis" OR "systematic review")'
-)
-
-max_results = 100000  # Adjust based on how many results you want
-
-# Specify the directory where you want to save the abstracts
-download_path = ""  # Update this path to your desired folder
-
-# Ensure the download directory exists
-os.makedirs(download_path, exist_ok=True)
-
-# Perform the search and download the abstracts
-pubmed_ids = search_pubmed(search_term, max_results)
-download_abstracts(pubmed_ids, download_path)
-
-print(f"Downloaded abstracts for {len(pubmed_ids)} articles.")
+EMAIL = "your@email.here"  # Replace with your email
+API_KEY = None  # Optional NCBI API key; raises the rate limit from 3 to 10 requests per second
+
+# E-utilities endpoint; point EUTILS_BASE at a local stub server (see mock_entrez_server.py) for testing
+EUTILS_BASE = os.environ.get("EUTILS_BASE", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/")
+TOOL = "IBD-Non-Associations"
+
+BATCH_SIZE = 200  # PMIDs per efetch request
+WORKERS = 3  # Concurrent efetch requests; NCBI's rate limit still applies across all of them
+MAX_RETRIES = 4  # Attempts per request before the batch is left for the next run
+ID_PAGE_SIZE = 10000  # PMIDs per ID-list page read back from the History server
+PACKED = False  # Write one packed corpus (abstracts.corpus in the download folder) instead of a file per abstract
+
+
+class RequestThrottle:
+    """Spaces requests from every worker thread at least 1/per_second seconds apart."""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class DownloadManifest:
+    """Record of every downloaded PMID and the date of the last completed search."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS pmids (pmid TEXT PRIMARY KEY, fetched TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+
+    def downloaded(self):
+        return {pmid for (pmid,) in self.conn.execute("SELECT pmid FROM pmids")}
+
+    def record(self, pmids):
+        today = date.today().strftime("%Y/%m/%d")
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO pmids (pmid, fetched) VALUES (?, ?)",
+                                  [(pmid, today) for pmid in pmids])
+
+    def get(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def eutils_request(endpoint, params, throttle):
+    """POST one E-utilities request, retrying throttling, server and network errors with backoff."""
+    params = dict(params, tool=TOOL, email=EMAIL)
+    if API_KEY:
+        params["api_key"] = API_KEY
+    data = urllib.parse.urlencode(params).encode('utf-8')
+    url = urllib.parse.urljoin(EUTILS_BASE, endpoint)
+
+    for attempt in range(MAX_RETRIES):
+        throttle.wait()
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=120) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code != 429 and e.code < 500 or attempt == MAX_RETRIES - 1:
+                raise
+            error = e
+        except (urllib.error.URLError, TimeoutError) as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            error = e
+        delay = 2 ** attempt
+        print(f"{endpoint} failed ({error}); retrying in {delay} seconds...")
+        time.sleep(delay)
+
+
+def search_pubmed(search_term, throttle, modified_since=None):
+    """Run the search on the History server; returns (count, WebEnv, query_key)."""
+    # The History server keeps the PMIDs in relevance order, so max_results keeps the most relevant ones
+    params = {"db": "pubmed", "term": search_term, "usehistory": "y", "retmax": 0, "retmode": "json",
+              "sort": "relevance"}
+    if modified_since:
+        # Only records added or revised since the last completed run
+        params.update({"datetype": "mdat", "mindate": modified_since,
+                       "maxdate": date.today().strftime("%Y/%m/%d")})
+    result = json.loads(eutils_request("esearch.fcgi", params, throttle))["esearchresult"]
+    return int(result["count"]), result["webenv"], result["querykey"]
+
+
+def fetch_id_list(count, webenv, query_key, throttle, max_results=None):
+    """Page the PMIDs of a stored search out of the History server."""
+    total = min(count, max_results) if max_results else count
+    pmids = []
+    for retstart in range(0, total, ID_PAGE_SIZE):
+        text = eutils_request("efetch.fcgi", {
+            "db": "pubmed", "WebEnv": webenv, "query_key": query_key, "rettype": "uilist",
+            "retmode": "text", "retstart": retstart, "retmax": min(ID_PAGE_SIZE, total - retstart)
+        }, throttle)
+        pmids.extend(line.strip() for line in text.decode('utf-8').splitlines() if line.strip())
+    return pmids
+
+
+def write_abstract(download_path, pubmed_id, abstract_text):
+    filename = os.path.join(download_path, f"PMID_{pubmed_id}_abstract.txt")
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write(abstract_text)
+
+
+def download_batch(pmids, throttle):
+    """Fetch one batch of MEDLINE records; returns (PMID, abstract) pairs."""
+    text = eutils_request("efetch.fcgi", {
+        "db": "pubmed", "id": ",".join(pmids), "rettype": "medline", "retmode": "text"
+    }, throttle)
+    return [(record.get("PMID", "No_PMID"), record.get("AB", "No abstract available"))
+            for record in Medline.parse(io.StringIO(text.decode('utf-8')))]
+
+
+def download_abstracts(search_term, download_path, max_results=None, batch_size=BATCH_SIZE, workers=WORKERS,
+                       packed=PACKED):
+    """Download abstracts for every PMID matching search_term that is missing or updated since the last run.
+
+    Batches are fetched concurrently within NCBI's rate limit and retried independently; PMIDs are only
+    recorded in the manifest once written, so a failed batch is picked up again by the next run. With
+    packed=True the abstracts are appended to download_path/abstracts.corpus (see abstract_corpus.py).
+    """
+    throttle = RequestThrottle(10 if API_KEY else 3)
+    manifest = DownloadManifest(os.path.join(download_path, "download_manifest.sqlite"))
+    search_date = date.today().strftime("%Y/%m/%d")
+
+    count, webenv, query_key = search_pubmed(search_term, throttle)
+    pmids = fetch_id_list(count, webenv, query_key, throttle, max_results)
+    downloaded = manifest.downloaded()
+    needed = [pmid for pmid in pmids if pmid not in downloaded]
+
+    last_run = manifest.get("last_run")
+    if last_run and downloaded:
+        count, webenv, query_key = search_pubmed(search_term, throttle, modified_since=last_run)
+        updated = set(fetch_id_list(count, webenv, query_key, throttle)) & downloaded
+        needed.extend(sorted(updated))
+        print(f"{len(updated)} previously downloaded records were revised since {last_run}")
+
+    print(f"{len(pmids)} matching records, {len(needed)} to download")
+    batches = [needed[start:start + batch_size] for start in range(0, len(needed), batch_size)]
+    failed_batches = 0
+    fetched = 0
+    writer = CorpusWriter(os.path.join(download_path, "abstracts.corpus")) if packed else None
+    uncommitted = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(download_batch, batch, throttle): batch for batch in batches}
+            for future in as_completed(futures):
+                try:
+                    records = future.result()
+                except Exception as e:
+                    failed_batches += 1
+                    print(f"Batch starting at PMID {futures[future][0]} failed: {e}")
+                    continue
+                for pubmed_id, abstract_text in records:
+                    if writer is not None:
+                        writer.add(pubmed_id, abstract_text)
+                    else:
+                        write_abstract(download_path, pubmed_id, abstract_text)
+                written = [pubmed_id for pubmed_id, _ in records]
+                if writer is not None:
+                    # The corpus index is only committed at the end, so the manifest waits for it too
+                    uncommitted.extend(written)
+                else:
+                    manifest.record(written)
+                fetched += len(written)
+    finally:
+        if writer is not None:
+            writer.close()
+            manifest.record(uncommitted)
+
+    if not failed_batches:
+        manifest.set("last_run", search_date)
+    else:
+        print(f"{failed_batches} batches failed; rerun the script to fetch them")
+    return fetched
+
+
+if __name__ == "__main__":
+    # Define your expanded search term
+    search_term = (
+        '("inflammatory bowel disease" OR IBD OR "Crohn\'s disease" OR "ulcerative colitis" OR '
+        '"indeterminate colitis" OR "IBD-unclassified" OR "pouchitis" OR "colitis") AND '
+        '(genes OR proteins OR mRNA OR cytokines OR enzymes OR alleles OR SNP OR '
+        '"single nucleotide polymorphism" OR transcriptome OR proteome OR "gene expression" OR '
+        '"protein expression" OR "signaling pathway" OR "immune response" OR microbiome OR '
+        '"innate immunity" OR "adaptive immunity" OR "inflammatory markers") AND '
+        '("not associated" OR "no association" OR "lack of association" OR "unrelated" OR '
+        '"not correlated" OR "no correlation" OR "lack of correlation" OR '
+        '"not linked" OR "no link" OR "lack of link" OR '
+        '"not connected" OR "no connection" OR "lack of connection" OR '
+        '"not related" OR "unrelated" OR "lack of relation" OR '
+        '"no significant difference" OR "no significant association" OR '
+        '"no significant correlation" OR "not statistically significant" OR '
+        '"negative results" OR "inconclusive results" OR "no evidence" OR '
+        '"failed to show" OR "did not demonstrate" OR "not supported" OR '
+        '"no role" OR "does not play a role" OR "not involved" OR '
+        '"GWAS" OR "genome-wide association study" OR "meta-analysis" OR "systematic review")'
+    )
+
+    max_results = 100000  # Adjust based on how many results you want
+
+    # Specify the directory where you want to save the abstracts
+    download_path = ""  # Update this path to your desired folder
+
+    # Ensure the download directory exists
+    os.makedirs(download_path, exist_ok=True)
+
+    # Perform the search and download the abstracts
+    downloaded = download_abstracts(search_term, download_path, max_results)
+
+    print(f"Downloaded abstracts for {downloaded} articles.")
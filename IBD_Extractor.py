@@ -0,0 +1,200 @@
+import os
+import argparse
+import multiprocessing
+
+from llm_providers import PROVIDERS, make_provider
+from extraction_pipeline import ExtractionPipeline
+from response_cache import ResponseCache
+from results_store import ResultsStore
+from run_trace import RunTrace
+from entity_index import EntityIndex
+from abstract_packing import PACK_SIZE
+from abstract_corpus import open_corpus
+from shard_coordinator import (SHARD_SIZE, LEASE_SECONDS, open_coordinator, run_worker, merge, default_worker_id,
+                               requeue_dead_letters)
+from results_dataset import export_run
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Extract IBD non-associations from a directory or packed corpus of abstracts.")
+    parser.add_argument("abstracts", help="Directory containing PMID_<id>_abstract.txt files, or a packed corpus file")
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), default="anthropic")
+    parser.add_argument("--model", help="Model name (defaults to the provider's default model)")
+    parser.add_argument("--temperature", type=float, default=0)
+    parser.add_argument("--max-tokens", type=int, help="Output token limit per call (provider default if omitted)")
+    parser.add_argument("--combined-max-tokens", type=int, default=800,
+                        help="Output token limit for the combined strategy's single call")
+    parser.add_argument("--api-key", help="API key (defaults to the provider's environment variable)")
+    parser.add_argument("--base-url", help="Alternative API endpoint, e.g. a local test server")
+    parser.add_argument("--strategy", choices=["two_call", "combined"], default="two_call")
+    parser.add_argument("--prompt-style", choices=["claude", "gpt"],
+                        help="Prompt wording (defaults to the provider's usual style)")
+    parser.add_argument("--mode", choices=["sequential", "concurrent", "batch"], default="concurrent")
+    parser.add_argument("--concurrency", type=int, default=8, help="PMIDs in flight at once in concurrent mode")
+    parser.add_argument("--requests-per-minute", type=int, default=50)
+    parser.add_argument("--tokens-per-minute", type=int, default=40000)
+    parser.add_argument("--output", default="Results.csv", help="Tab-separated results file")
+    parser.add_argument("--summaries", default="Summaries.csv", help="Tab-separated summaries file ('' to skip)")
+    parser.add_argument("--batch-state", default="batch_state.json")
+    parser.add_argument("--store", help="Results checkpoint database (defaults to the output name with .sqlite)")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Append rows straight to the output TSVs instead of checkpointing them")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Attempts per PMID before it is left as failed")
+    parser.add_argument("--max-retries", type=int, default=6,
+                        help="Retries per call on 429, 5xx/overloaded or timeouts before the PMID is dead-lettered")
+    parser.add_argument("--retry-dead-letters", action="store_true",
+                        help="Requeue the PMIDs dead-lettered by earlier runs before processing")
+    parser.add_argument("--cache", default="response_cache.sqlite", help="Response cache database")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the response cache")
+    parser.add_argument("--bypass-cache", action="store_true", help="Ignore cached responses but store new ones")
+    parser.add_argument("--prefilter", action="store_true",
+                        help="Write 'none' rows for abstracts with no negation cue or gene/SNP mention without an LLM call")
+    parser.add_argument("--pack-tokens", type=int, default=0,
+                        help="Summarise several abstracts per request, up to this many abstract tokens "
+                             "(two_call strategy only)")
+    parser.add_argument("--pack-size", type=int, default=PACK_SIZE, help="Most abstracts in one packed request")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream JSON replies and close the stream as soon as the object is complete")
+    parser.add_argument("--entity-index",
+                        help="Alias index from entity_index.py; non-associations are written as HGNC symbols/rsIDs")
+    parser.add_argument("--cascade-model",
+                        help="Small model that extracts every PMID first; only escalated PMIDs reach --model")
+    parser.add_argument("--cascade-provider", choices=sorted(PROVIDERS),
+                        help="Provider of --cascade-model (defaults to --provider)")
+    parser.add_argument("--ensemble", nargs="+", default=[], metavar="PROVIDER:MODEL",
+                        help="Extra models that vote when the cascade's small and large models disagree")
+    parser.add_argument("--coordinator",
+                        help="Shared coordinator (a .sqlite file, or a directory on a shared filesystem) that "
+                             "splits the PMIDs into shards leased to every worker started with it")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes to start on this machine")
+    parser.add_argument("--worker-id", help="Name of this worker in the coordinator (defaults to host-pid)")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="PMIDs per shard")
+    parser.add_argument("--lease-seconds", type=int, default=LEASE_SECONDS,
+                        help="Seconds a shard stays leased without a heartbeat before another worker takes it")
+    parser.add_argument("--dataset", default="results_dataset",
+                        help="Columnar results dataset (Parquet) the run is added to; query it with results_dataset.py")
+    parser.add_argument("--run-name", help="Name of this run in the dataset (defaults to the output name)")
+    parser.add_argument("--no-dataset", action="store_true", help="Do not add the run to the results dataset")
+    parser.add_argument("--trace", help="JSONL trace of every call (defaults to the output name with _trace.jsonl)")
+    parser.add_argument("--report", help="JSON run report (defaults to the output name with _run_report.json)")
+    parser.add_argument("--no-trace", action="store_true", help="Do not write a trace or run report")
+    parser.add_argument("--verbose", action="store_true", help="Print every summary and extraction")
+    return parser
+
+
+def make_tier_provider(name, model, args):
+    """A cascade or ensemble model, sharing the main provider's settings (and its key and endpoint if it is
+    the same provider)."""
+    same_provider = name == args.provider
+    return make_provider(name, model=model, max_tokens=args.max_tokens, temperature=args.temperature,
+                         combined_max_tokens=args.combined_max_tokens,
+                         api_key=args.api_key if same_provider else None,
+                         base_url=args.base_url if same_provider else None)
+
+
+def make_pipeline(args, worker=None):
+    """The pipeline for a run, or for one shard worker (whose results stores are the shards' own)."""
+    provider_args = {"model": args.model, "max_tokens": args.max_tokens, "temperature": args.temperature,
+                     "combined_max_tokens": args.combined_max_tokens, "api_key": args.api_key,
+                     "base_url": args.base_url}
+    provider = make_provider(args.provider, **provider_args)
+    cascade_provider, ensemble_providers = None, []
+    if args.cascade_model:
+        cascade_provider = make_tier_provider(args.cascade_provider or args.provider, args.cascade_model, args)
+        for spec in args.ensemble:
+            name, _, model = spec.partition(":")
+            ensemble_providers.append(make_tier_provider(name, model or None, args))
+    response_cache = None if args.no_cache else ResponseCache(args.cache, bypass=args.bypass_cache)
+    results_store = None
+    if not args.no_store and worker is None:
+        results_store = ResultsStore(args.store or os.path.splitext(args.output)[0] + '.sqlite')
+    trace = None
+    if not args.no_trace:
+        output_stem = os.path.splitext(args.output)[0]
+        if worker is not None:
+            output_stem = os.path.join(open_coordinator(args.coordinator).shard_dir, worker)
+        trace = RunTrace(args.trace or output_stem + '_trace.jsonl', args.report or output_stem + '_run_report.json')
+    return ExtractionPipeline(
+        provider, args.output, args.summaries or None, strategy=args.strategy, prompt_style=args.prompt_style,
+        response_cache=response_cache, results_store=results_store, max_attempts=args.max_attempts,
+        concurrency=args.concurrency, max_retries=args.max_retries,
+        requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+        prefilter=args.prefilter, trace=trace, streaming=args.stream, pack_tokens=args.pack_tokens,
+        pack_size=args.pack_size, dataset=None if args.no_dataset else args.dataset, run_name=args.run_name,
+        entity_index=EntityIndex(args.entity_index) if args.entity_index else None,
+        cascade_provider=cascade_provider, ensemble_providers=ensemble_providers, verbose=args.verbose
+    )
+
+
+def run_shard_worker(args, worker):
+    """Extract shards from the coordinator until none are left."""
+    pipeline = make_pipeline(args, worker)
+    corpus = open_corpus(args.abstracts)
+    pipeline.start_trace(args.mode, len(corpus), coordinator=args.coordinator, worker=worker)
+    try:
+        shards = run_worker(pipeline, args.coordinator, corpus, args.mode, worker, args.shard_size,
+                            args.lease_seconds)
+    finally:
+        corpus.close()
+    print(f"Worker {worker} finished {len(shards)} shards")
+    if pipeline.dead_letters:
+        print(f"{len(pipeline.dead_letters)} PMIDs ran out of retries on transient errors and were dead-lettered; "
+              f"requeue them with 'python shard_coordinator.py {args.coordinator} --requeue-dead-letters'")
+    # The shard stores are closed and their dead letters reported above
+    pipeline.results_store = None
+    pipeline.dead_letters = []
+    pipeline.report()
+    if pipeline.trace is not None:
+        pipeline.trace.close()
+
+
+def run_sharded(args):
+    if args.no_store:
+        raise ValueError("Sharded runs checkpoint every shard in its own results store; drop --no-store")
+    worker = args.worker_id or default_worker_id()
+    if args.workers > 1:
+        processes = [multiprocessing.Process(target=run_shard_worker, args=(args, f"{worker}-{number}"))
+                     for number in range(args.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        run_shard_worker(args, worker)
+    # Whichever worker finds every shard done writes the merged output; the merge is deterministic, so
+    # several workers finishing together write the same file
+    try:
+        rows = merge(args.coordinator, args.output, args.summaries or None)
+    except ValueError as e:
+        print(f"Not merging yet: {e}. Merge later with 'python shard_coordinator.py {args.coordinator} "
+              f"--merge {args.output}'.")
+    else:
+        print(f"Merged {rows} rows from every shard into {args.output}")
+        if not args.no_dataset:
+            export_run(args.dataset, args.output, args.run_name, args.model or PROVIDERS[args.provider].default_model,
+                       args.temperature, args.strategy)
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.max_retries < 1:
+        parser.error("--max-retries must be at least 1")
+    if args.coordinator:
+        if args.retry_dead_letters:
+            print(f"Requeued {requeue_dead_letters(args.coordinator)} dead-lettered PMIDs")
+        run_sharded(args)
+        print("Processing complete.")
+        return
+    pipeline = make_pipeline(args)
+    if args.retry_dead_letters and pipeline.results_store is not None:
+        print(f"Requeued {pipeline.results_store.requeue_dead_letters()} dead-lettered PMIDs")
+    pipeline.run(args.abstracts, args.mode, args.batch_state)
+    pipeline.report()
+    if pipeline.trace is not None:
+        pipeline.trace.close()
+    print("Processing complete.")
+
+
+if __name__ == "__main__":
+    main()
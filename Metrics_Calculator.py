@@ -1,57 +1,188 @@
 import os
+import re
+import json
+import sqlite3
+import hashlib
 import pandas as pd
 import numpy as np
-from fuzzy_mark_2 import evaluate_llm_output_refined, normalize_and_split
+from concurrent.futures import ProcessPoolExecutor
+from fuzzywuzzy_script import ENTITY_MATCH_THRESHOLD, GoldStandard, evaluate_llm_output_refined
+from abstract_corpus import open_corpus
+from entity_index import EntityIndex
+from bootstrap_stats import paired_statistics
 
-def process_files(main_folder, gold_standard_path):
-    strategies = []
+METRICS = ['accuracy_ibd_type', 'accuracy_na', 'precision_na', 'recall_na', 'f1_score_na']
+COUNT_COLUMNS = ['tp', 'fp', 'fn', 'tn'] # Per-PMID confusion counts kept for every scored file
+REPLICATE_PATTERN = re.compile(r'_\d+\.csv$') # Replicate run files: Results_1.csv, Results_2.csv, ... any number of them
+
+_gold_standard = None # Normalised gold standard, built once in each worker process
+
+def _init_worker(gold_standard_df, entity_index=None):
+    global _gold_standard
+    _gold_standard = GoldStandard(gold_standard_df, entity_index)
+
+class FileScores:
+    # Scores of one run file: its metrics plus per-PMID confusion counts and IBD type similarities
+    # (in gold standard order), which are what the metrics are aggregated from
+    def __init__(self, metrics, counts, similarities):
+        self.metrics = metrics
+        self.counts = counts
+        self.similarities = similarities
+
+def score_file(file_path):
+    # Runs in a worker process; returns (FileScores, None) or (None, error message)
+    try:
+        llm_output_df = pd.read_csv(file_path, delimiter='\t', header=0)
+        results = evaluate_llm_output_refined(_gold_standard, llm_output_df)
+        per_pmid = results['per_pmid']
+        return FileScores({metric: float(results[metric]) for metric in METRICS},
+                          per_pmid[COUNT_COLUMNS].to_numpy(dtype=np.int32),
+                          per_pmid['ibd_type_similarity'].to_numpy(dtype=np.float64)), None
+    except Exception as e:
+        return None, str(e)
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def gold_standard_hash(gold_standard_df, entity_index=None):
+    # Covers the gold rows actually scored and the matching settings, so changing either invalidates the cache
+    payload = gold_standard_df.to_csv(sep='\t', index=False) + f"\nENTITY_MATCH_THRESHOLD={ENTITY_MATCH_THRESHOLD}"
+    if entity_index is not None:
+        payload += f"\nENTITY_INDEX={entity_index.fingerprint()}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class MetricsCache:
+    """Per-file scores keyed on the run file's content hash and the gold standard's hash.
+
+    Unchanged files are never rescored; renaming or moving a file keeps its entry, since the key is its content.
+    """
+
+    def __init__(self, path='metrics_cache.sqlite'):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            "file_hash TEXT NOT NULL, gold_hash TEXT NOT NULL, metrics TEXT NOT NULL, "
+            "counts BLOB NOT NULL, similarities BLOB NOT NULL, PRIMARY KEY (file_hash, gold_hash))"
+        )
+        self.conn.commit()
+
+    def get(self, file_hash, gold_hash):
+        row = self.conn.execute("SELECT metrics, counts, similarities FROM scores WHERE file_hash = ? AND gold_hash = ?",
+                                (file_hash, gold_hash)).fetchone()
+        if row is None:
+            return None
+        metrics, counts, similarities = row
+        return FileScores(json.loads(metrics), np.frombuffer(counts, dtype=np.int32).reshape(-1, len(COUNT_COLUMNS)),
+                          np.frombuffer(similarities, dtype=np.float64))
+
+    def put(self, file_hash, gold_hash, scores):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)",
+                              (file_hash, gold_hash, json.dumps(scores.metrics),
+                               scores.counts.tobytes(), scores.similarities.tobytes()))
+
+    def close(self):
+        self.conn.close()
+
+def find_run_files(main_folder):
+    # Sorted strategy folders, sorted temperature folders and {(strategy, temperature): [replicate files]}
+    def subfolders(path):
+        return sorted(name for name in os.listdir(path)
+                      if os.path.isdir(os.path.join(path, name)) and name != '__pycache__')
+
+    strategies = subfolders(main_folder)
     temperature_columns = []
-    metrics = ['accuracy_ibd_type', 'accuracy_na', 'precision_na', 'recall_na', 'f1_score_na']
-    results_data = {metric: [] for metric in metrics}
-    std_data = {f'{metric}_std': [] for metric in metrics}
+    run_files = {}
+    for strategy_folder in strategies:
+        strategy_path = os.path.join(main_folder, strategy_folder)
+        for temp_folder in subfolders(strategy_path):
+            temp_path = os.path.join(strategy_path, temp_folder)
+            if temp_folder not in temperature_columns:
+                temperature_columns.append(temp_folder)
+            run_files[(strategy_folder, temp_folder)] = [os.path.join(temp_path, file)
+                                                         for file in sorted(os.listdir(temp_path))
+                                                         if REPLICATE_PATTERN.search(file)]
+    return strategies, sorted(temperature_columns), run_files
 
+def process_files(main_folder, gold_standard_path, corpus_path=None, workers=None, cache_path='metrics_cache.sqlite',
+                  resamples=10000, entity_index_path=None):
     gold_standard_df = pd.read_csv(gold_standard_path, delimiter='\t', header=0)
+    if corpus_path:
+        # Only score the PMIDs whose abstracts are in the corpus that was extracted
+        corpus = open_corpus(corpus_path)
+        gold_standard_df = gold_standard_df[[str(pmid) in corpus for pmid in gold_standard_df['PMID']]]
+        corpus.close()
 
-    for strategy_folder in os.listdir(main_folder):
-        strategy_path = os.path.join(main_folder, strategy_folder)
-        if os.path.isdir(strategy_path) and strategy_folder != '__pycache__':
-            strategies.append(strategy_folder)
-            strategy_results = {metric: {} for metric in metrics}
-            strategy_stds = {metric: {} for metric in metrics}
-
-            for temp_folder in os.listdir(strategy_path):
-                temp_path = os.path.join(strategy_path, temp_folder)
-                if os.path.isdir(temp_path) and temp_folder != '__pycache__':
-                    temp_results = {metric: [] for metric in metrics}
-
-                    for file in os.listdir(temp_path):
-                        if file.endswith(('_1.csv', '_2.csv', '_3.csv')):
-                            file_path = os.path.join(temp_path, file)
-                            try:
-                                llm_output_df = pd.read_csv(file_path, delimiter='\t', header=0)
-                                results = evaluate_llm_output_refined(gold_standard_df, llm_output_df)
-                                for metric in metrics:
-                                    temp_results[metric].append(results[metric])
-                            except Exception as e:
-                                print(f"Error processing file {file_path}: {str(e)}")
-
-                    for metric in metrics:
-                        if temp_results[metric]:
-                            avg_result = np.mean(temp_results[metric])
-                            std_result = np.std(temp_results[metric])
-                            strategy_results[metric][temp_folder] = avg_result
-                            strategy_stds[metric][temp_folder] = std_result
-
-                    if temp_folder not in temperature_columns:
-                        temperature_columns.append(temp_folder)
-
-            for metric in metrics:
-                results_data[metric].append(strategy_results[metric])
-                std_data[f'{metric}_std'].append(strategy_stds[metric])
+    # Workers map the index themselves on first use; only its path is sent to them
+    entity_index = EntityIndex(entity_index_path) if entity_index_path else None
+
+    strategies, temperature_columns, run_files = find_run_files(main_folder)
+    file_paths = [file_path for files in run_files.values() for file_path in files]
+
+    # Files scored by an earlier run against the same gold standard come straight from the cache
+    cache = MetricsCache(cache_path) if cache_path else None
+    gold_hash = gold_standard_hash(gold_standard_df, entity_index)
+    file_hashes = {file_path: file_hash(file_path) for file_path in file_paths}
+    scores = {}
+    if cache is not None:
+        for file_path in file_paths:
+            cached = cache.get(file_hashes[file_path], gold_hash)
+            if cached is not None:
+                scores[file_path] = (cached, None)
+    to_score = [file_path for file_path in file_paths if file_path not in scores]
+
+    # Each worker normalises the gold standard once and only reads it; results come back in submission order
+    if to_score:
+        chunksize = max(1, len(to_score) // (8 * (workers or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(gold_standard_df, entity_index)) as executor:
+            for file_path, (result, error) in zip(to_score, executor.map(score_file, to_score, chunksize=chunksize)):
+                scores[file_path] = (result, error)
+                if cache is not None and error is None:
+                    cache.put(file_hashes[file_path], gold_hash, result)
+    if cache is not None:
+        print(f"Scored {len(to_score)} files, {len(file_paths) - len(to_score)} unchanged files taken from {cache_path}")
+        cache.close()
+
+    results_data = {metric: [] for metric in METRICS}
+    std_data = {f'{metric}_std': [] for metric in METRICS}
+    cell_names, cell_counts = [], []
+    for strategy_folder in strategies:
+        strategy_results = {metric: {} for metric in METRICS}
+        strategy_stds = {metric: {} for metric in METRICS}
+        for temp_folder in temperature_columns:
+            temp_results = {metric: [] for metric in METRICS}
+            temp_counts = []
+            for file_path in run_files.get((strategy_folder, temp_folder), []):
+                result, error = scores[file_path]
+                if error is not None:
+                    print(f"Error processing file {file_path}: {error}")
+                    continue
+                for metric in METRICS:
+                    temp_results[metric].append(result.metrics[metric])
+                temp_counts.append(result.counts[:, :3])
+            if temp_counts:
+                # Replicates are pooled per PMID, so comparisons stay paired on the gold PMIDs
+                cell_names.append(f"{strategy_folder}/{temp_folder}")
+                cell_counts.append(np.sum(temp_counts, axis=0))
+
+            for metric in METRICS:
+                if temp_results[metric]:
+                    strategy_results[metric][temp_folder] = np.mean(temp_results[metric])
+                    strategy_stds[metric][temp_folder] = np.std(temp_results[metric])
+
+        for metric in METRICS:
+            results_data[metric].append(strategy_results[metric])
+            std_data[f'{metric}_std'].append(strategy_stds[metric])
 
     # Create DataFrames for results and standard deviations
     result_dfs = {}
-    for metric in metrics:
+    for metric in METRICS:
         df = pd.DataFrame(results_data[metric], index=strategies, columns=temperature_columns)
         df.index.name = 'Strategy'
         result_dfs[metric] = df
@@ -64,14 +195,29 @@ def process_files(main_folder, gold_standard_path):
     for metric, df in result_dfs.items():
         df.to_csv(f'{metric}_results.csv')
 
+    # Bootstrap intervals per cell and paired permutation tests between every two cells
+    if resamples and cell_counts:
+        intervals, comparisons = paired_statistics(np.stack(cell_counts), cell_names, resamples)
+        intervals.to_csv('bootstrap_intervals.csv')
+        comparisons.to_csv('pairwise_tests.csv', index=False)
+        result_dfs['bootstrap_intervals'] = intervals
+        result_dfs['pairwise_tests'] = comparisons
+
     return result_dfs
 
-# Example usage
-main_folder = "" # Enter directory containing non-associations here
-gold_standard_path = 'gold_standard.csv' # Gold standard used for assessing 104 abstracts, change accordingly for your own gold standard
-results = process_files(main_folder, gold_standard_path)
+if __name__ == "__main__":
+    # Example usage
+    main_folder = "" # Enter directory containing non-associations here
+    gold_standard_path = 'gold_standard.csv' # Gold standard used for assessing 104 abstracts, change accordingly for your own gold standard
+    corpus_path = None # Optionally, the abstracts directory or packed corpus that was extracted, to score only its PMIDs
+    workers = None # Worker processes for the sweep; None uses every core
+    cache_path = 'metrics_cache.sqlite' # Per-file scores reused while the file and gold standard are unchanged; None to disable
+    resamples = 10000 # Bootstrap/permutation resamples for confidence intervals and pairwise tests; 0 to skip
+    entity_index_path = None # Optionally, an alias index built with entity_index.py, so synonyms match exactly
+    results = process_files(main_folder, gold_standard_path, corpus_path, workers, cache_path, resamples,
+                            entity_index_path)
 
-# Print summary of results
-for metric, df in results.items():
-    print(f"\n{metric}:")
-    print(df)
\ No newline at end of file
+    # Print summary of results
+    for metric, df in results.items():
+        print(f"\n{metric}:")
+        print(df)
\ No newline at end of file
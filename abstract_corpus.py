@@ -0,0 +1,223 @@
+import os
+import re
+import mmap
+import struct
+import argparse
+
+# A packed corpus is two files: <path> holds the UTF-8 abstracts back to back, and <path>.idx holds one
+# fixed-width (PMID, offset, length) record per abstract, sorted by PMID. Both are memory-mapped, so
+# a lookup is a binary search over the index and one slice of the data file; nothing is loaded up front.
+INDEX_RECORD = struct.Struct("<QQI")
+INDEX_SUFFIX = ".idx"
+
+
+def extract_pmid(filename):
+    pmid_match = re.search(r'\d+', filename)
+    if pmid_match:
+        return pmid_match.group(0)
+    print(f"No PMID found in filename {filename}. Skipping file.")
+    return None
+
+
+def _map(path):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class PackedCorpus:
+    """Read-only view of a packed corpus; PMIDs are strings, as everywhere else in the pipeline."""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = _map(path)
+        self.index = _map(path + INDEX_SUFFIX)
+        self.count = len(self.index) // INDEX_RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, position):
+        return INDEX_RECORD.unpack_from(self.index, position * INDEX_RECORD.size)
+
+    def _find(self, pmid):
+        try:
+            target = int(pmid)
+        except ValueError:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            entry = self._entry(low)
+            if entry[0] == target:
+                return entry
+        return None
+
+    def __contains__(self, pmid):
+        return self._find(pmid) is not None
+
+    def get(self, pmid):
+        entry = self._find(pmid)
+        if entry is None:
+            return None
+        _, offset, length = entry
+        return bytes(self.data[offset:offset + length]).decode('utf-8')
+
+    def pmids(self):
+        for position in range(self.count):
+            yield str(self._entry(position)[0])
+
+    def __iter__(self):
+        for position in range(self.count):
+            pmid, offset, length = self._entry(position)
+            yield str(pmid), bytes(self.data[offset:offset + length]).decode('utf-8')
+
+    def close(self):
+        for view in (self.data, self.index):
+            if isinstance(view, mmap.mmap):
+                view.close()
+
+
+class DirectoryCorpus:
+    """The original layout: one PMID_<id>_abstract.txt file per abstract anywhere under a directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        for root, dirs, files in os.walk(path):
+            for file in files:
+                if not file.endswith('.txt'):
+                    continue
+                pmid = extract_pmid(file)
+                if pmid:
+                    self.files[pmid] = os.path.join(root, file)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, pmid):
+        return pmid in self.files
+
+    def get(self, pmid):
+        if pmid not in self.files:
+            return None
+        with open(self.files[pmid], 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def pmids(self):
+        return iter(self.files)
+
+    def __iter__(self):
+        for pmid in self.files:
+            yield pmid, self.get(pmid)
+
+    def close(self):
+        pass
+
+
+def open_corpus(path):
+    """Open a packed corpus file or a directory of *_abstract.txt files behind the same interface."""
+    if os.path.isdir(path):
+        return DirectoryCorpus(path)
+    return PackedCorpus(path)
+
+
+class CorpusWriter:
+    """Append abstracts to a packed corpus, creating it if needed.
+
+    Adding a PMID that is already present replaces it (the old bytes stay in the data file until the
+    corpus is repacked). The index is only rewritten, atomically, by commit()/close(), so readers and
+    an interrupted writer always see the last committed state.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path + INDEX_SUFFIX):
+            with open(path + INDEX_SUFFIX, 'rb') as file:
+                for pmid, offset, length in INDEX_RECORD.iter_unpack(file.read()):
+                    self.entries[pmid] = (offset, length)
+        self.data = open(path, 'ab')
+        self.offset = self.data.tell()
+
+    def add(self, pmid, text):
+        encoded = text.encode('utf-8')
+        self.data.write(encoded)
+        self.entries[int(pmid)] = (self.offset, len(encoded))
+        self.offset += len(encoded)
+
+    def commit(self):
+        self.data.flush()
+        os.fsync(self.data.fileno())
+        tmp_path = self.path + INDEX_SUFFIX + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            for pmid in sorted(self.entries):
+                file.write(INDEX_RECORD.pack(pmid, *self.entries[pmid]))
+        os.replace(tmp_path, self.path + INDEX_SUFFIX)
+
+    def close(self):
+        self.commit()
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def pack(source, path):
+    """Write every abstract from source (a directory or another packed corpus) into a fresh packed corpus."""
+    for stale in (path, path + INDEX_SUFFIX):
+        if os.path.isfile(stale):
+            os.remove(stale)
+    corpus = open_corpus(source)
+    with CorpusWriter(path) as writer:
+        for pmid, abstract in corpus:
+            writer.add(pmid, abstract)
+    corpus.close()
+    return len(writer.entries)
+
+
+def unpack(path, directory):
+    os.makedirs(directory, exist_ok=True)
+    corpus = PackedCorpus(path)
+    for pmid, abstract in corpus:
+        with open(os.path.join(directory, f"PMID_{pmid}_abstract.txt"), 'w', encoding='utf-8') as file:
+            file.write(abstract)
+    corpus.close()
+    return len(corpus)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert between an abstracts directory and a packed corpus.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_parser = commands.add_parser("pack", help="Pack a directory of *_abstract.txt files (or repack a corpus)")
+    pack_parser.add_argument("source")
+    pack_parser.add_argument("corpus")
+    unpack_parser = commands.add_parser("unpack", help="Write a packed corpus back out as *_abstract.txt files")
+    unpack_parser.add_argument("corpus")
+    unpack_parser.add_argument("directory")
+    show_parser = commands.add_parser("show", help="Print the abstract for one or more PMIDs")
+    show_parser.add_argument("corpus")
+    show_parser.add_argument("pmids", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        print(f"Packed {pack(args.source, args.corpus)} abstracts into {args.corpus}")
+    elif args.command == "unpack":
+        print(f"Wrote {unpack(args.corpus, args.directory)} abstracts to {args.directory}")
+    else:
+        corpus = open_corpus(args.corpus)
+        for pmid in args.pmids:
+            print(f"PMID {pmid}:\n{corpus.get(pmid)}\n")
+
+
+if __name__ == "__main__":
+    main()
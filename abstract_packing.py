@@ -0,0 +1,85 @@
+import re
+from dataclasses import replace
+
+from rate_limiter import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to the ~4 characters per token estimate without tiktoken
+    tiktoken = None
+
+# Packing puts several short abstracts into one summary request, so the role preamble and the objective
+# are sent once per pack instead of once per abstract. Abstracts are added to a pack, in PMID order, until
+# the next one would take its counted tokens over the budget or the pack holds max_pmids abstracts. Each
+# abstract in the prompt and each summary in the reply is headed by a "### PMID <id>" line; a summary
+# whose heading is missing, repeated or empty, or that was cut off at max_tokens, is left out so the PMID
+# falls back to a summary request of its own.
+PACK_TOKENS = 3000  # Abstract tokens per packed request
+PACK_SIZE = 8  # Abstracts per packed request
+SECTION_HEADING = re.compile(r"^[ \t#*]*PMID[ \t:]*(\d+)[ \t#*:]*$", re.MULTILINE)
+
+_encodings = {}
+
+
+def count_tokens(text, model=None):
+    """Tokens in text: exact for OpenAI models and close for Claude with tiktoken, otherwise estimated."""
+    if tiktoken is None:
+        return estimate_tokens(text)
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except (KeyError, TypeError):
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return max(1, len(_encodings[model].encode(text, disallowed_special=())))
+
+
+def pack_abstracts(abstracts, token_budget=PACK_TOKENS, max_pmids=PACK_SIZE, model=None, alone=None):
+    """Group (pmid, abstract) pairs into packs: lists of (pmid, abstract, tokens) within the budget.
+
+    An abstract over the budget on its own is a pack of one, and so is one for which alone(pmid, abstract)
+    is true; the pack being filled stays open past it.
+    """
+    pack, pack_tokens = [], 0
+    for pmid, abstract in abstracts:
+        if alone is not None and alone(pmid, abstract):
+            yield [(pmid, abstract, None)]
+            continue
+        tokens = count_tokens(abstract, model)
+        if pack and (pack_tokens + tokens > token_budget or len(pack) >= max_pmids):
+            yield pack
+            pack, pack_tokens = [], 0
+        pack.append((pmid, abstract, tokens))
+        pack_tokens += tokens
+    if pack:
+        yield pack
+
+
+def split_summaries(text, pmids, truncated=False):
+    """{pmid: summary} for each PMID in the pack with exactly one non-empty section in a packed reply."""
+    headings = list(SECTION_HEADING.finditer(text or ""))
+    sections = {}
+    repeated = set()
+    for number, heading in enumerate(headings):
+        end = headings[number + 1].start() if number + 1 < len(headings) else len(text)
+        pmid = heading.group(1)
+        if pmid in sections:
+            repeated.add(pmid)
+        sections[pmid] = text[heading.end():end].strip()
+    if truncated and headings:
+        # The last section stopped at max_tokens
+        sections.pop(headings[-1].group(1), None)
+    return {pmid: sections[pmid] for pmid in pmids if sections.get(pmid) and pmid not in repeated}
+
+
+def share_usage(completion, weights):
+    """Split a packed call's Completion into one per weight, dividing its token counts in proportion."""
+    total = sum(weights) or 1
+    shares = [replace(completion) for _ in weights]
+    for field in ("input_tokens", "output_tokens", "cache_write_tokens", "cache_read_tokens"):
+        amount = getattr(completion, field)
+        parts = [amount * weight // total for weight in weights]
+        # Rounding leftovers go to the last share, so the shares add up to the call
+        parts[-1] += amount - sum(parts)
+        for share, part in zip(shares, parts):
+            setattr(share, field, part)
+    return shares
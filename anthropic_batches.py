@@ -0,0 +1,159 @@
+import os
+import json
+from time import sleep
+
+# The Message Batches API accepts at most 100,000 requests per batch
+MAX_BATCH_REQUESTS = 100000
+
+
+def load_batch_state(state_path):
+    if os.path.isfile(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def load_written(progress_path):
+    """(stage, PMID) pairs whose results were already written, from the progress file beside the state file."""
+    if not os.path.isfile(progress_path):
+        return set()
+    with open(progress_path, 'r', encoding='utf-8') as f:
+        return {tuple(line.rstrip("\n").split("\t", 1)) for line in f if "\t" in line}
+
+
+def save_batch_state(state_path, state):
+    # Write to a temporary file first so an interrupted run never leaves a truncated state file
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def submit_batches(client, prompts, model, max_tokens, temperature, system=None):
+    """Submit {pmid: prompt} as one or more batches and return their IDs."""
+    requests = []
+    for pmid, prompt in prompts.items():
+        params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+        if system:
+            params["system"] = system
+        requests.append({"custom_id": pmid, "params": params})
+
+    batch_ids = []
+    for start in range(0, len(requests), MAX_BATCH_REQUESTS):
+        batch = client.messages.batches.create(requests=requests[start:start + MAX_BATCH_REQUESTS])
+        print(f"Submitted batch {batch.id} with {len(requests[start:start + MAX_BATCH_REQUESTS])} requests")
+        batch_ids.append(batch.id)
+    return batch_ids
+
+
+def wait_for_batches(client, batch_ids, poll_interval=60):
+    for batch_id in batch_ids:
+        while True:
+            batch = client.messages.batches.retrieve(batch_id)
+            if batch.processing_status == "ended":
+                break
+            counts = batch.request_counts
+            print(f"Batch {batch_id} {batch.processing_status}: {counts.processing} processing, "
+                  f"{counts.succeeded} succeeded, {counts.errored} errored")
+            sleep(poll_interval)
+
+
+def collect_results(client, batch_ids, usage):
+    """Return {pmid: text} for every request in the batches; failed requests map to ""."""
+    texts = {}
+    for batch_id in batch_ids:
+        for entry in client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                message = entry.result.message
+                usage["input_tokens"] += message.usage.input_tokens
+                usage["output_tokens"] += message.usage.output_tokens
+                usage["cache_creation_input_tokens"] += message.usage.cache_creation_input_tokens or 0
+                usage["cache_read_input_tokens"] += message.usage.cache_read_input_tokens or 0
+                texts[entry.custom_id] = message.content[0].text if message.content else ""
+            else:
+                print(f"Batch request for PMID {entry.custom_id} {entry.result.type}")
+                texts[entry.custom_id] = ""
+    return texts
+
+
+def run_stage(client, state, state_path, stage, prompts, model, max_tokens, temperature, system,
+              poll_interval, usage):
+    stage_state = state.get(stage)
+    if stage_state is None:
+        stage_state = {"batch_ids": submit_batches(client, prompts, model, max_tokens, temperature, system)}
+        state[stage] = stage_state
+        save_batch_state(state_path, state)
+    else:
+        print(f"Resuming {stage} stage: polling {', '.join(stage_state['batch_ids'])}")
+
+    wait_for_batches(client, stage_state["batch_ids"], poll_interval)
+    return collect_results(client, stage_state["batch_ids"], usage)
+
+
+def run_batch_pipeline(client, abstracts, generate_summary_prompt, generate_extraction_prompt,
+                       on_summary, on_extraction, state_path, model, max_tokens, temperature,
+                       system=None, poll_interval=60):
+    """Run the summary stage as batches, then the extraction stage built from the returned summaries.
+
+    abstracts maps PMID to abstract text and system is the system prompt sent with every request.
+    on_summary(pmid, summary) and on_extraction(pmid, ibd_info) write the outputs; a request that failed is
+    passed to them as "". Submitted batch IDs are kept in state_path, so a rerun after an interruption
+    resumes polling instead of submitting again, and each PMID is logged to state_path.written once its
+    result is written, so a rerun interrupted while writing skips the PMIDs already written instead of
+    writing them twice (at most the one being written when it stopped is repeated). Both files are
+    removed once both stages are written.
+    The client only needs the messages.batches interface, so it can point at a fake endpoint via base_url.
+    Returns the token usage reported for the batches.
+    """
+    state = load_batch_state(state_path)
+    usage = {"input_tokens": 0, "output_tokens": 0, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+    progress_path = state_path + '.written'
+    if "summary" not in state and os.path.isfile(progress_path):
+        # Left by a run that finished just before removing it
+        os.remove(progress_path)
+
+    if "summary" not in state and not abstracts:
+        print("No abstracts left to process.")
+        return usage
+
+    written = load_written(progress_path)
+    progress = open(progress_path, 'a', encoding='utf-8')
+
+    def write_once(stage, write, results):
+        for pmid, text in results.items():
+            if (stage, pmid) in written:
+                continue
+            write(pmid, text)
+            progress.write(f"{stage}\t{pmid}\n")
+            progress.flush()
+
+    summary_prompts = {} if "summary" in state else {
+        pmid: generate_summary_prompt(abstract) for pmid, abstract in abstracts.items()}
+    try:
+        summaries = run_stage(client, state, state_path, "summary", summary_prompts,
+                              model, max_tokens, temperature, system, poll_interval, usage)
+        if not state["summary"].get("written"):
+            write_once("summary", on_summary, summaries)
+            state["summary"]["written"] = True
+            save_batch_state(state_path, state)
+
+        extraction_prompts = {pmid: generate_extraction_prompt(summary)
+                              for pmid, summary in summaries.items() if summary}
+        if extraction_prompts or "extraction" in state:
+            extractions = run_stage(client, state, state_path, "extraction", extraction_prompts,
+                                    model, max_tokens, temperature, system, poll_interval, usage)
+            if not state["extraction"].get("written"):
+                write_once("extraction", on_extraction, extractions)
+                state["extraction"]["written"] = True
+                save_batch_state(state_path, state)
+    finally:
+        progress.close()
+
+    os.remove(state_path)
+    os.remove(progress_path)
+    return usage
@@ -0,0 +1,118 @@
+"""Run batch mode end to end against mock_llm_server.py's fake Message Batches endpoint.
+
+Usage: python benchmarks/batch_benchmark.py [--batch-latency 2] [--error-rate 0.05]
+
+Extracts the abstracts with ExtractionPipeline.process_documents_batch (summary batch, then extraction batch,
+polled every --poll-interval seconds), then runs it again on the same results store to check that nothing is
+resubmitted, and finally extracts the same abstracts in concurrent mode with the mock provider (whose canned
+replies the server also sends) to check that both modes write the same rows. Reports wall time, batches and
+batch requests submitted, tokens and the extracted/failed counts. With --error-rate, the rerun resubmits the
+PMIDs whose requests errored.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+import contextlib
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from abstract_corpus import open_corpus
+from llm_providers import make_provider
+from extraction_pipeline import ExtractionPipeline
+from results_store import ResultsStore
+from throughput_benchmark import free_port, server_stats
+
+
+def start_server(args, port):
+    command = [sys.executable, os.path.join(REPO_DIR, "mock_llm_server.py"), "--port", str(port),
+               "--latency", "0", "--batch-latency", str(args.batch_latency), "--error-rate", str(args.error_rate),
+               "--seed", str(args.seed)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            server_stats(port)
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("mock_llm_server.py did not start")
+
+
+def run_batch(base_url, abstracts, workdir, max_attempts, poll_interval):
+    """One batch-mode pass over the abstracts into workdir's results store; returns the pipeline and seconds."""
+    provider = make_provider("anthropic", api_key="mock", base_url=base_url)
+    store = ResultsStore(os.path.join(workdir, "Batch_Results.sqlite"))
+    pipeline = ExtractionPipeline(provider, os.path.join(workdir, "Batch_Results.csv"), results_store=store,
+                                  max_attempts=max_attempts)
+    corpus = open_corpus(abstracts)
+    start = time.perf_counter()
+    try:
+        pipeline.process_documents_batch(corpus, os.path.join(workdir, "batch_state.json"), poll_interval)
+    finally:
+        corpus.close()
+    store.export_tsv(pipeline.output_csv)
+    return pipeline, time.perf_counter() - start
+
+
+def read_rows(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return sorted(file.read().splitlines()[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--abstracts", default=os.path.join(REPO_DIR, 'Abstracts'))
+    parser.add_argument("--batch-latency", type=float, default=2.0, help="Seconds before a mock batch ends")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of batch requests that error")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="batch_benchmark.json", help="Where to write the results")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_server(args, port)
+    base_url = f"http://127.0.0.1:{port}"
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir, open(os.devnull, 'w') as devnull:
+            for name in ("first_run", "rerun"):
+                before = server_stats(port)
+                with contextlib.redirect_stdout(devnull):
+                    pipeline, seconds = run_batch(base_url, args.abstracts, workdir, args.max_attempts,
+                                                  args.poll_interval)
+                after = server_stats(port)
+                counts = pipeline.results_store.counts()
+                results[name] = {"seconds": seconds, "batches": after["batches"] - before["batches"],
+                                 "batch_requests": after["batch_requests"] - before["batch_requests"],
+                                 "extracted": counts["extracted"], "failed": counts["failed"], **pipeline.usage}
+                print(f"{name}: {seconds:.1f}s, {results[name]['batches']} batches of "
+                      f"{results[name]['batch_requests']} requests, {counts['extracted']} extracted, "
+                      f"{counts['failed']} failed, {pipeline.usage['input_tokens']} input and "
+                      f"{pipeline.usage['output_tokens']} output tokens")
+
+            provider = make_provider("mock")
+            concurrent_csv = os.path.join(workdir, "Concurrent_Results.csv")
+            pipeline = ExtractionPipeline(provider, concurrent_csv, requests_per_minute=10 ** 9,
+                                          tokens_per_minute=10 ** 12)
+            with contextlib.redirect_stdout(devnull):
+                pipeline.run(args.abstracts, 'concurrent')
+            matches = read_rows(os.path.join(workdir, "Batch_Results.csv")) == read_rows(concurrent_csv)
+            results["matches_concurrent"] = matches
+            print(f"Batch rows {'match' if matches else 'differ from'} the concurrent run's")
+    finally:
+        server.terminate()
+        server.wait()
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump({"settings": vars(args), "results": results}, file, indent=2)
+    return 0 if args.error_rate or matches else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,117 @@
+"""Compare running the large model on every PMID with the small-model-first cascade (and optional ensemble).
+
+Usage: python benchmarks/cascade_benchmark.py --model claude-3-5-sonnet-20240620 --cascade-model claude-3-5-haiku-20241022
+
+For each configuration reports calls, p50/p95 latency and estimated cost per tier, wall time, and the
+gold-standard scores from fuzzywuzzy_script.py, so a cheaper cascade can be checked for lost recall. This makes
+real API calls unless --base-url points at mock_llm_server.py. No response cache is used, so every call is timed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from llm_providers import PROVIDERS, make_provider
+from extraction_pipeline import ExtractionPipeline
+from run_trace import RunTrace
+from entity_index import EntityIndex
+from fuzzywuzzy_script import evaluate_llm_output_refined
+
+METRICS = ['accuracy_ibd_type', 'accuracy_na', 'precision_na', 'recall_na', 'f1_score_na']
+
+
+def run_configuration(name, args, cascade_model=None, ensemble=()):
+    output_csv = os.path.join(args.output_dir, f"{name}_Results.csv")
+    summary_csv = os.path.join(args.output_dir, f"{name}_Summaries.csv")
+    for path in (output_csv, summary_csv):
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def provider_for(provider_name, model):
+        same_provider = provider_name == args.provider
+        return make_provider(provider_name, model=model, temperature=args.temperature,
+                             base_url=args.base_url if same_provider else None,
+                             api_key=args.api_key if same_provider else None)
+
+    ensemble_providers = []
+    for spec in ensemble:
+        provider_name, _, model = spec.partition(":")
+        ensemble_providers.append(provider_for(provider_name, model or None))
+    trace = RunTrace()
+    pipeline = ExtractionPipeline(
+        provider_for(args.provider, args.model), output_csv, summary_csv, strategy=args.strategy,
+        concurrency=args.concurrency, requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute, trace=trace,
+        cascade_provider=provider_for(args.provider, cascade_model) if cascade_model else None,
+        ensemble_providers=ensemble_providers
+    )
+    start = time.perf_counter()
+    pipeline.run(args.abstracts, args.mode)
+    wall_time = time.perf_counter() - start
+
+    summary = trace.summary()
+    row = {"configuration": name, "wall_seconds": wall_time, "cost_usd": summary["cost_usd"],
+           **{f"settled_{tier}": count for tier, count in pipeline.tiers.items()}}
+    for stage, stats in summary["stages"].items():
+        row[f"{stage} calls"] = sum(stats["calls"].values())
+        if "total" in stats:
+            row[f"{stage} p50"] = stats["total"]["p50"]
+            row[f"{stage} p95"] = stats["total"]["p95"]
+    return output_csv, row
+
+
+def score(output_csv, gold_standard_path, entity_index=None):
+    gold_standard_df = pd.read_csv(gold_standard_path, delimiter='\t', header=0, dtype={'PMID': str})
+    if os.path.isfile(output_csv):
+        llm_output_df = pd.read_csv(output_csv, delimiter='\t', header=0, dtype={'PMID': str})
+    else:
+        llm_output_df = pd.DataFrame(columns=['PMID', 'IBD Type', 'Non-Associations', 'Non-Association Types'])
+    return evaluate_llm_output_refined(gold_standard_df, llm_output_df, entity_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--abstracts", default=os.path.join(REPO_DIR, 'Abstracts'))
+    parser.add_argument("--gold-standard", default=os.path.join(REPO_DIR, 'gold_standard.csv'))
+    parser.add_argument("--output-dir", default='cascade_benchmark')
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), default="anthropic")
+    parser.add_argument("--model", help="Large model (the provider's default if omitted)")
+    parser.add_argument("--cascade-model", required=True, help="Small model run first in the cascade")
+    parser.add_argument("--ensemble", nargs="*", default=[], metavar="PROVIDER:MODEL",
+                        help="Also benchmark the cascade with these models voting on disputed PMIDs")
+    parser.add_argument("--strategy", choices=["two_call", "combined"], default="two_call")
+    parser.add_argument("--mode", choices=["sequential", "concurrent"], default="concurrent")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-minute", type=int, default=50)
+    parser.add_argument("--tokens-per-minute", type=int, default=40000)
+    parser.add_argument("--temperature", type=float, default=0)
+    parser.add_argument("--api-key")
+    parser.add_argument("--base-url")
+    parser.add_argument("--entity-index", help="Alias index from entity_index.py to score with")
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    entity_index = EntityIndex(args.entity_index) if args.entity_index else None
+
+    configurations = [("single", None, ()), ("cascade", args.cascade_model, ())]
+    if args.ensemble:
+        configurations.append(("cascade_ensemble", args.cascade_model, args.ensemble))
+    rows = []
+    for name, cascade_model, ensemble in configurations:
+        output_csv, row = run_configuration(name, args, cascade_model, ensemble)
+        scores = score(output_csv, args.gold_standard, entity_index)
+        row.update({metric: float(scores[metric]) for metric in METRICS})
+        rows.append(row)
+
+    report = pd.DataFrame(rows).set_index('configuration')
+    print(report.T.to_string())
+    with open(os.path.join(args.output_dir, 'benchmark.json'), 'w', encoding='utf-8') as f:
+        json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
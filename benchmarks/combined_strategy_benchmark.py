@@ -0,0 +1,93 @@
+"""Compare the two-call and combined strategies on the bundled abstracts.
+
+Usage: python benchmarks/combined_strategy_benchmark.py [--provider anthropic] [--model ...]
+
+This makes real API calls unless --provider mock is used. No response cache is used, so every call is timed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from llm_providers import PROVIDERS, make_provider
+from extraction_pipeline import ExtractionPipeline
+from abstract_corpus import open_corpus
+from fuzzywuzzy_script import evaluate_llm_output_refined
+
+STRATEGIES = ['two_call', 'combined']
+METRICS = ['accuracy_ibd_type', 'accuracy_na', 'precision_na', 'recall_na', 'f1_score_na']
+
+
+def run_strategy(provider, strategy, directory_path, output_dir):
+    output_csv = os.path.join(output_dir, f"{strategy}_Results.csv")
+    summary_csv = os.path.join(output_dir, f"{strategy}_Summaries.csv")
+    for path in (output_csv, summary_csv):
+        if os.path.isfile(path):
+            os.remove(path)
+    pipeline = ExtractionPipeline(provider, output_csv, summary_csv, strategy=strategy)
+
+    latencies = []
+    start = time.perf_counter()
+    corpus = open_corpus(directory_path)
+    for pmid in sorted(pipeline.pending_pmids(corpus)):
+        call_start = time.perf_counter()
+        pipeline.process_abstract(pmid, corpus.get(pmid))
+        latencies.append(time.perf_counter() - call_start)
+    wall_time = time.perf_counter() - start
+
+    usage = pipeline.usage
+    return output_csv, {
+        "strategy": strategy,
+        "pmids": len(latencies),
+        "wall_seconds": wall_time,
+        "latency_mean": float(np.mean(latencies)) if latencies else 0.0,
+        "latency_p50": float(np.percentile(latencies, 50)) if latencies else 0.0,
+        "latency_p95": float(np.percentile(latencies, 95)) if latencies else 0.0,
+        "input_tokens": usage["input_tokens"] + usage["cache_write_tokens"] + usage["cache_read_tokens"],
+        "output_tokens": usage["output_tokens"]
+    }
+
+
+def score(output_csv, gold_standard_path):
+    gold_standard_df = pd.read_csv(gold_standard_path, delimiter='\t', header=0, dtype={'PMID': str})
+    if os.path.isfile(output_csv):
+        llm_output_df = pd.read_csv(output_csv, delimiter='\t', header=0, dtype={'PMID': str})
+    else:
+        llm_output_df = pd.DataFrame(columns=['PMID', 'IBD Type', 'Non-Associations', 'Non-Association Types'])
+    # evaluate_llm_output_refined matches rows by PMID; PMIDs with no output row count as empty predictions
+    return evaluate_llm_output_refined(gold_standard_df, llm_output_df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--abstracts", default=os.path.join(REPO_DIR, 'Abstracts'))
+    parser.add_argument("--gold-standard", default=os.path.join(REPO_DIR, 'gold_standard.csv'))
+    parser.add_argument("--output-dir", default='combined_benchmark')
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), default="anthropic")
+    parser.add_argument("--model")
+    parser.add_argument("--temperature", type=float, default=0)
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    provider = make_provider(args.provider, model=args.model, temperature=args.temperature)
+
+    rows = []
+    for strategy in STRATEGIES:
+        output_csv, row = run_strategy(provider, strategy, args.abstracts, args.output_dir)
+        scores = score(output_csv, args.gold_standard)
+        row.update({metric: scores[metric] for metric in METRICS})
+        rows.append(row)
+
+    report = pd.DataFrame(rows).set_index('strategy')
+    print(report.T.to_string())
+    with open(os.path.join(args.output_dir, 'benchmark.json'), 'w', encoding='utf-8') as f:
+        json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Time the vectorised matcher in fuzzywuzzy_script.py against the previous loop-based implementation.
+
+Synthetic run files are generated by perturbing gold_standard.csv (IBD types swapped or misspelt,
+entities dropped, added or misspelt); both implementations score every file. The IBD type accuracy
+must agree; the non-association metrics differ by design, since the previous implementation counted
+min(len(gold), len(llm)) as true positives instead of matching entities one-to-one.
+
+    python benchmarks/fuzzy_matching_benchmark.py --files 200 --scale 10
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from fuzzywuzzy_script import GoldStandard, evaluate_llm_output_refined
+
+METRICS = ['accuracy_ibd_type', 'accuracy_na', 'precision_na', 'recall_na', 'f1_score_na']
+COMPARABLE_METRICS = ['accuracy_ibd_type']
+IBD_TYPES = ["IBD", "Crohn's Disease", "Ulcerative Colitis", "Colitis", "N/A", "Crohn's Disease; Ulcerative Colitis"]
+
+
+# The implementation this replaces, kept verbatim for comparison
+
+def legacy_normalize_and_split(text, delimiter=';'):
+    if pd.isna(text) or text.lower() in ['none', 'n/a']:
+        return []
+    text = str(text).lower()
+    text = re.sub(r'\([^)]*\)', '', text)
+    text = re.sub(r'[^a-zA-Z0-9\s;]', '', text)
+    return [item.strip() for item in text.split(delimiter) if item.strip()]
+
+
+def legacy_calculate_similarity(list1, list2, ratio):
+    if not list1 and not list2:
+        return 1.0
+    if not list1 or not list2:
+        return 0.0
+
+    similarities = []
+    for item1 in list1:
+        max_similarity = max(ratio(item1, item2) / 100 for item2 in list2)
+        similarities.append(max_similarity)
+
+    return sum(similarities) / len(list1)
+
+
+def legacy_evaluate(gold_standard_df, llm_output_df, ratio):
+    for df in [gold_standard_df, llm_output_df]:
+        df['ibd_types'] = df.iloc[:, 1].apply(legacy_normalize_and_split)
+        df['non_assoc'] = df.iloc[:, 2].apply(legacy_normalize_and_split)
+
+    similarities_ibd = [legacy_calculate_similarity(gold, llm, ratio)
+                        for gold, llm in zip(gold_standard_df['ibd_types'], llm_output_df['ibd_types'])]
+
+    tp_na = fp_na = tn_na = fn_na = 0
+    for gold, llm in zip(gold_standard_df['non_assoc'], llm_output_df['non_assoc']):
+        if not gold and not llm:
+            tn_na += 1
+        elif gold and llm:
+            tp_na += min(len(gold), len(llm))
+            fp_na += max(len(llm) - len(gold), 0)
+            fn_na += max(len(gold) - len(llm), 0)
+        elif gold:
+            fn_na += len(gold)
+        elif llm:
+            fp_na += len(llm)
+
+    accuracy_ibd_type = np.mean(similarities_ibd)
+    total_na = tp_na + fp_na + tn_na + fn_na
+    accuracy_na = (tp_na + tn_na) / total_na if total_na > 0 else 0
+    precision_na = tp_na / (tp_na + fp_na) if (tp_na + fp_na) > 0 else 0
+    recall_na = tp_na / (tp_na + fn_na) if (tp_na + fn_na) > 0 else 0
+    f1_score_na = 2 * (precision_na * recall_na) / (precision_na + recall_na) if (precision_na + recall_na) > 0 else 0
+    return {"accuracy_ibd_type": accuracy_ibd_type, "accuracy_na": accuracy_na, "precision_na": precision_na,
+            "recall_na": recall_na, "f1_score_na": f1_score_na}
+
+
+def misspell(rng, text):
+    if len(text) < 3:
+        return text
+    position = rng.randrange(len(text))
+    return text[:position] + text[position + 1:]
+
+
+def perturb(rng, gold_standard_df):
+    rows = []
+    for _, row in gold_standard_df.iterrows():
+        ibd_type = row.iloc[1]
+        if rng.random() < 0.2:
+            ibd_type = rng.choice(IBD_TYPES)
+        elif rng.random() < 0.2:
+            ibd_type = misspell(rng, str(ibd_type))
+        entities = [] if pd.isna(row.iloc[2]) or str(row.iloc[2]).lower() == 'none' else str(row.iloc[2]).split('; ')
+        entities = [misspell(rng, e) if rng.random() < 0.2 else e for e in entities if rng.random() > 0.15]
+        if rng.random() < 0.15:
+            entities.append(rng.choice(["TNF", "IL23R", "NOD2", "ATG16L1", "rs2241880"]))
+        rows.append({"PMID": row.iloc[0], "IBD Type": ibd_type,
+                     "Non-Associations": "; ".join(entities) or "none",
+                     "Non-Association Types": "; ".join("gene" for _ in entities) or "none"})
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--gold-standard", default=os.path.join(REPO_DIR, 'gold_standard.csv'))
+    parser.add_argument("--files", type=int, default=200, help="Number of synthetic run files to score")
+    parser.add_argument("--scale", type=int, default=1, help="Repeat the gold standard this many times")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        from fuzzywuzzy import fuzz as legacy_fuzz
+    except ImportError:
+        from rapidfuzz import fuzz as legacy_fuzz
+    ratio = legacy_fuzz.ratio
+
+    gold_standard_df = pd.read_csv(args.gold_standard, delimiter='\t', header=0)
+    # Scaled copies get distinct PMIDs, since outputs are matched to the gold standard by PMID
+    gold_standard_df = pd.concat([gold_standard_df.assign(PMID=gold_standard_df['PMID'] + copy * 10 ** 9)
+                                  for copy in range(args.scale)], ignore_index=True)
+    rng = random.Random(args.seed)
+    runs = [perturb(rng, gold_standard_df) for _ in range(args.files)]
+
+    start = time.perf_counter()
+    legacy = [legacy_evaluate(gold_standard_df.copy(), run.copy(), ratio) for run in runs]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gold_standard = GoldStandard(gold_standard_df)
+    current = [evaluate_llm_output_refined(gold_standard, run) for run in runs]
+    current_seconds = time.perf_counter() - start
+
+    difference = max(abs(old[metric] - new[metric])
+                     for old, new in zip(legacy, current) for metric in COMPARABLE_METRICS)
+    print(f"{args.files} files x {len(gold_standard_df)} gold rows")
+    print(f"Previous implementation: {legacy_seconds:.2f}s ({legacy_seconds / args.files * 1000:.1f} ms/file)")
+    print(f"Vectorised matcher:      {current_seconds:.2f}s ({current_seconds / args.files * 1000:.1f} ms/file)")
+    print(f"Speedup: {legacy_seconds / current_seconds:.1f}x")
+    print(f"Largest IBD type accuracy difference: {difference:.2e}")
+    for metric in METRICS[1:]:
+        print(f"Mean {metric}: previous {np.mean([old[metric] for old in legacy]):.3f}, "
+              f"entity-matched {np.mean([new[metric] for new in current]):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compare packed summary requests with one summary request per abstract, on cost and on accuracy.
+
+Usage: python benchmarks/packing_benchmark.py --pack-tokens 1500 3000 --replicates 3 [--provider anthropic]
+
+Each configuration is run --replicates times into
+<output-dir>/runs/<configuration>/<temperature>/Results_<n>.csv, the layout Metrics_Calculator.py reads, and
+scored with its process_files: mean/std per metric, bootstrap intervals and paired tests of every packed
+configuration against the unpacked one. Calls, tokens and wall time come from the run traces. This makes real
+API calls unless --base-url points at mock_llm_server.py.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from llm_providers import PROVIDERS, make_provider
+from extraction_pipeline import ExtractionPipeline
+from run_trace import RunTrace
+from Metrics_Calculator import process_files
+
+
+def run_configuration(name, pack_tokens, replicate, args):
+    run_dir = os.path.join(args.output_dir, 'runs', name, str(args.temperature))
+    os.makedirs(run_dir, exist_ok=True)
+    output_csv = os.path.join(run_dir, f"Results_{replicate}.csv")
+    summary_csv = os.path.join(args.output_dir, f"{name}_Summaries_{replicate}.csv")
+    for path in (output_csv, summary_csv):
+        if os.path.isfile(path):
+            os.remove(path)
+
+    provider = make_provider(args.provider, model=args.model, temperature=args.temperature,
+                             base_url=args.base_url, api_key=args.api_key)
+    trace = RunTrace()
+    pipeline = ExtractionPipeline(provider, output_csv, summary_csv, concurrency=args.concurrency,
+                                  requests_per_minute=args.requests_per_minute,
+                                  tokens_per_minute=args.tokens_per_minute, trace=trace, pack_tokens=pack_tokens,
+                                  pack_size=args.pack_size)
+    start = time.perf_counter()
+    pipeline.run(args.abstracts, args.mode)
+    wall_time = time.perf_counter() - start
+
+    summary = trace.summary()
+    summary_stages = [stage for stage in summary["stages"] if "summary" in stage]
+    return {
+        "configuration": name,
+        "replicate": replicate,
+        "wall_seconds": wall_time,
+        "summary_calls": sum(sum(summary["stages"][stage]["calls"].values()) for stage in summary_stages),
+        "calls": sum(sum(stats["calls"].values()) for stats in summary["stages"].values()),
+        "input_tokens": sum(pipeline.usage[field] for field in
+                            ("input_tokens", "cache_write_tokens", "cache_read_tokens")),
+        "output_tokens": pipeline.usage["output_tokens"],
+        "fallbacks": pipeline.packing["fallbacks"],
+        "cost_usd": summary["cost_usd"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--abstracts", default=os.path.join(REPO_DIR, 'Abstracts'))
+    parser.add_argument("--gold-standard", default=os.path.join(REPO_DIR, 'gold_standard.csv'))
+    parser.add_argument("--output-dir", default='packing_benchmark')
+    parser.add_argument("--pack-tokens", type=int, nargs="+", default=[1500, 3000],
+                        help="Abstract-token budgets per packed request to compare with unpacked runs")
+    parser.add_argument("--pack-size", type=int, default=8)
+    parser.add_argument("--replicates", type=int, default=3)
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), default="anthropic")
+    parser.add_argument("--model")
+    parser.add_argument("--temperature", type=float, default=0)
+    parser.add_argument("--mode", choices=["sequential", "concurrent"], default="concurrent")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-minute", type=int, default=50)
+    parser.add_argument("--tokens-per-minute", type=int, default=40000)
+    parser.add_argument("--api-key")
+    parser.add_argument("--base-url")
+    parser.add_argument("--resamples", type=int, default=10000, help="Bootstrap/permutation resamples")
+    args = parser.parse_args()
+    args.abstracts = os.path.abspath(args.abstracts)
+    args.gold_standard = os.path.abspath(args.gold_standard)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    configurations = [("unpacked", 0)] + [(f"packed_{tokens}", tokens) for tokens in args.pack_tokens]
+    rows = []
+    for replicate in range(1, args.replicates + 1):
+        for name, pack_tokens in configurations:
+            rows.append(run_configuration(name, pack_tokens, replicate, args))
+    runs = pd.DataFrame(rows).groupby('configuration', sort=False).mean(numeric_only=True).drop(columns='replicate')
+    print(runs.to_string())
+
+    # Metrics_Calculator writes its tables to the working directory
+    runs_dir = os.path.abspath(os.path.join(args.output_dir, 'runs'))
+    cwd = os.getcwd()
+    os.chdir(args.output_dir)
+    try:
+        results = process_files(runs_dir, args.gold_standard, args.abstracts, cache_path=None,
+                                resamples=args.resamples)
+    finally:
+        os.chdir(cwd)
+    column = str(args.temperature)
+    scores = pd.DataFrame({metric: results[metric][column] for metric in
+                           ('accuracy_ibd_type', 'precision_na', 'recall_na', 'f1_score_na')})
+    print(scores.to_string())
+    if 'pairwise_tests' in results:
+        tests = results['pairwise_tests']
+        unpacked = f"unpacked/{column}"
+        print(tests[(tests.iloc[:, 0] == unpacked) | (tests.iloc[:, 1] == unpacked)].to_string(index=False))
+    with open(os.path.join(args.output_dir, 'benchmark.json'), 'w', encoding='utf-8') as f:
+        json.dump({"runs": rows, "scores": scores.reset_index().to_dict(orient='records')}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Drive the full extraction pipeline against mock_llm_server.py and measure end-to-end throughput.
+
+Each concurrency level runs in a fresh process (so peak memory is per run) over the bundled abstracts or a
+synthetic packed corpus, against a local mock of the provider's API with the given latency distribution
+and 429/5xx injection. Reports PMIDs/sec, peak memory, retries and how many PMIDs ended extracted,
+failed or dead-lettered. With --baseline, a run that is more than --tolerance slower than the saved
+result for the same configuration, or extracts fewer PMIDs, fails the benchmark.
+
+    python benchmarks/throughput_benchmark.py --concurrency 1 8 32 --latency 0.2 --error-rate 0.02
+    python benchmarks/throughput_benchmark.py --synthetic 100000 --concurrency 64 128 --save-baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import tempfile
+import argparse
+import resource
+import subprocess
+import contextlib
+import urllib.request
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from abstract_corpus import open_corpus, CorpusWriter
+from llm_providers import make_provider
+from extraction_pipeline import ExtractionPipeline
+from results_store import ResultsStore
+from run_trace import RunTrace
+from mock_llm_server import DISTRIBUTIONS
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=5) as response:
+        return json.load(response)
+
+
+def start_server(args, port):
+    command = [sys.executable, os.path.join(REPO_DIR, "mock_llm_server.py"), "--port", str(port),
+               "--latency", str(args.latency), "--distribution", args.distribution, "--sigma", str(args.sigma),
+               "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+               "--requests-per-minute", str(args.server_rpm), "--max-concurrency", str(args.server_concurrency),
+               "--token-latency", str(args.token_latency), "--malformed-rate", str(args.malformed_rate),
+               "--truncate-rate", str(args.truncate_rate), "--seed", str(args.seed)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            server_stats(port)
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("mock_llm_server.py did not start")
+
+
+def synthetic_corpus(source, path, count, seed=0):
+    """Write count abstracts made of sentences drawn from the source abstracts, with PMIDs from 900000000."""
+    rng = random.Random(seed)
+    corpus = open_corpus(source)
+    sentences = [sentence.strip() + "." for _, abstract in corpus for sentence in abstract.split(". ")
+                 if sentence.strip()]
+    corpus.close()
+    with CorpusWriter(path) as writer:
+        for i in range(count):
+            writer.add(900000000 + i, " ".join(rng.choice(sentences) for _ in range(rng.randint(6, 14))))
+    return path
+
+
+def run_configuration(provider_name, base_url, corpus_path, concurrency, strategy, max_retries, streaming, workdir):
+    """One pipeline run in this (fresh) process; returns its measurements."""
+    provider = make_provider(provider_name, api_key="mock", base_url=base_url)
+    output_csv = os.path.join(workdir, f"Results_{concurrency}.csv")
+    store = ResultsStore(os.path.join(workdir, f"Results_{concurrency}.sqlite"))
+    trace = RunTrace()
+    pipeline = ExtractionPipeline(provider, output_csv, strategy=strategy, results_store=store,
+                                  concurrency=concurrency, requests_per_minute=10 ** 9, tokens_per_minute=10 ** 12,
+                                  max_retries=max_retries, retry_delay=0.5, trace=trace, streaming=streaming)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        pipeline.run(corpus_path, 'concurrent')
+        seconds = time.perf_counter() - start
+    summary = trace.summary()
+    counts = store.counts()
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024)
+    return {
+        "seconds": seconds,
+        "pmids_per_second": summary["pmids"].get("extracted", 0) / seconds if seconds > 0 else 0.0,
+        "peak_memory_mb": peak,
+        "extracted": counts["extracted"],
+        "failed": counts["failed"] - len(store.dead_letters()),
+        "dead_lettered": len(store.dead_letters()),
+        "retries": sum(stage["retries"] for stage in summary["stages"].values()),
+        "json_repaired": pipeline.repaired,
+        "json_rerequested": pipeline.rerequested,
+        "latency_p50": {name: stage.get("total", {}).get("p50") for name, stage in summary["stages"].items()},
+        "latency_p99": {name: stage.get("total", {}).get("p99") for name, stage in summary["stages"].items()}
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Names of configurations that regressed against the baseline."""
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        if result["pmids_per_second"] < previous["pmids_per_second"] * (1 - tolerance):
+            regressions.append(f"{key}: {result['pmids_per_second']:.1f} PMIDs/s, "
+                               f"baseline {previous['pmids_per_second']:.1f}")
+        if result["extracted"] < previous["extracted"]:
+            regressions.append(f"{key}: {result['extracted']} PMIDs extracted, baseline {previous['extracted']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--abstracts", default=os.path.join(REPO_DIR, 'Abstracts'))
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Benchmark a synthetic packed corpus of this many abstracts instead")
+    parser.add_argument("--provider", choices=["anthropic", "openai"], default="anthropic")
+    parser.add_argument("--strategy", choices=["two_call", "combined"], default="two_call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--max-retries", type=int, default=6)
+    parser.add_argument("--stream", action="store_true", help="Stream JSON replies (see ExtractionPipeline)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Median seconds per mock reply")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with a 5xx")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls answered with a 429")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Mock seconds per streamed token")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Fraction of JSON replies the mock fences, wraps in prose or gives a trailing comma")
+    parser.add_argument("--truncate-rate", type=float, default=0.0,
+                        help="Fraction of JSON replies the mock cuts off halfway")
+    parser.add_argument("--server-rpm", type=int, default=0, help="Mock server's requests/min limit (0: none)")
+    parser.add_argument("--server-concurrency", type=int, default=0,
+                        help="Requests the mock server handles at once before replying overloaded (0: no limit)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="throughput_benchmark.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed fractional drop in PMIDs/sec before a configuration counts as regressed")
+    parser.add_argument("--save-baseline", help="Also write the results to this baseline file")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_server(args, port)
+    base_url = f"http://127.0.0.1:{port}" + ("/v1" if args.provider == "openai" else "")
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            corpus_path, corpus_label = args.abstracts, os.path.basename(os.path.normpath(args.abstracts))
+            if args.synthetic:
+                print(f"Writing a synthetic corpus of {args.synthetic} abstracts...")
+                corpus_path = synthetic_corpus(args.abstracts, os.path.join(workdir, "synthetic.corpus"),
+                                               args.synthetic, args.seed)
+                corpus_label = f"synthetic{args.synthetic}"
+            for concurrency in args.concurrency:
+                before = server_stats(port)
+                # A fresh process per run keeps peak memory and interpreter state independent
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    result = pool.submit(run_configuration, args.provider, base_url, corpus_path, concurrency,
+                                         args.strategy, args.max_retries, args.stream, workdir).result()
+                after = server_stats(port)
+                result["server_requests"] = after["requests"] - before["requests"]
+                result["server_errors"] = {status: count - before["status"].get(status, 0)
+                                           for status, count in after["status"].items()
+                                           if status != "200" and count - before["status"].get(status, 0)}
+                key = (f"{args.provider}/{args.strategy}{'/stream' if args.stream else ''}/{corpus_label}"
+                       f"/concurrency={concurrency}")
+                results[key] = result
+                print(f"{key}: {result['pmids_per_second']:.1f} PMIDs/s, {result['seconds']:.1f}s, "
+                      f"peak {result['peak_memory_mb']:.0f} MB, {result['extracted']} extracted, "
+                      f"{result['failed']} failed, {result['dead_lettered']} dead-lettered, "
+                      f"{result['retries']} retries, {result['json_repaired']} JSON replies repaired, "
+                      f"{result['json_rerequested']} re-requested, server errors {result['server_errors'] or 'none'}")
+    finally:
+        server.terminate()
+        server.wait()
+
+    settings = {key: value for key, value in vars(args).items()
+                if key not in ("output", "baseline", "save_baseline", "tolerance")}
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({"settings": settings, "results": results}, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
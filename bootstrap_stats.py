@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+# Paired bootstrap confidence intervals and permutation tests over per-PMID confusion counts.
+# Every cell (strategy x temperature) is scored on the same gold PMIDs, so resampling and label swapping are
+# done per PMID and shared by all cells; each resample is one row of an index or sign matrix, and the
+# resampled totals for every cell come from a single matrix product rather than a Python loop per iteration.
+
+STAT_METRICS = ['precision_na', 'recall_na', 'f1_score_na']
+
+
+def metrics_from_counts(tp, fp, fn):
+    tp, fp, fn = (np.asarray(x, dtype=np.float64) for x in (tp, fp, fn))
+    precision = np.divide(tp, tp + fp, out=np.zeros_like(tp), where=(tp + fp) > 0)
+    recall = np.divide(tp, tp + fn, out=np.zeros_like(tp), where=(tp + fn) > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(tp), where=(precision + recall) > 0)
+    return {"precision_na": precision, "recall_na": recall, "f1_score_na": f1}
+
+
+def index_weights(index_matrix):
+    """Turn a (resamples, n) matrix of resampled row indices into per-row counts of each index."""
+    resamples, n = index_matrix.shape
+    flat = (index_matrix + n * np.arange(resamples)[:, None]).ravel()
+    return np.bincount(flat, minlength=resamples * n).reshape(resamples, n)
+
+
+def resampled_totals(counts, resamples, seed=0, chunk_elements=20_000_000):
+    """Bootstrap and sign-flip totals for every cell.
+
+    counts has shape (cells, pmids, 3) holding TP/FP/FN. Returns (bootstrap, swapped), each of shape
+    (resamples, cells, 3): bootstrap[r] sums the counts over resample r's PMIDs, and swapped[r] sums them over
+    the PMIDs whose labels permutation r swaps. Resamples are drawn in chunks of at most chunk_elements
+    matrix entries so memory stays bounded on large gold standards.
+    """
+    cells, n, _ = counts.shape
+    flat_counts = counts.transpose(1, 0, 2).reshape(n, cells * 3).astype(np.float64)
+    rng = np.random.default_rng(seed)
+    chunk = max(1, chunk_elements // max(n, 1))
+    bootstrap, swapped = [], []
+    for start in range(0, resamples, chunk):
+        size = min(chunk, resamples - start)
+        weights = index_weights(rng.integers(0, n, size=(size, n)))
+        signs = rng.integers(0, 2, size=(size, n))
+        bootstrap.append((weights @ flat_counts).reshape(size, cells, 3))
+        swapped.append((signs @ flat_counts).reshape(size, cells, 3))
+    return np.concatenate(bootstrap), np.concatenate(swapped)
+
+
+def benjamini_hochberg(p_values):
+    p_values = np.asarray(p_values, dtype=np.float64)
+    if not len(p_values):
+        return p_values
+    order = np.argsort(p_values)
+    ranked = p_values[order] * len(p_values) / np.arange(1, len(p_values) + 1)
+    adjusted = np.minimum.accumulate(ranked[::-1])[::-1]
+    q_values = np.empty_like(adjusted)
+    q_values[order] = np.minimum(adjusted, 1.0)
+    return q_values
+
+
+def paired_statistics(counts, cell_names, resamples=10000, seed=0, confidence=0.95, pair_chunk=256):
+    """Bootstrap CIs for each cell and paired tests between every two cells.
+
+    counts: (cells, pmids, 3) TP/FP/FN per PMID in gold standard order, summed over a cell's replicates.
+    Returns (intervals, comparisons) DataFrames. For each pair of cells, {metric}_diff is cell_a minus
+    cell_b with its paired bootstrap interval, {metric}_p is the two-sided paired permutation p-value and
+    {metric}_q the Benjamini-Hochberg adjusted p-value across all pairs.
+    """
+    counts = np.asarray(counts)
+    alpha = (1 - confidence) / 2
+    totals = counts.sum(axis=1).astype(np.float64)
+    observed = metrics_from_counts(totals[:, 0], totals[:, 1], totals[:, 2])
+    bootstrap, swapped = resampled_totals(counts, resamples, seed)
+    boot_metrics = metrics_from_counts(bootstrap[..., 0], bootstrap[..., 1], bootstrap[..., 2])
+
+    intervals = pd.DataFrame(index=pd.Index(cell_names, name='Cell'))
+    for metric in STAT_METRICS:
+        lower, upper = np.quantile(boot_metrics[metric], [alpha, 1 - alpha], axis=0)
+        intervals[metric] = observed[metric]
+        intervals[f'{metric}_lower'] = lower
+        intervals[f'{metric}_upper'] = upper
+
+    first, second = np.triu_indices(len(cell_names), k=1)
+    comparisons = pd.DataFrame({"cell_a": [cell_names[i] for i in first],
+                                "cell_b": [cell_names[j] for j in second]})
+    results = {f'{metric}_{column}': np.empty(len(first)) for metric in STAT_METRICS
+               for column in ('diff', 'diff_lower', 'diff_upper', 'p')}
+    for start in range(0, len(first), pair_chunk):
+        a, b = first[start:start + pair_chunk], second[start:start + pair_chunk]
+        # Swapping a PMID's labels moves its counts from one cell to the other
+        moved = swapped[:, b] - swapped[:, a]
+        perm_a = metrics_from_counts(*(totals[a, k] + moved[..., k] for k in range(3)))
+        perm_b = metrics_from_counts(*(totals[b, k] - moved[..., k] for k in range(3)))
+        for metric in STAT_METRICS:
+            diff = observed[metric][a] - observed[metric][b]
+            boot_diff = boot_metrics[metric][:, a] - boot_metrics[metric][:, b]
+            perm_diff = perm_a[metric] - perm_b[metric]
+            chunk = slice(start, start + len(a))
+            results[f'{metric}_diff'][chunk] = diff
+            results[f'{metric}_diff_lower'][chunk], results[f'{metric}_diff_upper'][chunk] = \
+                np.quantile(boot_diff, [alpha, 1 - alpha], axis=0)
+            extreme = np.sum(np.abs(perm_diff) >= np.abs(diff) - 1e-12, axis=0)
+            results[f'{metric}_p'][chunk] = (extreme + 1) / (resamples + 1)
+    for metric in STAT_METRICS:
+        for column in ('diff', 'diff_lower', 'diff_upper', 'p'):
+            comparisons[f'{metric}_{column}'] = results[f'{metric}_{column}']
+        comparisons[f'{metric}_q'] = benjamini_hochberg(results[f'{metric}_p'])
+    return intervals, comparisons
@@ -0,0 +1,245 @@
+import os
+import re
+import csv
+import mmap
+import struct
+import hashlib
+import argparse
+
+# An entity index maps gene/protein names, symbols and SNP IDs to one canonical form: the HGNC approved
+# symbol, or the current rsID for a merged SNP. Like a packed corpus it is two files: <path> holds the
+# distinct canonical names back to back, and <path>.idx holds one fixed-width (alias hash, offset, length)
+# record per alias, sorted by hash. Both are memory-mapped when the first name is looked up, so opening an
+# index costs nothing and a lookup is an O(log n) binary search over the records. Aliases are stored as 64-bit
+# BLAKE2b hashes of their key (see alias_key), which keeps the index small; a collision between two of a
+# few million aliases is vanishingly unlikely.
+INDEX_RECORD = struct.Struct("<QQI")
+INDEX_SUFFIX = ".idx"
+
+GREEK_LETTERS = {"α": "alpha", "β": "beta", "γ": "gamma", "δ": "delta", "ε": "epsilon", "κ": "kappa"}
+NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]")
+PARENTHETICAL = re.compile(r"\(([^)]*)\)")
+RSID = re.compile(r"^rs\d+$")
+
+# HGNC columns in order of precedence: an alias claimed by two genes at the same level is ambiguous and is
+# left out, but an approved symbol always wins over another gene's alias
+HGNC_COLUMNS = ("symbol", "prev_symbol", "alias_symbol", "name", "prev_name", "alias_name")
+
+
+def alias_key(name):
+    """Lookup key for a name: lower case, Greek letters spelled out, everything but letters and digits dropped."""
+    name = name.lower()
+    for letter, spelled in GREEK_LETTERS.items():
+        name = name.replace(letter, spelled)
+    return NON_ALPHANUMERIC.sub("", name)
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), "little")
+
+
+def _map(path):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class EntityIndex:
+    """Read-only view of an entity index; the files are only mapped when the first name is looked up.
+
+    Pickling keeps just the path, so an index can be handed to worker processes, which map it themselves.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.index = None
+        self.count = 0
+        self.canonical_names = {}  # Extracted name -> canonical name or None, for names seen before
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def _open(self):
+        if self.index is None:
+            self.data = _map(self.path)
+            self.index = _map(self.path + INDEX_SUFFIX)
+            self.count = len(self.index) // INDEX_RECORD.size
+
+    def __len__(self):
+        self._open()
+        return self.count
+
+    def fingerprint(self):
+        """Changes whenever the index is rebuilt, for caches of results computed with it."""
+        stats = [os.stat(path) for path in (self.path, self.path + INDEX_SUFFIX)]
+        return ":".join(f"{stat.st_size}-{stat.st_mtime_ns}" for stat in stats)
+
+    def lookup_key(self, key):
+        """Canonical name for an alias key, or None."""
+        self._open()
+        target = key_hash(key)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if INDEX_RECORD.unpack_from(self.index, middle * INDEX_RECORD.size)[0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            alias, offset, length = INDEX_RECORD.unpack_from(self.index, low * INDEX_RECORD.size)
+            if alias == target:
+                return bytes(self.data[offset:offset + length]).decode('utf-8')
+        return None
+
+    def canonical(self, name):
+        """Canonical name for an extracted entity such as "interleukin-6 (IL-6)" or "RS 1234", or None.
+
+        The name is tried as written, without its parenthetical, and as the parenthetical alone. An rsID
+        is its own canonical form unless dbSNP merged it into another.
+        """
+        if name in self.canonical_names:
+            return self.canonical_names[name]
+        found = None
+        outer = PARENTHETICAL.sub(" ", name).strip()
+        for candidate in [name, outer] + PARENTHETICAL.findall(name):
+            key = alias_key(candidate)
+            if not key:
+                continue
+            found = self.lookup_key(key)
+            if found is None and RSID.match(key):
+                found = key
+            if found is not None:
+                break
+        self.canonical_names[name] = found
+        return found
+
+    def canonicalize_list(self, text, delimiter=';'):
+        """Replace each entity in a delimited Non-Associations cell with its canonical name where one is known."""
+        if not isinstance(text, str) or text.strip().lower() in ('', 'none', 'n/a'):
+            return text
+        items = [item.strip() for item in text.split(delimiter) if item.strip()]
+        return f"{delimiter} ".join(self.canonical(item) or item for item in items)
+
+    def close(self):
+        for view in (self.data, self.index):
+            if isinstance(view, mmap.mmap):
+                view.close()
+        self.data = self.index = None
+
+
+def _split_hgnc(value):
+    return [part.strip().strip('"') for part in value.split("|") if part.strip().strip('"')]
+
+
+def read_hgnc(path):
+    """(alias, canonical symbol, precedence) for every approved gene in an HGNC complete set TSV."""
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file, delimiter='\t'):
+            if row.get("status", "Approved") != "Approved":
+                continue
+            symbol = row["symbol"]
+            for precedence, column in enumerate(HGNC_COLUMNS):
+                for alias in _split_hgnc(row.get(column) or ""):
+                    yield alias, symbol, precedence
+
+
+def read_dbsnp_merges(path):
+    """(merged rsID, current rsID, precedence) from dbSNP's RsMergeArch.bcp (rsHigh first, rsCurrent seventh)."""
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 6 and fields[0].isdigit() and fields[6].isdigit():
+                yield f"rs{fields[0]}", f"rs{fields[6]}", 0
+
+
+def read_aliases(path):
+    """(alias, canonical name, precedence) from a two-column alias<TAB>canonical TSV; these override HGNC."""
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        for row in csv.reader(file, delimiter='\t'):
+            if len(row) >= 2 and row[0].strip() and not row[0].startswith("#"):
+                yield row[0].strip(), row[1].strip(), -1
+
+
+def build(path, sources):
+    """Write an entity index from (alias, canonical, precedence) iterables; returns (aliases, ambiguous)."""
+    best = {}
+    ambiguous = set()
+    for source in sources:
+        for alias, canonical, precedence in source:
+            key = alias_key(alias)
+            if not key:
+                continue
+            current = best.get(key)
+            if current is None or precedence < current[0]:
+                best[key] = (precedence, canonical)
+                ambiguous.discard(key)
+            elif precedence == current[0] and canonical != current[1]:
+                ambiguous.add(key)
+    for key in ambiguous:
+        del best[key]
+
+    offsets = {}
+    records = []
+    # Both files are written under temporary names and renamed into place, so a process that already has
+    # the old index mapped keeps reading the old files instead of bytes being rewritten underneath it
+    data_tmp_path = path + '.tmp'
+    with open(data_tmp_path, 'wb') as data:
+        for key, (_, canonical) in best.items():
+            if canonical not in offsets:
+                encoded = canonical.encode('utf-8')
+                offsets[canonical] = (data.tell(), len(encoded))
+                data.write(encoded)
+            records.append((key_hash(key), *offsets[canonical]))
+        data.flush()
+        os.fsync(data.fileno())
+    records.sort()
+    index_tmp_path = path + INDEX_SUFFIX + '.tmp'
+    with open(index_tmp_path, 'wb') as file:
+        for record in records:
+            file.write(INDEX_RECORD.pack(*record))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(data_tmp_path, path)
+    os.replace(index_tmp_path, path + INDEX_SUFFIX)
+    return len(records), len(ambiguous)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the alias index that maps gene, protein and SNP "
+                                                 "names to HGNC symbols and current rsIDs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="Build an index from offline HGNC/dbSNP dumps")
+    build_parser.add_argument("index")
+    build_parser.add_argument("--hgnc", help="HGNC complete set TSV (hgnc_complete_set.txt)")
+    build_parser.add_argument("--dbsnp-merges", help="dbSNP RsMergeArch.bcp mapping merged rsIDs to current ones")
+    build_parser.add_argument("--aliases", nargs="*", default=[],
+                              help="alias<TAB>canonical TSVs of extra names; these take precedence")
+    lookup_parser = commands.add_parser("lookup", help="Print the canonical name for each entity")
+    lookup_parser.add_argument("index")
+    lookup_parser.add_argument("names", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        sources = [read_aliases(path) for path in args.aliases]
+        if args.hgnc:
+            sources.append(read_hgnc(args.hgnc))
+        if args.dbsnp_merges:
+            sources.append(read_dbsnp_merges(args.dbsnp_merges))
+        if not sources:
+            parser.error("give at least one of --hgnc, --dbsnp-merges or --aliases")
+        aliases, ambiguous = build(args.index, sources)
+        print(f"Indexed {aliases} aliases into {args.index} ({ambiguous} ambiguous aliases left out)")
+    else:
+        index = EntityIndex(args.index)
+        for name in args.names:
+            print(f"{name}\t{index.canonical(name) or '(not found)'}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
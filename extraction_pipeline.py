@@ -0,0 +1,789 @@
+import os
+import csv
+import asyncio
+from dataclasses import dataclass
+from time import sleep, perf_counter
+
+from prompts import (role_prompt, generate_summary_prompt, generate_extraction_prompt, generate_combined_prompt,
+                     generate_packed_summary_prompt)
+from extraction_schema import EXTRACTION_SCHEMA, to_row
+from rate_limiter import AdaptiveRateLimiter, backoff_delay, exhausted_wait, estimate_tokens
+from llm_providers import Completion
+from anthropic_batches import run_batch_pipeline, load_batch_state
+from abstract_corpus import open_corpus
+from negation_prefilter import screen, prefiltered_row
+from json_repair import parse_json_object, UnrecoverableJSON
+from model_cascade import escalation_reason, disputed, vote
+from abstract_packing import PACK_SIZE, pack_abstracts, split_summaries, share_usage
+from results_dataset import export_run
+
+# Keys a two-call extraction reply must have; one without them was cut off or ignored the prompt
+EXTRACTION_KEYS = ("Non-Associations", "Non-Association Types")
+
+
+def write_to_csv(csv_filename, data):
+    file_exists = os.path.isfile(csv_filename)
+    with open(csv_filename, 'a', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=data.keys(), delimiter='\t', quotechar='"',
+                                quoting=csv.QUOTE_MINIMAL)
+        if not file_exists:
+            writer.writeheader()
+        writer.writerow(data)
+
+
+@dataclass
+class Extraction:
+    """One model's result for a PMID before it is written: the Results.csv row, or the error that stopped it.
+
+    summary is set when it is to be written along with the row.
+    """
+    row: dict = None
+    error: str = None
+    completion: Completion = None
+    summary: str = None
+    repaired: bool = False
+
+
+def read_processed_pmids(csv_filename):
+    processed_pmids = set()
+    if os.path.isfile(csv_filename):
+        with open(csv_filename, 'r', newline='', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile, delimiter='\t')
+            for row in reader:
+                processed_pmids.add(row['PMID'])
+    return processed_pmids
+
+
+def extraction_row(pmid, ibd_data):
+    """Turn the parsed extraction JSON into a Results.csv row."""
+    ibd_type = ibd_data.get("IBD Type", "N/A")
+    if isinstance(ibd_type, list):
+        ibd_type = "; ".join(ibd_type)
+    return {
+        "PMID": pmid,
+        "IBD Type": ibd_type,
+        "Non-Associations": "; ".join(ibd_data.get("Non-Associations", [])) or "none",
+        "Non-Association Types": "; ".join(ibd_data.get("Non-Association Types", [])) or "none"
+    }
+
+
+class ExtractionPipeline:
+    """Summary/extraction pipeline shared by every provider.
+
+    strategy is 'two_call' (summary request, then extraction from the summary) or 'combined'
+    (one structured request per PMID). Summaries go to summary_csv when it is given.
+
+    With a results_store, per-PMID progress, failures and token usage are checkpointed in it and
+    output_csv/summary_csv are exported from it at the end of each run; PMIDs that are extracted or
+    have failed max_attempts times are skipped. Without one, rows are appended to output_csv and
+    PMIDs already in it are skipped.
+
+    Calls that fail with a retryable error (429, 5xx/overloaded, timeouts; see Provider.classify_error)
+    are retried up to max_retries times, waiting for the server's retry-after when it sends one. In
+    concurrent mode an AdaptiveRateLimiter also narrows and widens the number of calls in flight from
+    the same signals. A PMID whose retries run out is dead-lettered in the results store (or listed in
+    self.dead_letters without one) for a later pass instead of counting against max_attempts; fatal
+    errors fail it straight away.
+
+    With prefilter=True, abstracts with no negation cue or no gene/SNP/protein mention (see
+    negation_prefilter.py) are written as 'none' rows without any LLM call.
+
+    With a trace (run_trace.RunTrace), every call's queue wait, time to first byte, latency, tokens,
+    retries and outcome, and every finished PMID, are written to its JSONL file; report() summarises them.
+
+    With an entity_index (entity_index.EntityIndex), extracted non-associations are written as their
+    canonical HGNC symbol or current rsID where the index knows them; other names are kept as written.
+
+    With a cascade_provider (a small, fast model), every PMID is extracted by it first and only escalated
+    to provider when it names candidate non-associations, needed its JSON repaired, or failed (see
+    model_cascade.py). When the two disagree, ensemble_providers also extract the PMID and the row is a
+    per-entity majority vote. Calls are traced as '<tier>:<stage>' with tiers small, large and ensemble,
+    and report() says how many PMIDs each tier settled. Cascade mode does not run in batch mode.
+
+    With pack_tokens set, the two-call strategy's summaries are requested for several PMIDs at once: pending
+    abstracts are packed, in PMID order, up to pack_tokens abstract tokens and pack_size PMIDs per request
+    (see abstract_packing.py), traced as stage 'packed_summary'. Each PMID's summary is cut out of the
+    reply by its heading and its extraction is requested on its own as usual; a PMID whose section is
+    missing or malformed falls back to its own summary request. Packing does not combine with the combined
+    strategy, cascade mode or batch mode.
+
+    JSON replies (the extraction and combined stages) are repaired locally when they have a code fence,
+    surrounding text, a trailing comma or a raw newline in a string (see json_repair.py). A reply that was
+    cut off mid-value or lacks a required key is re-requested once with max_tokens doubled, as stage
+    '<stage>_retry'. With streaming=True those replies are streamed and the stream is closed as soon as the
+    JSON object closes, so the model stops generating there.
+
+    With a dataset directory, run() also adds output_csv to that columnar results dataset once it is
+    exported, as run run_name (by default the output's stem, so a resumed run replaces its partition), one
+    row per PMID and non-associated entity with the model, temperature and strategy (see results_dataset.py).
+    A resume that changed nothing leaves the dataset as it was.
+    """
+
+    def __init__(self, provider, output_csv, summary_csv=None, strategy='two_call', system_prompt=None,
+                 prompt_style=None, response_cache=None, results_store=None, max_attempts=3, concurrency=8,
+                 requests_per_minute=50, tokens_per_minute=40000, max_retries=6, retry_delay=5, prefilter=False,
+                 trace=None, streaming=False, entity_index=None, cascade_provider=None, ensemble_providers=(),
+                 pack_tokens=0, pack_size=PACK_SIZE, dataset=None, run_name=None, verbose=False):
+        if max_retries < 1:
+            raise ValueError("max_retries is the number of tries per call and must be at least 1")
+        if pack_tokens and (strategy == 'combined' or cascade_provider is not None):
+            raise ValueError("Packing batches the two-call strategy's summaries; it does not combine with the "
+                             "combined strategy or cascade mode")
+        self.provider = provider
+        self.output_csv = output_csv
+        self.summary_csv = summary_csv
+        self.strategy = strategy
+        self.system_prompt = system_prompt
+        self.prompt_style = prompt_style or provider.prompt_style
+        self.fixed_prompt_style = prompt_style
+        self.response_cache = response_cache
+        self.results_store = results_store
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.prefilter = prefilter
+        self.trace = trace
+        self.streaming = streaming
+        self.entity_index = entity_index
+        self.cascade_provider = cascade_provider
+        self.ensemble_providers = list(ensemble_providers)
+        self.pack_tokens = pack_tokens
+        self.pack_size = pack_size
+        self.dataset = dataset
+        self.run_name = run_name
+        self.verbose = verbose
+        self.usage = {"input_tokens": 0, "output_tokens": 0, "cache_write_tokens": 0, "cache_read_tokens": 0}
+        self.prefiltered = 0
+        self.dead_letters = []
+        self.repaired = 0
+        self.rerequested = 0
+        self.tiers = {}
+        self.escalations = {}
+        self.packing = {"packs": 0, "packed": 0, "fallbacks": 0}
+        if results_store is not None and results_store.is_empty():
+            # Carry over PMIDs finished by earlier runs that wrote the TSVs directly
+            imported = results_store.import_tsv(output_csv, summary_csv)
+            if imported:
+                print(f"Imported {imported} existing results from {output_csv}")
+
+    # LLM calls
+
+    def cache_key(self, provider, prompt, structured, max_tokens=None):
+        if self.response_cache is None:
+            return None
+        max_tokens = max_tokens or provider.request_max_tokens(structured)
+        return self.response_cache.make_key(provider.model, max_tokens, provider.temperature,
+                                            self.system_prompt_for(provider), prompt)
+
+    def cached(self, cache_key):
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get(cache_key)
+
+    def record(self, cache_key, completion):
+        for key, value in completion.usage().items():
+            self.usage[key] += value
+        # A reply cut off at max_tokens is not cached: a hit comes back as a complete Completion, so a retry or
+        # rerun would accept the cut-off text instead of asking again
+        if self.response_cache is not None and completion.text and not completion.truncated:
+            self.response_cache.put(cache_key, completion.text)
+        return completion
+
+    def traced(self, provider, pmid, stage, outcome, completion, timing):
+        if self.trace is not None:
+            timing["total"] = perf_counter() - timing["total"]
+            self.trace.call(pmid, stage, provider.model, outcome, completion, **timing)
+        return completion
+
+    def chat(self, prompt, structured=False, pmid=None, stage=None, max_tokens=None, expect_json=False,
+             provider=None):
+        """Return the Completion for prompt; on failure its text is empty and error says why.
+
+        max_tokens overrides the provider's output limit; expect_json lets the reply be streamed. provider
+        defaults to the pipeline's own (the cascade and ensemble tiers pass theirs).
+        """
+        provider = provider or self.provider
+        # timing["total"] holds the start time until traced() turns it into the call's duration
+        timing = {"total": perf_counter(), "queue_wait": 0.0, "backoff": 0.0, "retries": 0}
+        cache_key = self.cache_key(provider, prompt, structured, max_tokens)
+        cached = self.cached(cache_key)
+        if cached is not None:
+            return self.traced(provider, pmid, stage, "cached", Completion(cached), timing)
+
+        call = provider.stream_json if self.streaming and expect_json else provider.complete
+        for attempt in range(self.max_retries):
+            call_start = perf_counter()
+            try:
+                completion = call(prompt, self.system_prompt_for(provider), structured, max_tokens)
+            except Exception as e:
+                retryable, retry_after = provider.classify_error(e)
+                if not retryable:
+                    print(f"Error in chat ({provider.name}): {str(e)}")
+                    return self.traced(provider, pmid, stage, "fatal", Completion("", error=str(e)), timing)
+                error = str(e)
+                if attempt < self.max_retries - 1:
+                    delay = backoff_delay(attempt, self.retry_delay, retry_after)
+                    print(f"Retryable error ({error}). Retrying in {delay:.1f} seconds...")
+                    sleep(delay)
+                    timing["backoff"] += delay
+                    timing["retries"] += 1
+                continue
+            timing["latency"] = perf_counter() - call_start
+            timing["ttfb"] = completion.ttfb
+            # Sequential calls have no window to narrow; just wait out an exhausted limit
+            wait = exhausted_wait(completion.rate_limits)
+            if wait > 0:
+                print(f"Rate limit exhausted. Waiting {wait:.1f} seconds for it to reset...")
+                sleep(wait)
+                timing["queue_wait"] += wait
+            return self.traced(provider, pmid, stage, "ok", self.record(cache_key, completion), timing)
+        print("Max retries reached. Skipping this request.")
+        completion = Completion("", error=f"retries exhausted: {error}", retryable=True)
+        return self.traced(provider, pmid, stage, "exhausted", completion, timing)
+
+    async def achat(self, limiter, prompt, structured=False, pmid=None, stage=None, max_tokens=None,
+                    expect_json=False, provider=None):
+        provider = provider or self.provider
+        timing = {"total": perf_counter(), "queue_wait": 0.0, "backoff": 0.0, "retries": 0}
+        cache_key = self.cache_key(provider, prompt, structured, max_tokens)
+        cached = self.cached(cache_key)
+        if cached is not None:
+            return self.traced(provider, pmid, stage, "cached", Completion(cached), timing)
+
+        call = provider.astream_json if self.streaming and expect_json else provider.acomplete
+        estimated = (estimate_tokens(self.system_prompt_for(provider) + prompt)
+                     + (max_tokens or provider.request_max_tokens(structured)))
+        for attempt in range(self.max_retries):
+            queued = perf_counter()
+            started = await limiter.acquire(estimated)
+            call_start = perf_counter()
+            timing["queue_wait"] += call_start - queued
+            try:
+                completion = await call(prompt, self.system_prompt_for(provider), structured, max_tokens)
+            except Exception as e:
+                retryable, retry_after = provider.classify_error(e)
+                if not retryable:
+                    print(f"Error in achat ({provider.name}): {str(e)}")
+                    return self.traced(provider, pmid, stage, "fatal", Completion("", error=str(e)), timing)
+                limiter.on_retryable_error(started, retry_after)
+                error = str(e)
+            else:
+                timing["latency"] = perf_counter() - call_start
+                timing["ttfb"] = completion.ttfb
+                limiter.on_success(completion.rate_limits)
+                limiter.record_usage(estimated, completion.input_tokens + completion.cache_write_tokens
+                                     + completion.cache_read_tokens + completion.output_tokens)
+                return self.traced(provider, pmid, stage, "ok", self.record(cache_key, completion), timing)
+            finally:
+                await limiter.release()
+            if attempt < self.max_retries - 1:
+                delay = backoff_delay(attempt, self.retry_delay, retry_after)
+                print(f"Retryable error ({error}). Retrying in {delay:.1f} seconds "
+                      f"({int(limiter.window)} calls in flight allowed)...")
+                await asyncio.sleep(delay)
+                timing["backoff"] += delay
+                timing["retries"] += 1
+        print("Max retries reached. Skipping this request.")
+        completion = Completion("", error=f"retries exhausted: {error}", retryable=True)
+        return self.traced(provider, pmid, stage, "exhausted", completion, timing)
+
+    @staticmethod
+    def unrecoverable(completion, required):
+        """Why a JSON reply cannot be repaired locally, or None if it can (or the call failed outright)."""
+        if not completion.text:
+            return None
+        try:
+            parse_json_object(completion.text, required)
+        except UnrecoverableJSON as e:
+            return str(e)
+        return None
+
+    def chat_json(self, prompt, required, structured=False, pmid=None, stage=None, provider=None):
+        """chat() for a reply that must be a JSON object with the required keys, re-requested once with a
+        larger token limit when it cannot be repaired locally."""
+        provider = provider or self.provider
+        completion = self.chat(prompt, structured, pmid, stage, expect_json=True, provider=provider)
+        problem = self.unrecoverable(completion, required)
+        if problem is None:
+            return completion
+        self.rerequested += 1
+        print(f"Unrecoverable JSON for PMID {pmid} ({problem}). Re-requesting with max_tokens raised...")
+        return self.chat(prompt, structured, pmid, f"{stage}_retry", 2 * provider.request_max_tokens(structured),
+                         expect_json=True, provider=provider)
+
+    async def achat_json(self, limiter, prompt, required, structured=False, pmid=None, stage=None,
+                         provider=None):
+        provider = provider or self.provider
+        completion = await self.achat(limiter, prompt, structured, pmid, stage, expect_json=True, provider=provider)
+        problem = self.unrecoverable(completion, required)
+        if problem is None:
+            return completion
+        self.rerequested += 1
+        print(f"Unrecoverable JSON for PMID {pmid} ({problem}). Re-requesting with max_tokens raised...")
+        return await self.achat(limiter, prompt, structured, pmid, f"{stage}_retry",
+                                2 * provider.request_max_tokens(structured), expect_json=True, provider=provider)
+
+    # Output; with a results store every write is one transaction, otherwise rows are appended to the TSVs
+
+    def begin(self, pmid):
+        """Start an attempt at pmid and return the summary kept from an earlier attempt, if any."""
+        if self.results_store is None:
+            return None
+        self.results_store.start(pmid)
+        state = self.results_store.get(pmid)
+        return state["summary"] or None
+
+    def write_summary(self, pmid, summary, completion=None):
+        if self.verbose:
+            print(f"LLM Summary for PMID {pmid}:\n{summary}\n")
+        if self.results_store is not None:
+            self.results_store.record_summary(pmid, summary, completion.usage() if completion else None)
+        elif self.summary_csv:
+            write_to_csv(self.summary_csv, {"PMID": pmid, "Summary": summary})
+
+    def write_row(self, pmid, row, completion=None, outcome="extracted"):
+        if self.entity_index is not None and outcome == "extracted":
+            row = {**row, "Non-Associations": self.entity_index.canonicalize_list(row["Non-Associations"])}
+        if self.results_store is not None:
+            self.results_store.record_extraction(pmid, row, completion.usage() if completion else None)
+        else:
+            write_to_csv(self.output_csv, row)
+        if self.trace is not None:
+            self.trace.pmid(pmid, outcome)
+        print(f"Processed PMID: {pmid}")
+
+    def write_failure(self, pmid, error, completion=None):
+        dead_letter = completion is not None and completion.retryable
+        print(f"{error} for PMID {pmid}. {'Dead-lettered for a later pass' if dead_letter else 'Skipping'}.")
+        if dead_letter:
+            self.dead_letters.append(pmid)
+        if self.results_store is not None:
+            self.results_store.record_failure(pmid, error, completion.usage() if completion else None, dead_letter)
+        if self.trace is not None:
+            self.trace.pmid(pmid, "dead_letter" if dead_letter else "failed")
+
+    def read_extraction(self, pmid, completion, combined=False, summary=None):
+        """Parse an extraction or combined reply into an Extraction, repairing its JSON if needed.
+
+        summary is a summary still to be written with the row; a combined reply carries its own.
+        """
+        if not completion.text:
+            return Extraction(error=f"Failed to extract IBD info ({completion.error})", completion=completion)
+        if self.verbose:
+            print(f"Extracted IBD Info for PMID {pmid}:\n{completion.text}\n")
+        required = EXTRACTION_SCHEMA["required"] if combined else EXTRACTION_KEYS
+        try:
+            parsed, repairs = parse_json_object(completion.text, required)
+        except UnrecoverableJSON as e:
+            return Extraction(error=f"JSON parsing error: {e}", completion=completion)
+        if repairs:
+            self.repaired += 1
+            if self.verbose:
+                print(f"Repaired JSON for PMID {pmid}: {', '.join(repairs)}")
+        if combined:
+            return Extraction(to_row(pmid, parsed), completion=completion, summary=parsed.get("summary", ""),
+                              repaired=bool(repairs))
+        return Extraction(extraction_row(pmid, parsed), completion=completion, summary=summary,
+                          repaired=bool(repairs))
+
+    def write_result(self, pmid, extraction):
+        if extraction.row is None:
+            self.write_failure(pmid, extraction.error, extraction.completion)
+            return
+        if extraction.summary is not None:
+            self.write_summary(pmid, extraction.summary)
+        self.write_row(pmid, extraction.row, extraction.completion)
+
+    def write_extraction(self, pmid, ibd_info):
+        """Write an extraction reply from batch mode ("" if its request failed)."""
+        completion = Completion(ibd_info, error=None if ibd_info else "batch request failed")
+        self.write_result(pmid, self.read_extraction(pmid, completion))
+
+    def add_usage(self, pmid, completion):
+        """Charge a call whose result is not written (a summary or an overruled cascade tier) to pmid."""
+        if self.results_store is not None and completion is not None:
+            self.results_store.add_usage(pmid, completion.usage())
+
+    # Per-PMID processing
+
+    def prescreen(self, pmid, abstract):
+        """Write a 'none' row straight away if the abstract cannot report a non-association; returns True if so."""
+        if not self.prefilter:
+            return False
+        reason = screen(abstract)
+        if reason is None:
+            return False
+        if self.verbose:
+            print(f"Pre-filter: {reason} in PMID {pmid}")
+        self.prefiltered += 1
+        self.write_row(pmid, prefiltered_row(pmid, abstract), outcome="prefiltered")
+        return True
+
+    def prompt_style_for(self, provider):
+        if provider is self.provider or self.fixed_prompt_style:
+            return self.prompt_style
+        return provider.prompt_style
+
+    def system_prompt_for(self, provider):
+        """The system prompt given to the pipeline, or else the role preamble of provider's prompt style."""
+        return self.system_prompt or role_prompt(self.prompt_style_for(provider))
+
+    def extract(self, pmid, abstract, summary=None, provider=None, tier=None):
+        """Run one model's calls for pmid and return its Extraction.
+
+        Outside a cascade (tier None) a new summary is checkpointed straight away; a cascade tier keeps it
+        in the Extraction, so only the tier that settles the PMID writes one.
+        """
+        provider = provider or self.provider
+        style = self.prompt_style_for(provider)
+        stage = f"{tier}:" if tier else ""
+        if self.strategy == 'combined':
+            completion = self.chat_json(generate_combined_prompt(abstract, style), EXTRACTION_SCHEMA["required"],
+                                        structured=True, pmid=pmid, stage=stage + "combined", provider=provider)
+            return self.read_extraction(pmid, completion, combined=True)
+
+        if summary is None:
+            completion = self.chat(generate_summary_prompt(abstract, style), pmid=pmid, stage=stage + "summary",
+                                   provider=provider)
+            if not completion.text:
+                return Extraction(error=f"Failed to generate summary ({completion.error})", completion=completion)
+            summary = completion.text
+            if tier is None:
+                self.write_summary(pmid, summary, completion)
+            else:
+                self.add_usage(pmid, completion)
+
+        completion = self.chat_json(generate_extraction_prompt(summary, style), EXTRACTION_KEYS, pmid=pmid,
+                                    stage=stage + "extraction", provider=provider)
+        return self.read_extraction(pmid, completion, summary=summary if tier else None)
+
+    async def extract_async(self, limiters, pmid, abstract, summary=None, provider=None, tier=None):
+        # Same stages as extract; the extraction still waits on this PMID's summary
+        provider = provider or self.provider
+        limiter = limiters[id(provider)]
+        style = self.prompt_style_for(provider)
+        stage = f"{tier}:" if tier else ""
+        if self.strategy == 'combined':
+            completion = await self.achat_json(limiter, generate_combined_prompt(abstract, style),
+                                               EXTRACTION_SCHEMA["required"], structured=True, pmid=pmid,
+                                               stage=stage + "combined", provider=provider)
+            return self.read_extraction(pmid, completion, combined=True)
+
+        if summary is None:
+            completion = await self.achat(limiter, generate_summary_prompt(abstract, style), pmid=pmid,
+                                          stage=stage + "summary", provider=provider)
+            if not completion.text:
+                return Extraction(error=f"Failed to generate summary ({completion.error})", completion=completion)
+            summary = completion.text
+            if tier is None:
+                self.write_summary(pmid, summary, completion)
+            else:
+                self.add_usage(pmid, completion)
+
+        completion = await self.achat_json(limiter, generate_extraction_prompt(summary, style), EXTRACTION_KEYS,
+                                           pmid=pmid, stage=stage + "extraction", provider=provider)
+        return self.read_extraction(pmid, completion, summary=summary if tier else None)
+
+    def escalate(self, small):
+        """Whether the small model's Extraction goes to the large model; counts the reason."""
+        reason = escalation_reason(small)
+        if reason is not None:
+            self.escalations[reason] = self.escalations.get(reason, 0) + 1
+        return reason is not None
+
+    def settle(self, pmid, tier, chosen, *overruled):
+        """Count the tier that settled pmid and charge the overruled tiers' calls to it; returns chosen."""
+        self.tiers[tier] = self.tiers.get(tier, 0) + 1
+        for extraction in overruled:
+            self.add_usage(pmid, extraction.completion)
+        return chosen
+
+    def settle_vote(self, pmid, large, small, votes):
+        rows = [extraction.row for extraction in [large, small] + votes if extraction.row is not None]
+        voted = Extraction(vote(pmid, rows, self.entity_index), completion=large.completion, summary=large.summary)
+        return self.settle(pmid, "ensemble", voted, small, *votes)
+
+    def cascade(self, pmid, abstract):
+        """The small model first; the large model (self.provider) only when escalate() says so, and a vote of
+        every model when the two disagree and ensemble providers are configured."""
+        small = self.extract(pmid, abstract, provider=self.cascade_provider, tier="small")
+        if not self.escalate(small):
+            return self.settle(pmid, "small", small)
+        large = self.extract(pmid, abstract, tier="large")
+        if not self.ensemble_providers or not disputed(small, large, self.entity_index):
+            return self.settle(pmid, "large", large, small)
+        votes = [self.extract(pmid, abstract, provider=provider, tier="ensemble")
+                 for provider in self.ensemble_providers]
+        return self.settle_vote(pmid, large, small, votes)
+
+    async def cascade_async(self, limiters, pmid, abstract):
+        small = await self.extract_async(limiters, pmid, abstract, provider=self.cascade_provider, tier="small")
+        if not self.escalate(small):
+            return self.settle(pmid, "small", small)
+        large = await self.extract_async(limiters, pmid, abstract, tier="large")
+        if not self.ensemble_providers or not disputed(small, large, self.entity_index):
+            return self.settle(pmid, "large", large, small)
+        votes = await asyncio.gather(*(self.extract_async(limiters, pmid, abstract, provider=provider,
+                                                          tier="ensemble")
+                                       for provider in self.ensemble_providers))
+        return self.settle_vote(pmid, large, small, list(votes))
+
+    def process_abstract(self, pmid, abstract, summary=None):
+        """Process one PMID; summary is one already written for it, e.g. from a packed request."""
+        if self.prescreen(pmid, abstract):
+            return
+        llm_summary = self.begin(pmid) or summary
+        if self.cascade_provider is not None:
+            self.write_result(pmid, self.cascade(pmid, abstract))
+        else:
+            self.write_result(pmid, self.extract(pmid, abstract, llm_summary))
+
+    async def process_abstract_async(self, limiters, pmid, abstract, summary=None):
+        if self.prescreen(pmid, abstract):
+            return
+        llm_summary = self.begin(pmid) or summary
+        if self.cascade_provider is not None:
+            self.write_result(pmid, await self.cascade_async(limiters, pmid, abstract))
+        else:
+            self.write_result(pmid, await self.extract_async(limiters, pmid, abstract, llm_summary))
+
+    # Packed summaries
+
+    def packs(self, corpus):
+        """Pending PMIDs as lists of (pmid, abstract) to summarise together (see abstract_packing.py)."""
+        abstracts = ((pmid, corpus.get(pmid)) for pmid in self.pending_pmids(corpus))
+        for pack in pack_abstracts(abstracts, self.pack_tokens, self.pack_size, self.provider.model,
+                                   alone=self.needs_no_summary):
+            yield [(pmid, abstract) for pmid, abstract, _ in pack]
+
+    def needs_no_summary(self, pmid, abstract):
+        """True for a PMID the pre-filter will write, or one with a summary kept from an earlier attempt."""
+        if self.prefilter and screen(abstract) is not None:
+            return True
+        return self.results_store is not None and bool((self.results_store.get(pmid) or {}).get("summary"))
+
+    def packed_summary_call(self, pack):
+        """Prompt and output token limit for a packed summary request: a summary's limit per PMID."""
+        return (generate_packed_summary_prompt(pack, self.prompt_style),
+                self.provider.request_max_tokens(False) * len(pack))
+
+    def read_packed_summaries(self, pack, completion):
+        """Write the summaries found in a packed reply, each charged its share of the call; returns them."""
+        pmids = [pmid for pmid, _ in pack]
+        summaries = split_summaries(completion.text, pmids, completion.truncated)
+        self.packing["packs"] += 1
+        self.packing["packed"] += len(summaries)
+        self.packing["fallbacks"] += len(pmids) - len(summaries)
+        if len(summaries) < len(pmids):
+            missing = [pmid for pmid in pmids if pmid not in summaries]
+            reason = completion.error or ("reply cut off" if completion.truncated else "section missing or malformed")
+            print(f"Packed summary had no usable section for PMIDs {', '.join(missing)} ({reason}); "
+                  f"summarising them one by one")
+        found = [pmid for pmid in pmids if pmid in summaries]
+        shares = share_usage(completion, [len(summaries[pmid]) for pmid in found]) if found else []
+        for pmid, share in zip(found, shares):
+            self.write_summary(pmid, summaries[pmid], share)
+        return summaries
+
+    def process_pack(self, pack):
+        summaries = {}
+        if len(pack) > 1:
+            prompt, max_tokens = self.packed_summary_call(pack)
+            completion = self.chat(prompt, stage="packed_summary", max_tokens=max_tokens)
+            summaries = self.read_packed_summaries(pack, completion)
+        for pmid, abstract in pack:
+            self.process_abstract(pmid, abstract, summaries.get(pmid))
+
+    async def process_pack_async(self, limiters, pack):
+        summaries = {}
+        if len(pack) > 1:
+            prompt, max_tokens = self.packed_summary_call(pack)
+            completion = await self.achat(limiters[id(self.provider)], prompt, stage="packed_summary",
+                                          max_tokens=max_tokens)
+            summaries = self.read_packed_summaries(pack, completion)
+        await asyncio.gather(*(self.process_abstract_async(limiters, pmid, abstract, summaries.get(pmid))
+                               for pmid, abstract in pack))
+
+    # Whole runs
+
+    def pending_pmids(self, corpus):
+        """PMIDs in corpus (see abstract_corpus.open_corpus) that still need processing."""
+        if self.results_store is not None:
+            finished_pmids = self.results_store.finished_pmids(self.max_attempts)
+        else:
+            finished_pmids = read_processed_pmids(self.output_csv)
+
+        for pmid in corpus.pmids():
+            if pmid not in finished_pmids:
+                yield pmid
+
+    def process_documents(self, corpus):
+        if self.pack_tokens:
+            for pack in self.packs(corpus):
+                self.process_pack(pack)
+            return
+        for pmid in self.pending_pmids(corpus):
+            self.process_abstract(pmid, corpus.get(pmid))
+
+    def providers(self):
+        """Every provider the run calls: the pipeline's own, then the cascade and ensemble models."""
+        providers = [self.provider]
+        if self.cascade_provider is not None:
+            providers += [self.cascade_provider] + self.ensemble_providers
+        return providers
+
+    async def process_documents_async(self, corpus):
+        # Each provider has its own rate limits, so each gets its own limiter
+        limiters = {id(provider): AdaptiveRateLimiter(self.requests_per_minute, self.tokens_per_minute,
+                                                      self.concurrency)
+                    for provider in self.providers()}
+        # Workers pull from one shared generator, so at most `concurrency` PMIDs (or packs of PMIDs) are
+        # open at a time without queueing a task for every abstract up front
+        pmids = self.pending_pmids(corpus)
+
+        async def worker():
+            for pmid in pmids:
+                try:
+                    abstract = await asyncio.to_thread(corpus.get, pmid)
+                    await self.process_abstract_async(limiters, pmid, abstract)
+                except Exception as e:
+                    print(f"Error processing PMID {pmid}: {str(e)}")
+
+        async def pack_worker():
+            # The packs generator reads the abstracts itself, to count their tokens
+            for pack in packs:
+                try:
+                    await self.process_pack_async(limiters, pack)
+                except Exception as e:
+                    print(f"Error processing PMIDs {', '.join(pmid for pmid, _ in pack)}: {str(e)}")
+
+        if self.pack_tokens:
+            packs = self.packs(corpus)
+            worker = pack_worker
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            for provider in self.providers():
+                await provider.aclose()
+        for provider in self.providers():
+            limiter = limiters[id(provider)]
+            if limiter.decreases:
+                print(f"Concurrency for {provider.model} was narrowed {limiter.decreases} times after retryable "
+                      f"errors (ended at {int(limiter.window)} of {self.concurrency} calls in flight)")
+
+    def process_documents_batch(self, corpus, state_path, poll_interval=60):
+        if not self.provider.supports_batches:
+            raise ValueError(f"The {self.provider.name} provider does not support batch mode")
+        if self.cascade_provider is not None or self.pack_tokens:
+            raise ValueError("Cascade mode and packing run in sequential or concurrent mode, not batch mode")
+        # Batch mode always runs the two-call strategy
+        abstracts = {}
+        for pmid in self.pending_pmids(corpus):
+            abstract = corpus.get(pmid)
+            if not self.prescreen(pmid, abstract):
+                abstracts[pmid] = abstract
+        if "summary" not in load_batch_state(state_path):
+            # Going into a new batch is an attempt, as begin() counts one in the other modes; a resumed run
+            # polls batches whose attempts were counted when they were submitted
+            for pmid in abstracts:
+                self.begin(pmid)
+        # Batch submission and polling are outside the retry controller, so the SDK retries those itself
+        usage = run_batch_pipeline(
+            self.provider.client.with_options(max_retries=4), abstracts,
+            lambda abstract: generate_summary_prompt(abstract, self.prompt_style),
+            lambda summary: generate_extraction_prompt(summary, self.prompt_style),
+            on_summary=lambda pmid, summary: (self.write_summary(pmid, summary) if summary
+                                              else self.write_failure(pmid, "Failed to generate summary")),
+            on_extraction=self.write_extraction,
+            state_path=state_path, model=self.provider.model, max_tokens=self.provider.max_tokens,
+            temperature=self.provider.temperature,
+            system=self.provider.system_blocks(self.system_prompt_for(self.provider)), poll_interval=poll_interval
+        )
+        self.usage["input_tokens"] += usage["input_tokens"]
+        self.usage["output_tokens"] += usage["output_tokens"]
+        self.usage["cache_write_tokens"] += usage["cache_creation_input_tokens"]
+        self.usage["cache_read_tokens"] += usage["cache_read_input_tokens"]
+        if self.trace is not None:
+            self.trace.batch(self.provider.model, {"input_tokens": usage["input_tokens"],
+                                                   "output_tokens": usage["output_tokens"],
+                                                   "cache_write_tokens": usage["cache_creation_input_tokens"],
+                                                   "cache_read_tokens": usage["cache_read_input_tokens"]})
+
+    def start_trace(self, mode, pmids, **settings):
+        if self.trace is not None:
+            self.trace.start(provider=self.provider.name, model=self.provider.model, strategy=self.strategy,
+                             mode=mode, concurrency=self.concurrency if mode == 'concurrent' else 1,
+                             pmids=pmids,
+                             cascade_model=self.cascade_provider.model if self.cascade_provider else None,
+                             ensemble_models=[provider.model for provider in self.ensemble_providers],
+                             pack_tokens=self.pack_tokens or None, **settings)
+
+    def run(self, abstracts_path, mode='concurrent', batch_state='batch_state.json'):
+        """Process every pending PMID in abstracts_path, a directory of *_abstract.txt files or a packed corpus."""
+        corpus = open_corpus(abstracts_path)
+        self.start_trace(mode, len(corpus))
+        try:
+            self.run_corpus(corpus, mode, batch_state)
+        finally:
+            corpus.close()
+        self.export_dataset()
+
+    def export_dataset(self):
+        """Add output_csv to the results dataset, if there is one; returns the run name."""
+        if self.dataset is None:
+            return None
+        return export_run(self.dataset, self.output_csv, self.run_name, self.provider.model,
+                          self.provider.temperature, self.strategy)
+
+    def run_corpus(self, corpus, mode='concurrent', batch_state='batch_state.json'):
+        """Process every pending PMID in an open corpus (or a view of one, such as a shard) and export the store."""
+        if mode == 'batch':
+            self.process_documents_batch(corpus, batch_state)
+        elif mode == 'concurrent':
+            asyncio.run(self.process_documents_async(corpus))
+        else:
+            self.process_documents(corpus)
+        if self.results_store is not None:
+            self.results_store.export_tsv(self.output_csv, self.summary_csv)
+
+    def report(self):
+        if self.usage['cache_write_tokens'] or self.usage['cache_read_tokens']:
+            print(f"Total input tokens (uncached): {self.usage['input_tokens']}")
+            print(f"Total input tokens written to prompt cache: {self.usage['cache_write_tokens']}")
+            print(f"Total input tokens read from prompt cache: {self.usage['cache_read_tokens']}")
+        else:
+            print(f"Total input tokens: {self.usage['input_tokens']}")
+        print(f"Total output tokens: {self.usage['output_tokens']}")
+        if self.prefilter:
+            calls_per_abstract = 1 if self.strategy == 'combined' else 2
+            print(f"Pre-filter wrote {self.prefiltered} 'none' rows without an LLM call "
+                  f"({self.prefiltered * calls_per_abstract} calls saved)")
+        if self.repaired or self.rerequested:
+            print(f"JSON replies repaired locally: {self.repaired}; re-requested with max_tokens raised: "
+                  f"{self.rerequested}")
+        if self.pack_tokens:
+            print(f"Packing: {self.packing['packed']} summaries from {self.packing['packs']} packed requests; "
+                  f"{self.packing['fallbacks']} PMIDs fell back to a summary request of their own")
+        if self.cascade_provider is not None:
+            escalated = ", ".join(f"{count} {reason}" for reason, count in self.escalations.items()) or "none"
+            print(f"Cascade: {self.tiers.get('small', 0)} PMIDs settled by {self.cascade_provider.model}, "
+                  f"{self.tiers.get('large', 0)} by {self.provider.model} after escalation ({escalated}), "
+                  f"{self.tiers.get('ensemble', 0)} by an ensemble vote")
+        if self.dead_letters:
+            if self.results_store is not None:
+                print(f"{len(self.dead_letters)} PMIDs ran out of retries on transient errors and were dead-lettered; "
+                      f"requeue them with 'python results_store.py {self.results_store.path} --requeue'")
+            else:
+                print(f"{len(self.dead_letters)} PMIDs ran out of retries on transient errors and will be retried "
+                      f"by the next run: {', '.join(self.dead_letters)}")
+        if self.results_store is not None:
+            counts = self.results_store.counts()
+            print("PMIDs in results store: " + ", ".join(f"{count} {status}" for status, count in counts.items()))
+        if self.response_cache is not None:
+            self.response_cache.report()
+        if self.trace is not None:
+            self.trace.report()
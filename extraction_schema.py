@@ -0,0 +1,55 @@
+# Structured-output schema for the combined summarise-and-extract strategy.
+# The same schema backs the Anthropic tool definition and the OpenAI json_schema response format,
+# so both providers return an object that always parses.
+
+TOOL_NAME = "record_non_associations"
+
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {
+            "type": "string",
+            "description": "Concise justified summary of the explicitly mentioned non-associated genes, proteins, "
+                           "SNPs, enzymes, cytokines, mRNA and alleles with the pathogenesis of IBD."
+        },
+        "ibd_type": {
+            "type": "string",
+            "description": "IBD/Crohn's Disease/Ulcerative Colitis/Colitis, or N/A if the abstract is not IBD related."
+        },
+        "non_associations": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Non-associated genes, proteins, SNPs, enzymes, cytokines, mRNA or alleles; "
+                           "acronyms only, no descriptions."
+        },
+        "non_association_types": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Type of each non-association in the same order: "
+                           "gene/protein/SNP/enzyme/cytokine/mRNA/allele or N/A."
+        }
+    },
+    "required": ["summary", "ibd_type", "non_associations", "non_association_types"],
+    "additionalProperties": False
+}
+
+ANTHROPIC_TOOL = {
+    "name": TOOL_NAME,
+    "description": "Record the abstract summary and the extracted IBD non-associations.",
+    "input_schema": EXTRACTION_SCHEMA
+}
+
+OPENAI_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": TOOL_NAME, "strict": True, "schema": EXTRACTION_SCHEMA}
+}
+
+
+def to_row(pmid, extraction):
+    """Convert a structured extraction into the Results.csv row layout."""
+    return {
+        "PMID": pmid,
+        "IBD Type": extraction.get("ibd_type") or "N/A",
+        "Non-Associations": "; ".join(extraction.get("non_associations", [])) or "none",
+        "Non-Association Types": "; ".join(extraction.get("non_association_types", [])) or "none"
+    }
@@ -1,54 +1,184 @@
-# fuzzy_mark_2.py
 import pandas as pd
 import numpy as np
-from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz, process
 import re
+from collections import Counter
 
-def normalize_and_split(text, delimiter=';'):
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # Fall back to greedy matching without scipy
+    linear_sum_assignment = None
+
+ENTITY_MATCH_THRESHOLD = 0.9  # Minimum fuzz.ratio / 100 for a predicted entity to count as a gold entity
+
+PARENTHESES = re.compile(r'\([^)]*\)')
+NON_ALPHANUMERIC = re.compile(r'[^a-zA-Z0-9\s;]')
+
+def normalize_and_split(text, delimiter=';', entity_index=None):
+    # With an entity_index (entity_index.EntityIndex), known genes, proteins and SNPs become their canonical
+    # HGNC symbol or rsID first, so synonyms compare equal instead of relying on fuzzy ratios
     if pd.isna(text) or text.lower() in ['none', 'n/a']:
         return []
+    if entity_index is not None:
+        text = entity_index.canonicalize_list(str(text), delimiter)
     text = str(text).lower()
-    text = re.sub(r'\([^)]*\)', '', text)
-    text = re.sub(r'[^a-zA-Z0-9\s;]', '', text)
+    text = PARENTHESES.sub('', text)
+    text = NON_ALPHANUMERIC.sub('', text)
     return [item.strip() for item in text.split(delimiter) if item.strip()]
 
+def normalize_column(column, delimiter=';', entity_index=None):
+    # normalize_and_split over a whole column; a plain list avoids pandas' per-call overhead on short columns
+    return [normalize_and_split(text, delimiter, entity_index) for text in column.tolist()]
+
+def ratio_matrix(list1, list2):
+    # fuzz.ratio / 100 for every pair in one C-level call, rounded to whole percent as fuzzywuzzy does
+    return np.rint(process.cdist(list1, list2, scorer=fuzz.ratio)) / 100
+
+def match_entities(gold_items, llm_items, threshold=ENTITY_MATCH_THRESHOLD):
+    # Number of predicted entities paired one-to-one with a distinct gold entity scoring at least threshold
+    if not gold_items or not llm_items:
+        return 0
+    # Identical entities pair up directly; fuzzy ratios are only computed for the leftovers
+    unmatched_gold = Counter(gold_items)
+    leftover_llm = []
+    exact = 0
+    for item in llm_items:
+        if unmatched_gold[item]:
+            unmatched_gold[item] -= 1
+            exact += 1
+        else:
+            leftover_llm.append(item)
+    leftover_gold = list(unmatched_gold.elements())
+    if not leftover_gold or not leftover_llm:
+        return exact
+    return exact + match_fuzzy(leftover_gold, leftover_llm, threshold)
+
+def match_fuzzy(gold_items, llm_items, threshold):
+    scores = ratio_matrix(gold_items, llm_items)
+    scores[scores < threshold] = 0
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(scores, maximize=True)
+        return int(np.count_nonzero(scores[rows, cols]))
+    matches = 0
+    used_gold, used_llm = set(), set()
+    for flat in np.argsort(-scores, axis=None, kind='stable'):
+        i, j = divmod(int(flat), scores.shape[1])
+        if scores[i, j] == 0:
+            break
+        if i not in used_gold and j not in used_llm:
+            used_gold.add(i)
+            used_llm.add(j)
+            matches += 1
+    return matches
+
 def calculate_similarity(list1, list2):
     if not list1 and not list2:
         return 1.0
     if not list1 or not list2:
         return 0.0
 
-    similarities = []
-    for item1 in list1:
-        max_similarity = max(fuzz.ratio(item1, item2) / 100 for item2 in list2)
-        similarities.append(max_similarity)
+    return float(ratio_matrix(list1, list2).max(axis=1).mean())
+
+class GoldStandard:
+    """The gold standard normalised once, for scoring any number of LLM output files against it.
+
+    Every distinct IBD type seen in an output is scored against the gold IBD type vocabulary once, and
+    every distinct (gold, output) pair of IBD type lists is reduced to a similarity once; entity matches
+    are kept the same way per distinct (gold, output) entity lists. Later files only pay for strings and
+    combinations they introduce. With an entity_index, gold and output non-associations are both
+    canonicalised through it before matching.
+    """
 
-    return sum(similarities) / len(list1)
+    def __init__(self, gold_standard_df, entity_index=None):
+        self.df = gold_standard_df
+        self.entity_index = entity_index
+        self.pmids = [str(pmid).strip() for pmid in gold_standard_df.iloc[:, 0].tolist()]
+        self.ibd_types = normalize_column(gold_standard_df.iloc[:, 1])
+        self.non_assoc = normalize_column(gold_standard_df.iloc[:, 2], entity_index=entity_index)
+        self.ibd_vocab = sorted({item for items in self.ibd_types for item in items})
+        position = {item: i for i, item in enumerate(self.ibd_vocab)}
+        self.ibd_positions = [tuple(position[item] for item in items) for items in self.ibd_types]
+        self.ibd_scores = {}
+        self.pair_similarities = {}
+        self.entity_matches = {}
 
-def evaluate_llm_output_refined(gold_standard_df, llm_output_df):
-    # Normalize and split IBD types and non-associations
-    for df in [gold_standard_df, llm_output_df]:
-        df['ibd_types'] = df.iloc[:, 1].apply(normalize_and_split)
-        df['non_assoc'] = df.iloc[:, 2].apply(normalize_and_split)
+    def ibd_similarities(self, llm_ibd_types):
+        """calculate_similarity(gold, llm) for each row pair, in row order."""
+        new = sorted({item for items in llm_ibd_types for item in items} - self.ibd_scores.keys())
+        if new and self.ibd_vocab:
+            self.ibd_scores.update(zip(new, ratio_matrix(new, self.ibd_vocab)))
+
+        similarities = []
+        for gold_positions, llm in zip(self.ibd_positions, llm_ibd_types):
+            key = (gold_positions, tuple(llm))
+            if key not in self.pair_similarities:
+                if not gold_positions and not llm:
+                    similarity = 1.0
+                elif not gold_positions or not llm:
+                    similarity = 0.0
+                else:
+                    rows = [self.ibd_scores[item] for item in llm]
+                    similarity = sum(max(row[i] for row in rows) for i in gold_positions) / len(gold_positions)
+                self.pair_similarities[key] = float(similarity)
+            similarities.append(self.pair_similarities[key])
+        return similarities
+
+    def true_positives(self, llm_non_assoc):
+        """Entity matches for each row pair, in row order."""
+        matches = []
+        for gold, llm in zip(self.non_assoc, llm_non_assoc):
+            key = (tuple(gold), tuple(llm))
+            if key not in self.entity_matches:
+                self.entity_matches[key] = match_entities(gold, llm)
+            matches.append(self.entity_matches[key])
+        return matches
+
+    def align(self, llm_output_df):
+        """Line the output rows up with the gold PMIDs.
+
+        The last row of a duplicated PMID wins (as when a resumed run appends it again), and a gold PMID with
+        no output row counts as an empty prediction. Returns (IBD types, non-associations, counts).
+        """
+        llm_pmids = [str(pmid).strip() for pmid in llm_output_df.iloc[:, 0].tolist()]
+        latest = {pmid: row for row, pmid in enumerate(llm_pmids)}
+        llm_ibd_types = normalize_column(llm_output_df.iloc[:, 1])
+        llm_non_assoc = normalize_column(llm_output_df.iloc[:, 2], entity_index=self.entity_index)
+        rows = [latest.get(pmid) for pmid in self.pmids]
+        counts = {
+            "missing_pmids": rows.count(None),
+            "extra_pmids": len(latest.keys() - set(self.pmids)),
+            "duplicate_rows": len(llm_pmids) - len(latest)
+        }
+        return ([llm_ibd_types[row] if row is not None else [] for row in rows],
+                [llm_non_assoc[row] if row is not None else [] for row in rows], counts)
+
+def evaluate_llm_output_refined(gold_standard_df, llm_output_df, entity_index=None):
+    # gold_standard_df may be a GoldStandard, so a sweep over many files normalises it only once
+    if isinstance(gold_standard_df, GoldStandard):
+        gold = gold_standard_df
+    else:
+        gold = GoldStandard(gold_standard_df, entity_index)
+
+    # Normalize and split IBD types and non-associations, matched to the gold standard by PMID
+    llm_ibd_types, llm_non_assoc, counts = gold.align(llm_output_df)
 
     # Calculate similarities for IBD types
-    similarities_ibd = [calculate_similarity(gold, llm)
-                        for gold, llm in zip(gold_standard_df['ibd_types'], llm_output_df['ibd_types'])]
-
-    # Calculate confusion matrix for non-associations
-    tp_na = fp_na = tn_na = fn_na = 0
-
-    for gold, llm in zip(gold_standard_df['non_assoc'], llm_output_df['non_assoc']):
-        if not gold and not llm:
-            tn_na += 1
-        elif gold and llm:
-            tp_na += min(len(gold), len(llm))  # Count matches
-            fp_na += max(len(llm) - len(gold), 0)  # Extra predictions
-            fn_na += max(len(gold) - len(llm), 0)  # Missed predictions
-        elif gold:
-            fn_na += len(gold)
-        elif llm:
-            fp_na += len(llm)
+    similarities_ibd = gold.ibd_similarities(llm_ibd_types)
+
+    # Calculate confusion matrix for non-associations from a one-to-one matching of the entities
+    gold_counts = np.array([len(items) for items in gold.non_assoc], dtype=int)
+    llm_counts = np.array([len(items) for items in llm_non_assoc], dtype=int)
+    tp = np.array(gold.true_positives(llm_non_assoc), dtype=int)
+    per_pmid = pd.DataFrame({
+        "PMID": gold.pmids,
+        "ibd_type_similarity": similarities_ibd,
+        "tp": tp,
+        "fp": llm_counts - tp,  # Predictions with no matching gold entity
+        "fn": gold_counts - tp,  # Gold entities with no matching prediction
+        "tn": ((gold_counts == 0) & (llm_counts == 0)).astype(int)
+    })
+
+    tp_na, fp_na, fn_na, tn_na = (per_pmid[column].sum() for column in ("tp", "fp", "fn", "tn"))
 
     # Calculate metrics
     accuracy_ibd_type = np.mean(similarities_ibd)
@@ -67,7 +197,9 @@ def evaluate_llm_output_refined(gold_standard_df, llm_output_df):
         "true_positives_na": int(tp_na),
         "false_positives_na": int(fp_na),
         "true_negatives_na": int(tn_na),
-        "false_negatives_na": int(fn_na)
+        "false_negatives_na": int(fn_na),
+        "per_pmid": per_pmid,
+        **counts
     }
 
 # This script is to be used as an import for results calculation
\ No newline at end of file
@@ -0,0 +1,165 @@
+import json
+
+# Incremental scanning and local repair of the JSON objects the models return. The usual defects are a code
+# fence or a sentence around the object, a trailing comma, a raw newline inside a string, and a reply cut off
+# at max_tokens. The first four are repaired without another request. A cut-off reply is only completed if
+# nothing but closing braces is missing: an unterminated string or list may have lost entities, so it is
+# reported as unrecoverable and the caller re-requests it with a larger token limit.
+
+CLOSERS = {"{": "}", "[": "]"}
+CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+class UnrecoverableJSON(ValueError):
+    """The reply holds no JSON object that can be recovered without guessing at lost content."""
+
+
+class JSONObjectScanner:
+    """Follow a streamed reply and report when its first top-level JSON object closes."""
+
+    def __init__(self):
+        self.chunks = []
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        self.closed = False
+
+    def feed(self, chunk):
+        """Add the next piece of the reply; returns True once the object has closed (later text is ignored)."""
+        if self.closed:
+            return True
+        for position, char in enumerate(chunk):
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.depth = 1
+                continue
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = True
+                    self.chunks.append(chunk[:position + 1])
+                    return True
+        self.chunks.append(chunk)
+        return False
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+
+def repair(text):
+    """Rebuild the first JSON object in text. Returns (json_text, repairs, complete) or (None, repairs, False).
+
+    repairs names what was changed; complete is False when the object was cut off and had to be closed.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None, ["no JSON object"], False
+    repairs = []
+    if text[:start].strip():
+        repairs.append("text before the object")
+    out = []
+    stack = []
+    cut_points = []  # (length of out, stack) just before each separator, where a partial value can be cut off
+    in_string = escaped = False
+    end = None
+    for position in range(start, len(text)):
+        char = text[position]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char in CONTROL_ESCAPES:
+                char = CONTROL_ESCAPES[char]
+                if "control character in a string" not in repairs:
+                    repairs.append("control character in a string")
+            out.append(char)
+            continue
+        if char == '"':
+            in_string = True
+        elif char in CLOSERS:
+            stack.append(char)
+            cut_points.append((len(out) + 1, list(stack)))
+        elif char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                if "trailing comma" not in repairs:
+                    repairs.append("trailing comma")
+            if stack:
+                stack.pop()
+            if not stack:
+                out.append(char)
+                end = position
+                break
+        elif char == ",":
+            cut_points.append((len(out), list(stack)))
+        out.append(char)
+
+    if end is not None:
+        if text[end + 1:].strip():
+            repairs.append("text after the object")
+        return "".join(out), repairs, True
+
+    # Cut off: close what is open, or fall back to the last complete value
+    body = "".join(out).rstrip()
+    candidate = body + ('"' if in_string else "") + "".join(CLOSERS[opener] for opener in reversed(stack))
+    if _parses(candidate):
+        closed = ["a string"] if in_string else []
+        closed += [f"{'an object' if opener == '{' else 'a list'}" for opener in reversed(stack)]
+        return candidate, repairs + [f"closed {', '.join(closed)}"], False
+    for length, cut_stack in reversed(cut_points):
+        candidate = "".join(out[:length]).rstrip().rstrip(",") + "".join(CLOSERS[o] for o in reversed(cut_stack))
+        if _parses(candidate):
+            return candidate, repairs + ["dropped a partial value"], False
+    return None, repairs + ["cut off"], False
+
+
+def _parses(candidate):
+    try:
+        json.loads(candidate)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_json_object(text, required=()):
+    """Parse the JSON object in a model reply, repairing the defects above. Returns (object, repairs).
+
+    Raises UnrecoverableJSON when there is no object, it lacks a required key, or it was cut off anywhere
+    other than before its final closing braces.
+    """
+    try:
+        parsed = json.loads(text)
+        repairs = []
+    except ValueError:
+        repaired, repairs, complete = repair(text)
+        if repaired is None:
+            raise UnrecoverableJSON(", ".join(repairs))
+        if not complete and (repairs[-1] == "dropped a partial value" or "a string" in repairs[-1]
+                             or "a list" in repairs[-1]):
+            raise UnrecoverableJSON(f"reply cut off ({repairs[-1]})")
+        parsed = json.loads(repaired)
+    if not isinstance(parsed, dict):
+        raise UnrecoverableJSON("reply is not a JSON object")
+    missing = [key for key in required if key not in parsed]
+    if missing:
+        raise UnrecoverableJSON(f"missing {', '.join(missing)}")
+    return parsed, repairs
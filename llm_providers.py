@@ -0,0 +1,575 @@
+import re
+import json
+import time
+import asyncio
+import inspect
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from dataclasses import dataclass
+
+from rate_limiter import estimate_tokens
+from json_repair import JSONObjectScanner
+from extraction_schema import ANTHROPIC_TOOL, OPENAI_RESPONSE_FORMAT, TOOL_NAME
+
+
+@dataclass
+class Completion:
+    """Text of one model reply plus its token usage.
+
+    input_tokens counts only uncached input; prompt-cache writes and reads are counted separately
+    so the totals mean the same thing for every provider. A failed call has empty text and an error;
+    retryable marks an error that was transient but outlasted every retry. rate_limits holds what the
+    response headers said about the remaining budget (see read_rate_limits), and ttfb the seconds from
+    sending the request to its response headers (to the first streamed text when streaming), when the
+    provider can measure it. truncated means generation stopped at the max_tokens limit.
+    """
+    text: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_write_tokens: int = 0
+    cache_read_tokens: int = 0
+    error: str = None
+    retryable: bool = False
+    rate_limits: dict = None
+    ttfb: float = None
+    truncated: bool = False
+
+    def usage(self):
+        return {"input_tokens": self.input_tokens, "output_tokens": self.output_tokens,
+                "cache_write_tokens": self.cache_write_tokens, "cache_read_tokens": self.cache_read_tokens}
+
+
+# Worth retrying: request timeout, conflict, rate limit, and every 5xx (including Anthropic's 529 "overloaded")
+RETRYABLE_STATUSES = {408, 409, 429}
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def header_seconds(value):
+    """Seconds from now given a header value in seconds, a duration ("6m0s", "20ms") or a date/timestamp."""
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            moment = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_after(headers):
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return header_seconds(headers.get("retry-after"))
+
+
+def read_rate_limits(headers, prefix, names):
+    """Remaining requests/tokens and seconds to their reset from a response's rate-limit headers."""
+    if headers is None:
+        return None
+    rate_limits = {}
+    for kind in ("requests", "tokens"):
+        remaining = headers.get(prefix + names[kind + "_remaining"])
+        if remaining is not None:
+            try:
+                rate_limits[kind + "_remaining"] = int(remaining)
+            except ValueError:
+                continue
+            rate_limits[kind + "_reset"] = header_seconds(headers.get(prefix + names[kind + "_reset"]))
+    return rate_limits or None
+
+
+def classify_sdk_error(sdk, error):
+    """(retryable, retry_after) for an exception from the anthropic or openai SDK, or None if it is not one."""
+    if isinstance(error, sdk.APIStatusError):
+        status = error.status_code
+        return status in RETRYABLE_STATUSES or status >= 500, retry_after(error.response.headers)
+    if isinstance(error, sdk.APIConnectionError):  # Includes APITimeoutError
+        return True, None
+    return None
+
+
+# Set by each call so the HTTP clients' response hook can time that call's headers; contextvars keep the
+# timings of concurrent calls apart
+_response_timing = contextvars.ContextVar("response_timing", default=None)
+
+
+def _mark_headers(response):
+    timing = _response_timing.get()
+    if timing is not None and "headers" not in timing:
+        timing["headers"] = time.perf_counter()
+
+
+async def _amark_headers(response):
+    _mark_headers(response)
+
+
+@contextmanager
+def response_timer():
+    timing = {"start": time.perf_counter()}
+    token = _response_timing.set(timing)
+    try:
+        yield timing
+    finally:
+        _response_timing.reset(token)
+
+
+def time_to_headers(timing):
+    return timing["headers"] - timing["start"] if "headers" in timing else None
+
+
+async def parse_raw(raw):
+    # Raw responses parse synchronously in some SDK releases and asynchronously in others
+    parsed = raw.parse()
+    if inspect.isawaitable(parsed):
+        parsed = await parsed
+    return parsed
+
+
+class StreamedReply:
+    """A streamed reply collected until its first JSON object closes, so the stream can be dropped there."""
+
+    def __init__(self, input_estimate=0):
+        self.scanner = JSONObjectScanner()
+        self.start = time.perf_counter()
+        self.ttfb = None
+        self.input_tokens = input_estimate
+        self.output_tokens = 0
+        self.cache_write_tokens = 0
+        self.cache_read_tokens = 0
+        self.stop_reason = None
+
+    def add(self, text):
+        """Append streamed text; returns True once the JSON object is complete."""
+        if not text:
+            return False
+        if self.ttfb is None:
+            self.ttfb = time.perf_counter() - self.start
+        return self.scanner.feed(text)
+
+    def completion(self, rate_limits=None, truncated=False):
+        # A stream dropped early never reports its output tokens, so they are estimated from the text
+        text = self.scanner.text
+        return Completion(text, self.input_tokens, self.output_tokens or estimate_tokens(text),
+                          self.cache_write_tokens, self.cache_read_tokens, rate_limits=rate_limits,
+                          ttfb=self.ttfb, truncated=truncated)
+
+
+class Provider:
+    """One model endpoint. Each provider keeps a single client so HTTP connections are pooled
+    and reused across every call of a run instead of being rebuilt per request.
+
+    complete(prompt, system, structured, max_tokens) returns a Completion; structured=True asks for the
+    extraction schema and returns it as JSON text, and max_tokens overrides the output limit for one call.
+    stream_json() is the same call for replies expected to be a JSON object: providers that can stream
+    stop reading, and so stop generation, as soon as the object closes.
+    """
+    name = None
+    default_model = None
+    default_max_tokens = 300
+    prompt_style = "claude"
+    supports_batches = False
+
+    def __init__(self, model=None, max_tokens=None, temperature=0, combined_max_tokens=800):
+        self.model = model or self.default_model
+        self.max_tokens = max_tokens or self.default_max_tokens
+        self.temperature = temperature
+        self.combined_max_tokens = combined_max_tokens
+
+    def request_max_tokens(self, structured=False):
+        return self.combined_max_tokens if structured else self.max_tokens
+
+    def complete(self, prompt, system, structured=False, max_tokens=None):
+        raise NotImplementedError
+
+    async def acomplete(self, prompt, system, structured=False, max_tokens=None):
+        raise NotImplementedError
+
+    def stream_json(self, prompt, system, structured=False, max_tokens=None):
+        return self.complete(prompt, system, structured, max_tokens)
+
+    async def astream_json(self, prompt, system, structured=False, max_tokens=None):
+        return await self.acomplete(prompt, system, structured, max_tokens)
+
+    rate_limit_prefix = None
+    rate_limit_headers = {}
+
+    def rate_limits(self, headers):
+        if self.rate_limit_prefix is None:
+            return None
+        return read_rate_limits(headers, self.rate_limit_prefix, self.rate_limit_headers)
+
+    def classify_error(self, error):
+        """(retryable, retry_after seconds or None) for an exception raised by complete/acomplete.
+
+        Timeouts and dropped connections are worth retrying; anything else (a bad request, authentication,
+        a reply that cannot be parsed) fails the same way every time.
+        """
+        return isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)), None
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class AnthropicProvider(Provider):
+    name = "anthropic"
+    default_model = "claude-3-5-sonnet-20240620"
+    default_max_tokens = 300
+    prompt_style = "claude"
+    supports_batches = True
+
+    def __init__(self, model=None, max_tokens=None, temperature=0, combined_max_tokens=800,
+                 api_key=None, base_url=None):
+        super().__init__(model, max_tokens, temperature, combined_max_tokens)
+        import anthropic
+        self._anthropic = anthropic
+        # The pipeline retries with the rate-limit controller, which needs to see every 429 and retry-after
+        self._client_args = {"api_key": api_key, "base_url": base_url, "max_retries": 0}
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._anthropic.Anthropic(
+                **self._client_args, http_client=self._anthropic.DefaultHttpxClient(
+                    event_hooks={"response": [_mark_headers]}))
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = self._anthropic.AsyncAnthropic(
+                **self._client_args, http_client=self._anthropic.DefaultAsyncHttpxClient(
+                    event_hooks={"response": [_amark_headers]}))
+        return self._async_client
+
+    def cache_min_tokens(self):
+        """The shortest prefix Anthropic caches for this model."""
+        return 2048 if "haiku" in self.model else 1024
+
+    def system_blocks(self, system):
+        # The system prompt is identical for every call, so it is marked for prompt caching once it is long
+        # enough to be cached at all. The role preamble on its own is a few hundred tokens, so by default it is
+        # sent unmarked and every call's input is billed (and reported) as uncached.
+        block = {"type": "text", "text": system}
+        if estimate_tokens(system) >= self.cache_min_tokens():
+            block["cache_control"] = {"type": "ephemeral"}
+        return [block]
+
+    def params(self, prompt, system, structured=False, max_tokens=None):
+        params = {
+            "model": self.model,
+            "max_tokens": max_tokens or self.request_max_tokens(structured),
+            "temperature": self.temperature,
+            "system": self.system_blocks(system),
+            "messages": [{"role": "user", "content": prompt}]
+        }
+        if structured:
+            # Forcing the tool call makes the reply a schema-conforming object rather than free text
+            params["tools"] = [ANTHROPIC_TOOL]
+            params["tool_choice"] = {"type": "tool", "name": TOOL_NAME}
+        return params
+
+    rate_limit_prefix = "anthropic-ratelimit-"
+    rate_limit_headers = {"requests_remaining": "requests-remaining", "requests_reset": "requests-reset",
+                          "tokens_remaining": "tokens-remaining", "tokens_reset": "tokens-reset"}
+
+    def classify_error(self, error):
+        return classify_sdk_error(self._anthropic, error) or super().classify_error(error)
+
+    def to_completion(self, response, headers=None):
+        text = ""
+        for block in response.content:
+            if block.type == "tool_use":
+                text = json.dumps(block.input)
+                break
+            if block.type == "text":
+                text = block.text
+                break
+        usage = response.usage
+        return Completion(text, usage.input_tokens, usage.output_tokens,
+                          usage.cache_creation_input_tokens or 0, usage.cache_read_input_tokens or 0,
+                          rate_limits=self.rate_limits(headers), truncated=response.stop_reason == "max_tokens")
+
+    def complete(self, prompt, system, structured=False, max_tokens=None):
+        with response_timer() as timing:
+            raw = self.client.messages.with_raw_response.create(
+                **self.params(prompt, system, structured, max_tokens))
+        completion = self.to_completion(raw.parse(), raw.headers)
+        completion.ttfb = time_to_headers(timing)
+        return completion
+
+    async def acomplete(self, prompt, system, structured=False, max_tokens=None):
+        with response_timer() as timing:
+            raw = await self.async_client.messages.with_raw_response.create(
+                **self.params(prompt, system, structured, max_tokens))
+        completion = self.to_completion(await parse_raw(raw), raw.headers)
+        completion.ttfb = time_to_headers(timing)
+        return completion
+
+    @staticmethod
+    def read_stream_event(event, reply):
+        """Text carried by one streaming event (reply text or tool input JSON); usage goes on reply."""
+        if event.type == "message_start":
+            usage = event.message.usage
+            reply.input_tokens = usage.input_tokens
+            reply.cache_write_tokens = usage.cache_creation_input_tokens or 0
+            reply.cache_read_tokens = usage.cache_read_input_tokens or 0
+        elif event.type == "content_block_delta":
+            return getattr(event.delta, "text", None) or getattr(event.delta, "partial_json", None)
+        elif event.type == "message_delta":
+            reply.output_tokens = event.usage.output_tokens
+            reply.stop_reason = event.delta.stop_reason
+        return None
+
+    def stream_json(self, prompt, system, structured=False, max_tokens=None):
+        reply = StreamedReply()
+        raw = self.client.messages.with_raw_response.create(
+            stream=True, **self.params(prompt, system, structured, max_tokens))
+        stream = raw.parse()
+        try:
+            for event in stream:
+                if reply.add(self.read_stream_event(event, reply)):
+                    break  # Closing the stream stops generation, so text after the object is never paid for
+        finally:
+            stream.close()
+        return reply.completion(self.rate_limits(raw.headers), truncated=reply.stop_reason == "max_tokens")
+
+    async def astream_json(self, prompt, system, structured=False, max_tokens=None):
+        reply = StreamedReply()
+        raw = await self.async_client.messages.with_raw_response.create(
+            stream=True, **self.params(prompt, system, structured, max_tokens))
+        stream = await parse_raw(raw)
+        try:
+            async for event in stream:
+                if reply.add(self.read_stream_event(event, reply)):
+                    break
+        finally:
+            await stream.close()
+        return reply.completion(self.rate_limits(raw.headers), truncated=reply.stop_reason == "max_tokens")
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+    default_model = "gpt-4o"
+    default_max_tokens = 500
+    prompt_style = "gpt"
+
+    def __init__(self, model=None, max_tokens=None, temperature=0, combined_max_tokens=800,
+                 api_key=None, base_url=None):
+        super().__init__(model, max_tokens, temperature, combined_max_tokens)
+        import openai
+        self._openai = openai
+        self._client_args = {"api_key": api_key, "base_url": base_url, "max_retries": 0}
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._openai.OpenAI(
+                **self._client_args, http_client=self._openai.DefaultHttpxClient(
+                    event_hooks={"response": [_mark_headers]}))
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = self._openai.AsyncOpenAI(
+                **self._client_args, http_client=self._openai.DefaultAsyncHttpxClient(
+                    event_hooks={"response": [_amark_headers]}))
+        return self._async_client
+
+    def params(self, prompt, system, structured=False, max_tokens=None):
+        # OpenAI caches prompt prefixes of 1024+ tokens automatically, so the system prompt goes first
+        params = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens or self.request_max_tokens(structured),
+            "temperature": self.temperature
+        }
+        if structured:
+            params["response_format"] = OPENAI_RESPONSE_FORMAT
+        return params
+
+    rate_limit_prefix = "x-ratelimit-"
+    rate_limit_headers = {"requests_remaining": "remaining-requests", "requests_reset": "reset-requests",
+                          "tokens_remaining": "remaining-tokens", "tokens_reset": "reset-tokens"}
+
+    def classify_error(self, error):
+        return classify_sdk_error(self._openai, error) or super().classify_error(error)
+
+    def to_completion(self, response, headers=None):
+        usage = response.usage
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        text = (response.choices[0].message.content or "").strip()
+        return Completion(text, usage.prompt_tokens - cached, usage.completion_tokens, 0, cached,
+                          rate_limits=self.rate_limits(headers),
+                          truncated=response.choices[0].finish_reason == "length")
+
+    def complete(self, prompt, system, structured=False, max_tokens=None):
+        with response_timer() as timing:
+            raw = self.client.chat.completions.with_raw_response.create(
+                **self.params(prompt, system, structured, max_tokens))
+        completion = self.to_completion(raw.parse(), raw.headers)
+        completion.ttfb = time_to_headers(timing)
+        return completion
+
+    async def acomplete(self, prompt, system, structured=False, max_tokens=None):
+        with response_timer() as timing:
+            raw = await self.async_client.chat.completions.with_raw_response.create(
+                **self.params(prompt, system, structured, max_tokens))
+        completion = self.to_completion(await parse_raw(raw), raw.headers)
+        completion.ttfb = time_to_headers(timing)
+        return completion
+
+    def stream_params(self, prompt, system, structured=False, max_tokens=None):
+        return {**self.params(prompt, system, structured, max_tokens),
+                "stream": True, "stream_options": {"include_usage": True}}
+
+    @staticmethod
+    def read_stream_event(chunk, reply):
+        if getattr(chunk, "usage", None) is not None:
+            details = getattr(chunk.usage, "prompt_tokens_details", None)
+            cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+            reply.input_tokens = chunk.usage.prompt_tokens - cached
+            reply.cache_read_tokens = cached
+            reply.output_tokens = chunk.usage.completion_tokens
+        if chunk.choices:
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                reply.stop_reason = choice.finish_reason
+            return choice.delta.content
+        return None
+
+    def stream_json(self, prompt, system, structured=False, max_tokens=None):
+        # Usage only arrives in the final chunk, so a stream dropped early falls back to estimates
+        reply = StreamedReply(estimate_tokens(system + prompt))
+        raw = self.client.chat.completions.with_raw_response.create(
+            **self.stream_params(prompt, system, structured, max_tokens))
+        stream = raw.parse()
+        try:
+            for chunk in stream:
+                if reply.add(self.read_stream_event(chunk, reply)):
+                    break
+        finally:
+            stream.close()
+        return reply.completion(self.rate_limits(raw.headers), truncated=reply.stop_reason == "length")
+
+    async def astream_json(self, prompt, system, structured=False, max_tokens=None):
+        reply = StreamedReply(estimate_tokens(system + prompt))
+        raw = await self.async_client.chat.completions.with_raw_response.create(
+            **self.stream_params(prompt, system, structured, max_tokens))
+        stream = await parse_raw(raw)
+        try:
+            async for chunk in stream:
+                if reply.add(self.read_stream_event(chunk, reply)):
+                    break
+        finally:
+            await stream.close()
+        return reply.completion(self.rate_limits(raw.headers), truncated=reply.stop_reason == "length")
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+
+
+class MockProvider(Provider):
+    """Offline stand-in that returns canned replies after a fixed delay, for dry runs without API keys."""
+    name = "mock"
+    default_model = "mock"
+    default_max_tokens = 300
+    prompt_style = "claude"
+
+    SUMMARY = "The abstract does not explicitly report any non-associations with IBD pathogenesis."
+    EXTRACTION = {"IBD Type": "N/A", "Non-Associations": [], "Non-Association Types": []}
+    COMBINED = {"summary": SUMMARY, "ibd_type": "N/A", "non_associations": [], "non_association_types": []}
+    PACKED_HEADING = re.compile(r"^[ \t]*### PMID (\d+)[ \t]*$", re.MULTILINE)
+
+    def __init__(self, model=None, max_tokens=None, temperature=0, combined_max_tokens=800,
+                 api_key=None, base_url=None, latency=0.0):
+        super().__init__(model, max_tokens, temperature, combined_max_tokens)
+        self.latency = latency
+
+    @classmethod
+    def packed_summaries(cls, prompt, summary):
+        """The reply to a packed summary prompt (see abstract_packing.py): summary under every PMID's heading,
+        or None for any other prompt."""
+        pmids = cls.PACKED_HEADING.findall(prompt)
+        if not pmids:
+            return None
+        return "\n\n".join(f"### PMID {pmid}\n{summary}" for pmid in pmids)
+
+    def reply(self, prompt, system, structured=False):
+        packed = self.packed_summaries(prompt, self.SUMMARY)
+        if structured:
+            text = json.dumps(self.COMBINED)
+        elif packed is not None:
+            text = packed
+        elif "Abstract:" in prompt:
+            text = self.SUMMARY
+        else:
+            text = json.dumps(self.EXTRACTION)
+        return Completion(text, estimate_tokens(system + prompt), estimate_tokens(text))
+
+    def complete(self, prompt, system, structured=False, max_tokens=None):
+        time.sleep(self.latency)
+        return self.reply(prompt, system, structured)
+
+    async def acomplete(self, prompt, system, structured=False, max_tokens=None):
+        await asyncio.sleep(self.latency)
+        return self.reply(prompt, system, structured)
+
+
+PROVIDERS = {
+    "anthropic": AnthropicProvider,
+    "openai": OpenAIProvider,
+    "mock": MockProvider
+}
+
+
+def make_provider(name, **kwargs):
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider {name!r}; choose from {', '.join(PROVIDERS)}")
+    return PROVIDERS[name](**kwargs)
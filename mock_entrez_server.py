@@ -0,0 +1,113 @@
+import os
+import re
+import json
+import random
+import argparse
+import textwrap
+from datetime import date, datetime
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the PubMed E-utilities used by Abstract_Downloader.py (esearch with usehistory,
+# efetch uilist and MEDLINE). Every PMID_<id>_abstract.txt in the served directory is one record whose
+# modification date is the file's mtime. Run it, then set EUTILS_BASE=http://127.0.0.1:8808/ for the downloader.
+
+
+def load_records(directory):
+    records = {}
+    for filename in os.listdir(directory):
+        match = re.match(r'PMID_(\d+)_abstract\.txt$', filename)
+        if match:
+            path = os.path.join(directory, filename)
+            records[match.group(1)] = (path, date.fromtimestamp(os.path.getmtime(path)))
+    return dict(sorted(records.items(), key=lambda item: int(item[0])))
+
+
+def to_medline(pmid, text):
+    lines = textwrap.wrap(text, 82, break_on_hyphens=False, break_long_words=False) or [""]
+    return f"PMID- {pmid}\nAB  - " + "\n      ".join(lines) + "\n"
+
+
+class EntrezHandler(BaseHTTPRequestHandler):
+    records = {}
+    histories = {}
+    error_rate = 0.0
+
+    def do_GET(self):
+        self.handle_request(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.handle_request(parse_qs(self.rfile.read(length).decode('utf-8')))
+
+    def handle_request(self, query):
+        params = {key: values[0] for key, values in query.items()}
+        if random.random() < self.error_rate:
+            self.send_error(random.choice([429, 500, 502, 503]))
+            return
+        endpoint = urlparse(self.path).path.rsplit('/', 1)[-1]
+        if endpoint == "esearch.fcgi":
+            self.esearch(params)
+        elif endpoint == "efetch.fcgi":
+            self.efetch(params)
+        else:
+            self.send_error(404)
+
+    def esearch(self, params):
+        pmids = list(self.records)
+        if params.get("mindate"):
+            mindate = datetime.strptime(params["mindate"], "%Y/%m/%d").date()
+            pmids = [pmid for pmid in pmids if self.records[pmid][1] >= mindate]
+        webenv = f"MCID_{len(self.histories) + 1}"
+        self.histories[webenv] = pmids
+        self.reply("application/json", json.dumps({"esearchresult": {
+            "count": str(len(pmids)), "retmax": "0", "retstart": "0",
+            "querykey": "1", "webenv": webenv, "idlist": []
+        }}))
+
+    def efetch(self, params):
+        if "id" in params:
+            pmids = [pmid for pmid in params["id"].split(",") if pmid in self.records]
+        else:
+            pmids = self.histories.get(params.get("WebEnv"), [])
+            start = int(params.get("retstart", 0))
+            pmids = pmids[start:start + int(params.get("retmax", 20))]
+        if params.get("rettype") == "uilist":
+            self.reply("text/plain", "".join(f"{pmid}\n" for pmid in pmids))
+            return
+        entries = []
+        for pmid in pmids:
+            with open(self.records[pmid][0], 'r', encoding='utf-8') as file:
+                entries.append(to_medline(pmid, file.read()))
+        self.reply("text/plain", "\n".join(entries))
+
+    def reply(self, content_type, body):
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a directory of abstracts as a stub PubMed E-utilities endpoint.")
+    parser.add_argument("abstracts", help="Directory of PMID_<id>_abstract.txt files to serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with a 429 or 5xx, to exercise retries")
+    args = parser.parse_args(argv)
+
+    EntrezHandler.records = load_records(args.abstracts)
+    EntrezHandler.error_rate = args.error_rate
+    server = ThreadingHTTPServer((args.host, args.port), EntrezHandler)
+    print(f"Serving {len(EntrezHandler.records)} records at http://{args.host}:{args.port}/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
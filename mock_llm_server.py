@@ -0,0 +1,498 @@
+import json
+import time
+import random
+import argparse
+import threading
+import itertools
+from datetime import datetime, timezone, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from rate_limiter import TokenBucket, estimate_tokens
+from llm_providers import MockProvider
+
+# Local stand-in for the Anthropic Messages and OpenAI Chat Completions APIs, so the extractors can be run
+# and benchmarked without spending API credit. Point a provider at it with --base-url
+# http://127.0.0.1:8809 (Anthropic) or http://127.0.0.1:8809/v1 (OpenAI). Replies are canned (MockProvider's,
+# or a --replies JSON file with "summary", "extraction" and "combined" keys, plus optional per-model overrides
+# under "models" for trying the cascade and ensemble modes), latency is drawn from the chosen
+# distribution, and 429/5xx responses can be injected at random or produced by server-side rate limits.
+# Requests with "stream": true are answered with server-sent events at --token-latency seconds per token; a
+# client that closes the stream early is counted in /stats as "disconnected". Replies longer than the
+# request's max_tokens are cut off there, and --malformed-rate/--truncate-rate damage JSON replies the way
+# models sometimes do. A packed summary request gets the summary under each of its PMIDs' headings.
+# POST /v1/messages/batches, GET /v1/messages/batches/<id> and GET .../<id>/results fake the Message Batches
+# API: every request in a batch is answered when it is created, the batch reports "ended" --batch-latency
+# seconds later, and --error-rate of its requests come back errored. GET /stats returns request and status
+# counts.
+
+DEFAULT_REPLIES = {"summary": MockProvider.SUMMARY, "extraction": MockProvider.EXTRACTION,
+                   "combined": MockProvider.COMBINED}
+DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+STREAM_PIECE = 16  # Characters per streamed delta, about four tokens
+
+
+def sample_latency(distribution, median, sigma):
+    if median <= 0:
+        return 0.0
+    if distribution == "uniform":
+        return random.uniform(0, 2 * median)
+    if distribution == "exponential":
+        return random.expovariate(0.6931471805599453 / median)  # ln 2 / median, so the median is `median`
+    if distribution == "lognormal":
+        return median * random.lognormvariate(0, sigma)
+    return median
+
+
+class ServerState:
+    """Counters and server-side limits shared by every handler thread."""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, max_concurrency=0):
+        self.lock = threading.Lock()
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.stats = {"requests": 0, "status": {}, "disconnected": 0, "batches": 0, "batch_requests": 0}
+        self.batches = {}
+        self.batch_ids = itertools.count(1)
+
+    def admit(self, tokens):
+        """Take a request slot. Returns (refusal, retry_after, limits): refusal is None when admitted,
+        otherwise "overloaded" or "rate_limit"; limits feed the rate-limit headers."""
+        with self.lock:
+            self.stats["requests"] += 1
+            limits = self.limits()
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                return "overloaded", None, limits
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    wait = bucket.wait_time(amount)
+                    if wait > 0:
+                        return "rate_limit", wait, limits
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.consume(amount)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return None, None, self.limits()
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def count(self, status):
+        with self.lock:
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+
+    def disconnected(self):
+        with self.lock:
+            self.stats["disconnected"] += 1
+
+    def add_batch(self, results):
+        with self.lock:
+            batch_id = f"msgbatch_mock_{next(self.batch_ids)}"
+            self.batches[batch_id] = {"created": time.time(), "results": results}
+            self.stats["batches"] += 1
+            self.stats["batch_requests"] += len(results)
+            return batch_id
+
+    def batch(self, batch_id):
+        with self.lock:
+            return self.batches.get(batch_id)
+
+    def limits(self):
+        limits = {}
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            if bucket is not None:
+                level = max(0, int(bucket.level))
+                limits[kind] = (int(bucket.capacity), level, (bucket.capacity - level) / bucket.rate)
+        return limits
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, "status": dict(self.stats["status"]), "in_flight": self.in_flight,
+                    "max_in_flight": self.max_in_flight}
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so the SDKs' connection pools behave as they do in production
+    state = ServerState()
+    replies = DEFAULT_REPLIES
+    distribution = "lognormal"
+    latency = 0.5
+    sigma = 0.5
+    error_rate = 0.0
+    rate_limit_rate = 0.0
+    retry_after = 1.0
+    token_latency = 0.0
+    malformed_rate = 0.0
+    truncate_rate = 0.0
+    batch_latency = 1.0
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/stats"):
+            self.send_json(200, self.state.snapshot())
+        elif "/messages/batches/" in path:
+            batch_id, _, results = path.split("/messages/batches/", 1)[1].partition("/")
+            batch = self.state.batch(batch_id)
+            if batch is None or results not in ("", "results"):
+                self.send_json(404, {"type": "error", "error": {"type": "not_found_error",
+                                                                "message": f"unknown batch {batch_id}"}})
+            elif results:
+                self.send_batch_results(batch)
+            else:
+                self.send_json(200, self.batch_object(batch_id, batch))
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/messages/batches"):
+            self.create_batch(body)
+            return
+        if path.endswith("/messages"):
+            api = "anthropic"
+        elif path.endswith("/chat/completions"):
+            api = "openai"
+        else:
+            self.send_json(404, {"error": {"message": f"unknown endpoint {path}"}})
+            return
+
+        system, prompt = self.read_prompt(api, body)
+        estimated = estimate_tokens(system + prompt) + body.get("max_tokens", 0)
+        refused, wait, limits = self.state.admit(estimated)
+        if refused is None and random.random() < self.rate_limit_rate:
+            self.state.release()
+            refused, wait = "rate_limit", self.retry_after
+        elif refused is None and random.random() < self.error_rate:
+            time.sleep(sample_latency(self.distribution, self.latency, self.sigma) / 2)
+            self.state.release()
+            refused = "server_error"
+        if refused is not None:
+            self.send_error_reply(api, refused, wait, limits)
+            return
+
+        try:
+            time.sleep(sample_latency(self.distribution, self.latency, self.sigma))
+            structured = bool(body.get("tools") if api == "anthropic" else body.get("response_format"))
+            stream = bool(body.get("stream"))
+            text = self.reply_text(prompt, structured, body.get("model"))
+            # A non-streamed Anthropic tool call carries a parsed object, which cannot be malformed
+            if text.startswith("{") and (stream or not (api == "anthropic" and structured)):
+                text = self.damage(text)
+            text, truncated = self.cut_off(text, body.get("max_tokens"))
+            input_tokens, output_tokens = estimate_tokens(system + prompt), estimate_tokens(text)
+            if stream:
+                if api == "anthropic":
+                    events = self.anthropic_events(body, text, structured, truncated, input_tokens, output_tokens)
+                else:
+                    events = self.openai_events(body, text, truncated, input_tokens, output_tokens)
+                self.send_stream(events, self.limit_headers(api, limits))
+                return
+            time.sleep(self.token_latency * output_tokens)
+            if api == "anthropic":
+                reply = self.anthropic_reply(body, text, structured, truncated, input_tokens, output_tokens)
+            else:
+                reply = self.openai_reply(body, text, truncated, input_tokens, output_tokens)
+            self.send_json(200, reply, self.limit_headers(api, limits))
+        finally:
+            self.state.release()
+
+    def create_batch(self, body):
+        """Answer every request of a new batch now; the batch is served as ended batch_latency seconds later."""
+        results = []
+        for request in body.get("requests", []):
+            params = request.get("params", {})
+            if random.random() < self.error_rate:
+                result = {"type": "errored", "error": {"type": "error", "error": {"type": "api_error",
+                                                                                  "message": "mock server error"}}}
+            else:
+                system, prompt = self.read_prompt("anthropic", params)
+                structured = bool(params.get("tools"))
+                text, truncated = self.cut_off(self.reply_text(prompt, structured, params.get("model")),
+                                               params.get("max_tokens"))
+                message = self.anthropic_reply(params, text, structured, truncated,
+                                               estimate_tokens(system + prompt), estimate_tokens(text))
+                result = {"type": "succeeded", "message": message}
+            results.append({"custom_id": request.get("custom_id"), "result": result})
+        batch_id = self.state.add_batch(results)
+        self.send_json(200, self.batch_object(batch_id, self.state.batch(batch_id)))
+
+    def batch_object(self, batch_id, batch):
+        created = datetime.fromtimestamp(batch["created"], timezone.utc)
+        ended = time.time() >= batch["created"] + self.batch_latency
+        counts = {"processing": 0 if ended else len(batch["results"]), "succeeded": 0, "errored": 0,
+                  "canceled": 0, "expired": 0}
+        if ended:
+            for entry in batch["results"]:
+                counts[entry["result"]["type"]] += 1
+        return {"id": batch_id, "type": "message_batch", "processing_status": "ended" if ended else "in_progress",
+                "request_counts": counts, "created_at": created.isoformat(),
+                "expires_at": (created + timedelta(days=1)).isoformat(),
+                "ended_at": (created + timedelta(seconds=self.batch_latency)).isoformat() if ended else None,
+                "archived_at": None, "cancel_initiated_at": None,
+                "results_url": (f"http://{self.headers.get('Host')}/v1/messages/batches/{batch_id}/results"
+                                if ended else None)}
+
+    def send_batch_results(self, batch):
+        data = "".join(json.dumps(entry) + "\n" for entry in batch["results"]).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/binary")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.state.count(200)
+
+    @staticmethod
+    def read_prompt(api, body):
+        def text_of(content):
+            if isinstance(content, str):
+                return content
+            return "".join(block.get("text", "") for block in content or [])
+
+        messages = body.get("messages", [])
+        if api == "anthropic":
+            system = text_of(body.get("system", ""))
+        else:
+            system = "".join(text_of(m["content"]) for m in messages if m.get("role") == "system")
+        prompt = "".join(text_of(m["content"]) for m in messages if m.get("role") == "user")
+        return system, prompt
+
+    def reply_text(self, prompt, structured, model=None):
+        replies = {**self.replies, **self.replies.get("models", {}).get(model, {})}
+        if structured:
+            return json.dumps(replies["combined"])
+        packed = MockProvider.packed_summaries(prompt, replies["summary"])
+        if packed is not None:
+            return packed
+        if "Abstract:" in prompt:
+            return replies["summary"]
+        return json.dumps(replies["extraction"])
+
+    def damage(self, text):
+        """Apply the defects models produce: a fenced or chatty reply, a trailing comma, or a cut-off one."""
+        if random.random() < self.malformed_rate:
+            defect = random.choice(["fence", "comma", "prose"])
+            if defect == "fence":
+                text = f"```json\n{text}\n```"
+            elif defect == "comma":
+                text = text[:-1].rstrip() + ",\n}"
+            else:
+                text = f"Here is the extracted information:\n{text}\nLet me know if you need anything else."
+        if random.random() < self.truncate_rate:
+            text = text[:len(text) // 2]
+        return text
+
+    @staticmethod
+    def cut_off(text, max_tokens):
+        """Cut text at max_tokens (about four characters each); returns (text, truncated)."""
+        if max_tokens and estimate_tokens(text) > max_tokens:
+            return text[:max_tokens * 4], True
+        return text, False
+
+    @staticmethod
+    def anthropic_stop_reason(structured, truncated):
+        return "max_tokens" if truncated else "tool_use" if structured else "end_turn"
+
+    @classmethod
+    def anthropic_reply(cls, body, text, structured, truncated, input_tokens, output_tokens):
+        if structured:
+            content = [{"type": "tool_use", "id": "toolu_mock", "name": body["tools"][0]["name"],
+                        "input": json.loads(text) if not truncated else {}}]
+        else:
+            content = [{"type": "text", "text": text}]
+        return {"id": "msg_mock", "type": "message", "role": "assistant", "model": body.get("model", "mock"),
+                "content": content, "stop_reason": cls.anthropic_stop_reason(structured, truncated),
+                "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                          "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}}
+
+    @staticmethod
+    def openai_reply(body, text, truncated, input_tokens, output_tokens):
+        return {"id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "length" if truncated else "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                          "total_tokens": input_tokens + output_tokens}}
+
+    def pieces(self, text):
+        """The reply in streamed deltas, generated at token_latency seconds per token."""
+        for start in range(0, len(text), STREAM_PIECE):
+            piece = text[start:start + STREAM_PIECE]
+            time.sleep(self.token_latency * estimate_tokens(piece))
+            yield piece
+
+    def anthropic_events(self, body, text, structured, truncated, input_tokens, output_tokens):
+        usage = {"input_tokens": input_tokens, "output_tokens": 1, "cache_creation_input_tokens": 0,
+                 "cache_read_input_tokens": 0}
+        yield "message_start", {"type": "message_start", "message": {
+            "id": "msg_mock", "type": "message", "role": "assistant", "model": body.get("model", "mock"),
+            "content": [], "stop_reason": None, "stop_sequence": None, "usage": usage}}
+        if structured:
+            block = {"type": "tool_use", "id": "toolu_mock", "name": body["tools"][0]["name"], "input": {}}
+        else:
+            block = {"type": "text", "text": ""}
+        yield "content_block_start", {"type": "content_block_start", "index": 0, "content_block": block}
+        for piece in self.pieces(text):
+            delta = ({"type": "input_json_delta", "partial_json": piece} if structured
+                     else {"type": "text_delta", "text": piece})
+            yield "content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta}
+        yield "content_block_stop", {"type": "content_block_stop", "index": 0}
+        yield "message_delta", {"type": "message_delta",
+                                "delta": {"stop_reason": self.anthropic_stop_reason(structured, truncated),
+                                          "stop_sequence": None},
+                                "usage": {"output_tokens": output_tokens}}
+        yield "message_stop", {"type": "message_stop"}
+
+    def openai_events(self, body, text, truncated, input_tokens, output_tokens):
+        def chunk(delta, finish_reason=None):
+            return None, {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                          "model": body.get("model", "mock"),
+                          "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        yield chunk({"role": "assistant", "content": ""})
+        for piece in self.pieces(text):
+            yield chunk({"content": piece})
+        yield chunk({}, "length" if truncated else "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield None, {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body.get("model", "mock"), "choices": [],
+                         "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                                   "total_tokens": input_tokens + output_tokens}}
+        yield None, "[DONE]"
+
+    @staticmethod
+    def limit_headers(api, limits):
+        headers = {}
+        for kind, (limit, remaining, reset) in limits.items():
+            if api == "anthropic":
+                reset_at = datetime.now(timezone.utc) + timedelta(seconds=reset)
+                headers[f"anthropic-ratelimit-{kind}-limit"] = str(limit)
+                headers[f"anthropic-ratelimit-{kind}-remaining"] = str(remaining)
+                headers[f"anthropic-ratelimit-{kind}-reset"] = reset_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+            else:
+                headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+                headers[f"x-ratelimit-remaining-{kind}"] = str(remaining)
+                headers[f"x-ratelimit-reset-{kind}"] = f"{reset:.3f}s"
+        return headers
+
+    def send_error_reply(self, api, kind, wait, limits):
+        status = {"rate_limit": 429, "overloaded": 529 if api == "anthropic" else 503,
+                  "server_error": random.choice([500, 502, 503])}[kind]
+        headers = self.limit_headers(api, limits)
+        if wait:
+            headers["retry-after"] = str(max(1, round(wait)))
+        message = f"mock {kind.replace('_', ' ')}"
+        if api == "anthropic":
+            error_type = {"rate_limit": "rate_limit_error", "overloaded": "overloaded_error"}.get(kind, "api_error")
+            body = {"type": "error", "error": {"type": error_type, "message": message}}
+        else:
+            body = {"error": {"message": message, "type": "rate_limit_exceeded" if status == 429 else "server_error",
+                              "code": None, "param": None}}
+        self.send_json(status, body, headers)
+
+    def send_stream(self, events, headers):
+        """Send (event name, data) pairs as server-sent events over chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.state.count(200)
+        try:
+            for event, data in events:
+                message = (f"event: {event}\n" if event else "") + \
+                          f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+                payload = message.encode('utf-8')
+                self.wfile.write(f"{len(payload):X}\r\n".encode('ascii') + payload + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, as the pipeline does once a streamed JSON object closes
+            self.state.disconnected()
+            self.close_connection = True
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.state.count(status)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # The default backlog of 5 drops connections when many clients connect at once
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Serve canned replies on the Anthropic Messages (and Message "
+                                                 "Batches) and OpenAI Chat Completions endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8809)
+    parser.add_argument("--latency", type=float, default=0.5, help="Median seconds per reply")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Spread of the lognormal latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 5xx")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with a 429 regardless of the limits below")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after sent with injected 429s")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="Server-side request limit (0: none)")
+    parser.add_argument("--tokens-per-minute", type=int, default=0, help="Server-side token limit (0: none)")
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="Requests in flight before replying overloaded (529/503; 0: no limit)")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="Seconds to generate each output token, on top of --latency")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Fraction of JSON replies wrapped in a code fence or prose, or given a trailing comma")
+    parser.add_argument("--truncate-rate", type=float, default=0.0,
+                        help="Fraction of JSON replies cut off halfway through")
+    parser.add_argument("--batch-latency", type=float, default=1.0,
+                        help="Seconds before a message batch reports it has ended")
+    parser.add_argument("--replies", help="JSON file overriding the canned summary/extraction/combined replies")
+    parser.add_argument("--seed", type=int, help="Seed for latency and error injection")
+    return parser
+
+
+def configure(args):
+    """Apply parsed arguments to the handler class; returns the handler to serve."""
+    if args.seed is not None:
+        random.seed(args.seed)
+    MockLLMHandler.state = ServerState(args.requests_per_minute, args.tokens_per_minute, args.max_concurrency)
+    MockLLMHandler.distribution = args.distribution
+    MockLLMHandler.latency = args.latency
+    MockLLMHandler.sigma = args.sigma
+    MockLLMHandler.error_rate = args.error_rate
+    MockLLMHandler.rate_limit_rate = args.rate_limit_rate
+    MockLLMHandler.retry_after = args.retry_after
+    MockLLMHandler.token_latency = args.token_latency
+    MockLLMHandler.malformed_rate = args.malformed_rate
+    MockLLMHandler.truncate_rate = args.truncate_rate
+    MockLLMHandler.batch_latency = args.batch_latency
+    if args.replies:
+        with open(args.replies, 'r', encoding='utf-8') as file:
+            MockLLMHandler.replies = {**DEFAULT_REPLIES, **json.load(file)}
+    return MockLLMHandler
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    server = MockLLMServer((args.host, args.port), configure(args))
+    print(f"Serving mock Anthropic/OpenAI endpoints at http://{args.host}:{server.server_port}/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+from itertools import zip_longest
+
+from entity_index import alias_key
+
+# Routing and voting for the cascade mode of ExtractionPipeline. A small, fast model extracts every PMID
+# first; a PMID is escalated to the large model only when the small model's answer could be wrong in a way
+# that costs recall or precision: it named candidate non-associations, its JSON needed repairing, or it
+# failed. When the two models then disagree and ensemble models are configured, every model's answer is
+# put to a per-entity majority vote.
+
+
+def has_candidates(row):
+    return row["Non-Associations"].strip().lower() not in ("", "none", "n/a")
+
+
+def escalation_reason(extraction):
+    """Why the small model's Extraction should be checked by the large model, or None to keep it."""
+    if extraction.row is None:
+        return "failed"
+    if extraction.repaired:
+        return "repaired JSON"
+    if has_candidates(extraction.row):
+        return "candidates"
+    return None
+
+
+def entities(row, entity_index=None):
+    """{entity key: (name, type)} for a Results.csv row, keyed so that synonyms and spellings coincide."""
+    found = {}
+    names = [name.strip() for name in row["Non-Associations"].split(";") if name.strip()]
+    types = [kind.strip() for kind in row["Non-Association Types"].split(";") if kind.strip()]
+    for name, kind in zip_longest(names, types[:len(names)], fillvalue="N/A"):
+        if name.lower() in ("none", "n/a"):
+            continue
+        canonical = entity_index.canonical(name) if entity_index is not None else None
+        found.setdefault(alias_key(canonical or name) or name.lower(), (name, kind))
+    return found
+
+
+def disputed(first, second, entity_index=None):
+    """True when two Extractions both produced rows that name different entities or IBD types."""
+    if first.row is None or second.row is None:
+        return False
+    return (entities(first.row, entity_index).keys() != entities(second.row, entity_index).keys()
+            or first.row["IBD Type"].strip().lower() != second.row["IBD Type"].strip().lower())
+
+
+def vote(pmid, rows, entity_index=None):
+    """Majority row over rows, ordered by precedence (the large model first): an entity is kept when more
+    than half of the rows name it, with the earliest row's wording; ties on IBD type go to the earliest row."""
+    counts, names = {}, {}
+    for row in rows:
+        for key, entity in entities(row, entity_index).items():
+            counts[key] = counts.get(key, 0) + 1
+            names.setdefault(key, entity)
+    kept = [names[key] for key in names if counts[key] * 2 > len(rows)]
+
+    ibd_votes, first_seen = {}, {}
+    for position, row in enumerate(rows):
+        ibd_type = row["IBD Type"].strip()
+        ibd_votes[ibd_type.lower()] = ibd_votes.get(ibd_type.lower(), 0) + 1
+        first_seen.setdefault(ibd_type.lower(), (position, ibd_type))
+    winner = max(ibd_votes, key=lambda ibd_type: (ibd_votes[ibd_type], -first_seen[ibd_type][0]))
+    return {
+        "PMID": pmid,
+        "IBD Type": first_seen[winner][1],
+        "Non-Associations": "; ".join(name for name, _ in kept) or "none",
+        "Non-Association Types": "; ".join(kind for _, kind in kept) or "none"
+    }
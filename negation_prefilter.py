@@ -0,0 +1,131 @@
+import re
+import csv
+import argparse
+
+from abstract_corpus import open_corpus
+
+# Negation phrases from the search term in Abstract_Downloader.py. Abstracts matched only by its
+# "GWAS", "meta-analysis" or "systematic review" terms often contain none of them.
+NEGATION_PHRASES = [
+    "not associated", "no association", "lack of association", "unrelated",
+    "not correlated", "no correlation", "lack of correlation",
+    "not linked", "no link", "lack of link",
+    "not connected", "no connection", "lack of connection",
+    "not related", "lack of relation",
+    "no significant difference", "no significant association",
+    "no significant correlation", "not statistically significant",
+    "negative results", "inconclusive results", "no evidence",
+    "failed to show", "did not demonstrate", "not supported",
+    "no role", "does not play a role", "not involved"
+]
+
+# Inflected and reworded negations the fixed phrases miss ("was not significantly different",
+# "does not account for", "carry the variant at the same rate"). Deliberately broad: a false
+# cue only costs an LLM call, a missed one loses a non-association.
+NEGATION_PATTERNS = [
+    r"\b(?:not|nor)\s+(?:\w+\s+){0,2}?(?:associated|correlated|linked|related|connected|different|differ|involved"
+    r"|contribute|account|affect|influence|predict|significant)",
+    r"\b(?:did|does|do|could|was|were|is|are)\s+not\b",
+    r"\bno\s+(?:\w+\s+){0,2}?(?:association|correlation|link|connection|relation|relationship|difference|effect|role"
+    r"|evidence|contribution|influence)s?\b",
+    r"\black of\b", r"\bfailed to\b", r"\bindependent of\b", r"\bnon-?significant", r"\bneither\b",
+    r"\bsimilar\b", r"\bsame rate\b", r"\bcomparable\b"
+]
+
+# Anything that could be extracted: entity-type words, rsIDs, gene-style symbols (NOD2, IL23R, HLA-DRB1)
+ENTITY_PATTERN = (
+    r"\b(?:genes?|genetic|polymorphisms?|alleles?|SNPs?|mutations?|variants?|genotypes?|haplotypes?|proteins?"
+    r"|cytokines?|enzymes?|mRNA|expression|receptors?|interleukin|rs\d+)\b"
+    r"|\b[A-Z][A-Z0-9]*\d[A-Z0-9]*\b"
+    r"|\b(?:IL|TNF|HLA|TLR|NOD|CARD|MMP)[-\w]*"
+)
+
+# All cues are compiled into single alternations, so each abstract is scanned once per pattern
+NEGATION_CUES = re.compile("|".join([re.escape(phrase) for phrase in NEGATION_PHRASES] + NEGATION_PATTERNS),
+                           re.IGNORECASE)
+ENTITY_CUES = re.compile(ENTITY_PATTERN)
+
+CROHNS = re.compile(r"crohn", re.IGNORECASE)
+ULCERATIVE_COLITIS = re.compile(r"ulcerative colitis", re.IGNORECASE)
+IBD = re.compile(r"inflammatory bowel disease|\bIBD\b", re.IGNORECASE)
+COLITIS = re.compile(r"colitis", re.IGNORECASE)
+
+
+def screen(abstract):
+    """Return None when the abstract may report a non-association, otherwise the reason it cannot."""
+    if not NEGATION_CUES.search(abstract):
+        return "no negation cue"
+    if not ENTITY_CUES.search(abstract):
+        return "no gene, SNP or protein mention"
+    return None
+
+
+def guess_ibd_type(abstract):
+    crohns, ulcerative_colitis = bool(CROHNS.search(abstract)), bool(ULCERATIVE_COLITIS.search(abstract))
+    if crohns and ulcerative_colitis:
+        return "Crohn's Disease; Ulcerative Colitis"
+    if crohns:
+        return "Crohn's Disease"
+    if ulcerative_colitis:
+        return "Ulcerative Colitis"
+    if IBD.search(abstract):
+        return "IBD"
+    if COLITIS.search(abstract):
+        return "Colitis"
+    return "N/A"
+
+
+def prefiltered_row(pmid, abstract):
+    """Results.csv row for a screened-out abstract: no non-associations, IBD type from keywords."""
+    return {
+        "PMID": pmid,
+        "IBD Type": guess_ibd_type(abstract),
+        "Non-Associations": "none",
+        "Non-Association Types": "none"
+    }
+
+
+def read_gold_positives(gold_standard_path):
+    """PMIDs of the gold standard rows that list at least one non-association."""
+    positives = set()
+    with open(gold_standard_path, 'r', newline='', encoding='utf-8') as csvfile:
+        for row in csv.reader(csvfile, delimiter='\t'):
+            if row and row[0] != 'PMID' and len(row) > 2 and row[2].strip().lower() not in ('', 'none', 'n/a'):
+                positives.add(row[0].strip())
+    return positives
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report how many abstracts the negation pre-filter would skip "
+                                                 "and check it against a gold standard.")
+    parser.add_argument("abstracts", help="Directory of PMID_<id>_abstract.txt files or a packed corpus")
+    parser.add_argument("--gold-standard", default="gold_standard.csv")
+    parser.add_argument("--strategy", choices=["two_call", "combined"], default="two_call",
+                        help="Extraction strategy, for the number of LLM calls saved per skipped abstract")
+    args = parser.parse_args(argv)
+
+    corpus = open_corpus(args.abstracts)
+    reasons = {}
+    skipped = set()
+    for pmid, abstract in corpus:
+        reason = screen(abstract)
+        if reason is not None:
+            skipped.add(pmid)
+            reasons[reason] = reasons.get(reason, 0) + 1
+    calls_per_abstract = 1 if args.strategy == 'combined' else 2
+    print(f"Screened {len(corpus)} abstracts; {len(skipped)} would be written as 'none' without an LLM call "
+          f"({len(skipped) * calls_per_abstract} calls saved)")
+    for reason, count in sorted(reasons.items()):
+        print(f"  {reason}: {count}")
+
+    positives = {pmid for pmid in read_gold_positives(args.gold_standard) if pmid in corpus}
+    lost = sorted(positives & skipped, key=int)
+    print(f"Gold standard abstracts with non-associations kept: {len(positives) - len(lost)}/{len(positives)}")
+    for pmid in lost:
+        print(f"  Lost PMID {pmid}")
+    corpus.close()
+    return 1 if lost else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+from extraction_schema import TOOL_NAME
+
+# Role preamble, sent once per request as the system prompt so only the objective and the abstract or summary
+# vary between calls. Each style keeps the wording its study scripts sent: the Claude one as
+# Anthropic_with_Summaries.py opened its prompts, and the GPT one as the OpenAI extractor's system message,
+# without the "Role:" prefix and with its "quoated" spelling left as it was
+ROLE_PROMPT = "Role: You are an expert molecular biologist focused on IBD research. You are to find specific, explicitly quoted non-associations with IBD pathogenesis ONLY pertaining to genes, proteins, enzymes, cytokines, mRNA, alleles and SNPs; ignore anything else entirely, and when summarising abstracts only write about the biologics we're looking for. It is imperative that you are extremely strict with your classifications for non-associations, and to be as agonizingly specific pertaining to said non-associations. It is important that you do not conflate singular polymorphisms with whole genes, as an SNP within a gene might be non-associative but that might not be true for the rest of the gene. Do not concern yourself with association factors pertaining to other disease states, such as glucocorticoid resistance in IBD patients; ignore drugs or any administered biologic agents entirely; do not confuse associations with non-associations, especially associations that could play a role in the pathogenesis of IBD; be careful to not conflate biologics with no mutual basis with each other as non-associations with IBD itself."
+GPT_ROLE_PROMPT = "You are an expert molecular biologist focused on IBD research. You are to find specific, explicitly quoated non-associations with IBD pathogenesis ONLY pertaining to genes, proteins, enzymes, cytokines, mRNA, alleles and SNPs; ignore anything else entirely, and when summarising abstracts only write about the biologics we're looking for. It is imperative that you are extremely strict with your classifications for non-associations, and to be as agonizingly specific pertaining to said non-associations. It is important that you do not conflate singular polymorphisms with whole genes, as an SNP within a gene might be non-associative but that might not be true for the rest of the gene. Do not concern yourself with association factors pertaining to other disease states, such as glucocorticoid resistance in IBD patients; ignore drugs or any administered biologic agents entirely; do not confuse associations with non-associations, especially associations that could play a role in the pathogenesis of IBD; be careful to not conflate biologics with no mutual basis with each other as non-associations with IBD itself."
+
+# How a packed summary request (several abstracts in one prompt; see abstract_packing.py) asks for its reply
+PACKING_INSTRUCTIONS = "There are {count} abstracts below, each starting with a line of the form \"### PMID <number>\". Write one summary per abstract, in the same order, each starting with that abstract's own \"### PMID <number>\" line, and write nothing before the first of those lines."
+
+# Prompt templates per style. 'claude' is the wording used with the Anthropic models and 'gpt' the
+# wording used with the OpenAI models in the study; both produce the same JSON layout.
+CLAUDE_SUMMARY_PROMPT = """
+    Objective: Based on the following abstract, provide a concise justified summary of any explicitly mentioned non-associated genes, proteins, SNPs, enzymes, and cytokines with the pathogenesis of inflammatory bowel diseases (IBD). Focus only on these specific biological entities and their non-associations with IBD; exclude information pertaining to immune cells, haplotypes, environmental factors, bacteria, diseases, etc.
+
+    Abstract: {abstract}
+    """
+
+CLAUDE_EXTRACTION_PROMPT = """
+    Objective: Produce a JSON from this abstract summary to extract explicitly mentioned non-associated genes, proteins, SNPs, enzymes and cytokines with the pathogenesis of IBD. The format should be:
+    {{
+        "IBD Type": "IBD/Crohn's Disease/Ulcerative Colitis/Colitis or N/A if it's a non-IBD related summary",
+        "Non-Associations": ["list of non-associated genes, proteins, SNPs, enzymes, cytokines, mRNA or alleles; do not include descriptions and keep to just acronyms for naming"],
+        "Non-Association Types": ["array of types in order of the non-associations named; gene/protein/SNP/enzyme/cytokine/mRNA/allele or N/A if not explicitly in this format"]
+    }}
+
+    IMPORTANT: Provide ONLY the JSON response without any additional formatting, backticks, code blocks, or any other text. ONLY include the JSON itself, and nothing else.
+
+    Summary: {summary}
+    """
+
+CLAUDE_COMBINED_PROMPT = """
+    Objective: Based on the following abstract, provide a concise justified summary of any explicitly mentioned non-associated genes, proteins, SNPs, enzymes, and cytokines with the pathogenesis of inflammatory bowel diseases (IBD), then extract those non-associations. Focus only on these specific biological entities and their non-associations with IBD; exclude information pertaining to immune cells, haplotypes, environmental factors, bacteria, diseases, etc. Record both the summary and the extraction with the {tool_name} tool; do not include descriptions and keep to just acronyms for naming the non-associations.
+
+    Abstract: {abstract}
+    """
+
+CLAUDE_PACKED_SUMMARY_PROMPT = """
+    Objective: Based on each of the following abstracts, provide a concise justified summary of any explicitly mentioned non-associated genes, proteins, SNPs, enzymes, and cytokines with the pathogenesis of inflammatory bowel diseases (IBD). Focus only on these specific biological entities and their non-associations with IBD; exclude information pertaining to immune cells, haplotypes, environmental factors, bacteria, diseases, etc. Summarise every abstract on its own and never carry a finding from one abstract into another's summary.
+
+    {packing_instructions}
+
+    {abstracts}
+    """
+
+GPT_SUMMARY_PROMPT = """
+    Based on the following abstract, provide a concise justified summary of any explicitly mentioned non-associated genes, proteins, SNPs, enzymes, mRNA, alleles and cytokines with the pathogenesis of inflammatory bowel diseases (IBD). Focus only on these specific biological entities and their explicit non-associations with IBD pathogenesis; exclude information pertaining to immune cells, haplotypes, environmental factors, bacteria, diseases, drugs, etc.
+
+    Abstract: {abstract}
+    """
+
+GPT_PACKED_SUMMARY_PROMPT = """
+    Based on each of the following abstracts, provide a concise justified summary of any explicitly mentioned non-associated genes, proteins, SNPs, enzymes, mRNA, alleles and cytokines with the pathogenesis of inflammatory bowel diseases (IBD). Focus only on these specific biological entities and their explicit non-associations with IBD pathogenesis; exclude information pertaining to immune cells, haplotypes, environmental factors, bacteria, diseases, drugs, etc. Summarise every abstract on its own and never carry a finding from one abstract into another's summary.
+
+    {packing_instructions}
+
+    {abstracts}
+    """
+
+GPT_EXTRACTION_PROMPT = """
+    Produce a JSON from this abstract summary to extract explicitly mentioned non-associated genes, proteins, SNPs, enzymes and cytokines with the pathogenesis of IBD. The format should be:
+    {{
+        "IBD Type": ["IBD/Crohn's Disease/Ulcerative Colitis/Colitis, or N/A if it's a non-IBD related summary; the study participants determine IBD type."],
+        "Non-Associations": ["list of non-associated genes, proteins, SNPs, enzymes, cytokines, mRNAs or alleles; do not include descriptions and keep to just acronyms for naming if the summary used said acronym, don't include 'gene' or 'mutation' as part the non-association name; avoid extracting drugs, bacteria, cells, diseases, environmental factors and haplotypes."],
+        "Non-Association Types": ["array of types in order of the non-associations named; gene/protein/SNP/enzyme/cytokine/mRNA/allele or N/A if not explicitly in this format."]
+    }}
+
+    IMPORTANT: Provide ONLY the JSON response without any additional formatting, backticks, code blocks, or any other text. ONLY include the JSON itself, and nothing else.
+    IMPORTANT: Make sure you stick to the provided JSON format, do not add verbatim quotes from this format guide as that would be erroneous.
+
+    Summary: {summary}
+    """
+
+GPT_COMBINED_PROMPT = """
+    Based on the following abstract, provide a concise justified summary of any explicitly mentioned non-associated genes, proteins, SNPs, enzymes, mRNA, alleles and cytokines with the pathogenesis of inflammatory bowel diseases (IBD), then extract those non-associations. Focus only on these specific biological entities and their explicit non-associations with IBD pathogenesis; exclude information pertaining to immune cells, haplotypes, environmental factors, bacteria, diseases, drugs, etc. For the IBD type, the study participants determine IBD type. Keep to just acronyms for naming if the summary used said acronym, and don't include 'gene' or 'mutation' as part of the non-association name.
+
+    Abstract: {abstract}
+    """
+
+PROMPT_STYLES = {
+    "claude": {
+        "summary": CLAUDE_SUMMARY_PROMPT,
+        "packed_summary": CLAUDE_PACKED_SUMMARY_PROMPT,
+        "extraction": CLAUDE_EXTRACTION_PROMPT,
+        "combined": CLAUDE_COMBINED_PROMPT,
+        "role": ROLE_PROMPT
+    },
+    "gpt": {
+        "summary": GPT_SUMMARY_PROMPT,
+        "packed_summary": GPT_PACKED_SUMMARY_PROMPT,
+        "extraction": GPT_EXTRACTION_PROMPT,
+        "combined": GPT_COMBINED_PROMPT,
+        "role": GPT_ROLE_PROMPT
+    }
+}
+
+
+def role_prompt(style="claude"):
+    return PROMPT_STYLES[style]["role"]
+
+
+def generate_summary_prompt(abstract, style="claude"):
+    return PROMPT_STYLES[style]["summary"].format(abstract=abstract)
+
+
+def generate_packed_summary_prompt(abstracts, style="claude"):
+    """Summary prompt for several (pmid, abstract) pairs, asking for one summary per PMID under its heading."""
+    return PROMPT_STYLES[style]["packed_summary"].format(
+        packing_instructions=PACKING_INSTRUCTIONS.format(count=len(abstracts)),
+        abstracts="\n\n".join(f"### PMID {pmid}\n{abstract}" for pmid, abstract in abstracts)
+    )
+
+
+def generate_extraction_prompt(summary, style="claude"):
+    return PROMPT_STYLES[style]["extraction"].format(summary=summary)
+
+
+def generate_combined_prompt(abstract, style="claude"):
+    return PROMPT_STYLES[style]["combined"].format(abstract=abstract, tool_name=TOOL_NAME)
@@ -0,0 +1,160 @@
+import time
+import random
+import asyncio
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used before the real usage is known."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding at most one minute's worth of units."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they already are)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta):
+        """Debit (positive) or credit (negative) units once the real cost is known."""
+        self._refill()
+        self.level = min(self.capacity, self.level - delta)
+
+    def clamp(self, available):
+        """Never assume more units than the server says are left."""
+        self._refill()
+        self.level = min(self.level, available)
+
+
+class RateLimiter:
+    """Requests/min and tokens/min limits shared by every coroutine of a run.
+
+    Callers acquire with an estimated token cost and report the real usage afterwards,
+    so the token bucket tracks what the API actually billed.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, estimated_tokens):
+        # Holding the lock while sleeping keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                delay = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+def backoff_delay(attempt, base, retry_after=None, cap=60.0):
+    """Seconds to wait before retry number attempt + 1: the server's retry-after when it sent one,
+    otherwise exponential backoff from base with jitter so concurrent callers do not retry in lockstep."""
+    if retry_after is not None:
+        return retry_after
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def exhausted_wait(rate_limits):
+    """Seconds until the limit resets if the rate-limit headers report no requests or tokens left, else 0."""
+    if not rate_limits:
+        return 0.0
+    wait = 0.0
+    for kind in ("requests", "tokens"):
+        remaining = rate_limits.get(f"{kind}_remaining")
+        if remaining is not None and remaining <= 0:
+            wait = max(wait, rate_limits.get(f"{kind}_reset") or 0.0)
+    return wait
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """RateLimiter plus an AIMD concurrency window steered by the provider's responses.
+
+    At most `window` calls are in flight, starting at max_concurrency. Each success widens the window by
+    1/window (about one slot per window's worth of successes); a retryable error halves it, down to one,
+    at most once per round of calls so a burst of 429s from the same round counts once. A retry-after,
+    or rate-limit headers reporting nothing left, pause new calls until the server's reset, and the
+    remaining counts clamp the token buckets.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_concurrency):
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.window = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.decreases = 0
+        self._slots = asyncio.Condition()
+
+    async def acquire(self, estimated_tokens):
+        """Take a concurrency slot and the rate budget for one call; pair every acquire with release()."""
+        while True:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            async with self._slots:
+                if self.in_flight < int(self.window):
+                    self.in_flight += 1
+                    break
+                await self._slots.wait()
+        try:
+            await super().acquire(estimated_tokens)
+        except BaseException:
+            await self.release()
+            raise
+        return time.monotonic()
+
+    async def release(self):
+        async with self._slots:
+            self.in_flight -= 1
+            self._slots.notify_all()
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def on_success(self, rate_limits=None):
+        self.window = min(float(self.max_concurrency), self.window + 1 / self.window)
+        if rate_limits:
+            if rate_limits.get("requests_remaining") is not None:
+                self.requests.clamp(rate_limits["requests_remaining"])
+            if rate_limits.get("tokens_remaining") is not None:
+                self.tokens.clamp(rate_limits["tokens_remaining"])
+            wait = exhausted_wait(rate_limits)
+            if wait > 0:
+                self.pause(wait)
+
+    def on_retryable_error(self, started, retry_after=None):
+        """A call that acquired its slot at `started` (acquire's return value) hit a retryable error."""
+        if started >= self.last_decrease:
+            self.window = max(1.0, self.window / 2)
+            self.last_decrease = time.monotonic()
+            self.decreases += 1
+        if retry_after:
+            self.pause(retry_after)
@@ -0,0 +1,78 @@
+import json
+import time
+import sqlite3
+import hashlib
+
+
+class ResponseCache:
+    """Disk-backed cache of LLM responses, keyed on everything that determines the reply.
+
+    Entries are evicted least-recently-used once more than max_entries are stored.
+    With bypass=True lookups always miss, but fresh responses are still stored, so a
+    bypassed run refreshes the cache instead of ignoring it. Calls with temperature above 0
+    are not cached unless cache_sampled=True, so replicate runs still draw fresh samples.
+    """
+
+    def __init__(self, path="response_cache.sqlite", max_entries=100000, bypass=False, cache_sampled=False):
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.cache_sampled = cache_sampled
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def make_key(self, model, max_tokens, temperature, system, prompt):
+        """Return the cache key for a call, or None if the call should not be cached."""
+        if temperature > 0 and not self.cache_sampled:
+            return None
+        payload = json.dumps([model, max_tokens, temperature, system, prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if key is None or self.bypass:
+            self.misses += 1
+            return None
+        row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time_ns(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key, response):
+        if key is None:
+            return
+        existed = self.conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)",
+            (key, response, time.time_ns())
+        )
+        if not existed:
+            self.entries += 1
+        if self.entries > self.max_entries:
+            excess = self.entries - self.max_entries
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self.entries -= excess
+        self.conn.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": self.entries}
+
+    def report(self):
+        print(f"Response cache: {self.hits} hits, {self.misses} misses, {self.entries} entries stored")
+
+    def close(self):
+        self.conn.close()
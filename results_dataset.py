@@ -0,0 +1,336 @@
+import os
+import csv
+import re
+import time
+import hashlib
+import argparse
+from urllib.parse import quote
+
+from model_cascade import entities
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # The TSV outputs are unaffected; only the columnar dataset needs pyarrow
+    pa = None
+
+# A results dataset is a directory of Parquet files with one row per (run, PMID, non-associated entity):
+# the "; "-joined cells of Results.csv exploded, so cross-run questions are columnar scans rather than
+# reparsing every TSV. Each run is its own Hive partition, run=<name>/part-0.parquet, written whole and
+# renamed into place, so runs can be added (or rewritten) while others query the dataset. Exporting a run
+# under an existing name replaces its partition, and is skipped when the Results.csv and settings it came
+# from (fingerprinted in the file's metadata) have not changed, so resumes and repeated merges add nothing.
+# A PMID with no non-associations keeps one row with a null entity, so every run still records which PMIDs
+# it covered.
+# entity_key is the lookup key from entity_index.alias_key, under which spellings such as "IL-6" and "il6"
+# coincide, and entity_id a 64-bit hash of it: the queries group and count on the integer columns (pmid,
+# entity_id) and per-run fragments, and read names only for the entities in the answer, because hashing
+# millions of strings is what would keep a query from finishing in well under a second.
+COLUMNS = ("pmid", "ibd_type", "entity", "entity_key", "entity_id", "entity_type", "model", "temperature",
+           "strategy")
+REPLICATE_PATTERN = re.compile(r'_\d+\.csv$')
+
+
+def schema():
+    return pa.schema([("pmid", pa.int64()), ("ibd_type", pa.string()), ("entity", pa.string()),
+                      ("entity_key", pa.string()), ("entity_id", pa.int64()), ("entity_type", pa.string()),
+                      ("model", pa.string()), ("temperature", pa.float64()), ("strategy", pa.string())])
+
+
+def run_name(output_csv):
+    """Default run name: the output file's stem, so resuming into the same output replaces its partition."""
+    return os.path.splitext(os.path.basename(output_csv))[0]
+
+
+def source_fingerprint(results_csv, model=None, temperature=None, strategy=None):
+    """Hash of a Results.csv and the settings it is exported with."""
+    digest = hashlib.blake2b(repr((model, temperature, strategy)).encode('utf-8'), digest_size=16)
+    with open(results_csv, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def partition_path(dataset_dir, run):
+    return os.path.join(dataset_dir, f"run={quote(run, safe='')}")
+
+
+def is_current(dataset_dir, run, source):
+    """Whether run's partition was written from the source with this fingerprint."""
+    path = os.path.join(partition_path(dataset_dir, run), "part-0.parquet")
+    if not os.path.isfile(path):
+        return False
+    metadata = pq.read_schema(path).metadata or {}
+    return metadata.get(b"source") == source.encode('utf-8')
+
+
+def entity_id(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def explode(rows, model=None, temperature=None, strategy=None):
+    """Columns of the exploded dataset for Results.csv rows (dicts with its four headings)."""
+    columns = {column: [] for column in COLUMNS}
+    for row in rows:
+        found = entities(row) or {None: (None, None)}
+        for key, (name, kind) in found.items():
+            values = (int(row["PMID"]), row["IBD Type"].strip(), name, key, None if key is None else entity_id(key),
+                      kind, model, temperature, strategy)
+            for column, value in zip(COLUMNS, values):
+                columns[column].append(value)
+    return columns
+
+
+def write_run(dataset_dir, run, rows, model=None, temperature=None, strategy=None, source=None):
+    """Write (or replace) one run's partition from Results.csv rows; returns the number of rows written.
+
+    source is the fingerprint of what the rows came from, kept in the file's metadata (see is_current).
+    """
+    table = pa.Table.from_pydict(explode(rows, model, temperature, strategy), schema=schema())
+    if source is not None:
+        table = table.replace_schema_metadata({"source": source})
+    partition = partition_path(dataset_dir, run)
+    os.makedirs(partition, exist_ok=True)
+    path = os.path.join(partition, "part-0.parquet")
+    # Dot files are skipped by dataset discovery, so a half-written file is never read
+    tmp_path = os.path.join(partition, f".part-0.{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    # Anything else in the partition belongs to an earlier version of the run
+    for name in os.listdir(partition):
+        if name != "part-0.parquet" and not name.startswith("."):
+            os.remove(os.path.join(partition, name))
+    return table.num_rows
+
+
+def read_results(results_csv):
+    with open(results_csv, 'r', newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile, delimiter='\t'):
+            # gold_standard.csv heads the types column "Non-Associations Types"
+            if "Non-Association Types" not in row:
+                row["Non-Association Types"] = row.get("Non-Associations Types") or ""
+            yield row
+
+
+def export_run(dataset_dir, results_csv, run=None, model=None, temperature=None, strategy=None):
+    """Add a finished run's Results.csv to the dataset, replacing a run of the same name; returns the run name,
+    or None without pyarrow. Nothing is written if the run's partition already holds this file and settings.
+    """
+    if pa is None:
+        print("pyarrow is not installed (pip install pyarrow); the results dataset was not written")
+        return None
+    if not os.path.isfile(results_csv):
+        return None
+    run = run or run_name(results_csv)
+    source = source_fingerprint(results_csv, model, temperature, strategy)
+    if is_current(dataset_dir, run, source):
+        print(f"Run {run} in the results dataset is already up to date with {results_csv}")
+        return run
+    rows = write_run(dataset_dir, run, read_results(results_csv), model, temperature, strategy, source)
+    print(f"Added run {run} ({rows} rows) to the results dataset in {dataset_dir}")
+    return run
+
+
+def add_tree(dataset_dir, main_folder):
+    """Add every replicate file of a Metrics_Calculator.py folder tree (<strategy>/<temperature>/*_<n>.csv)
+    as run <strategy>/<temperature>/<file stem>; returns the run names."""
+    runs = []
+    for root, dirs, files in os.walk(main_folder):
+        dirs.sort()
+        parts = os.path.relpath(root, main_folder).split(os.sep)
+        if len(parts) != 2:
+            continue
+        strategy, temperature = parts
+        try:
+            temperature_value = float(temperature)
+        except ValueError:
+            temperature_value = None
+        for file in sorted(files):
+            if REPLICATE_PATTERN.search(file):
+                run = f"{strategy}/{temperature}/{os.path.splitext(file)[0]}"
+                write_run(dataset_dir, run, read_results(os.path.join(root, file)), temperature=temperature_value,
+                          strategy=strategy)
+                runs.append(run)
+    return runs
+
+
+def open_dataset(dataset_dir):
+    return ds.dataset(dataset_dir, format="parquet", partitioning="hive", schema=schema().append(
+        pa.field("run", pa.string())))
+
+
+def fragments(dataset, runs=None):
+    """(run, fragment) for each run's Parquet file, in run order."""
+    found = []
+    for fragment in dataset.get_fragments(filter=pc.field("run").isin(runs) if runs else None):
+        found.append((ds.get_partition_keys(fragment.partition_expression)["run"], fragment))
+    return sorted(found, key=lambda item: item[0])
+
+
+def per_run_unique(dataset, column, runs=None, expression=None):
+    """Each run's distinct values of column, concatenated: value_counts of it counts runs per value."""
+    values = [pc.unique(fragment.to_table(schema=dataset.schema, columns=[column], filter=expression)[column])
+              for _, fragment in fragments(dataset, runs)]
+    return pa.concat_arrays([value.combine_chunks() if hasattr(value, "combine_chunks") else value
+                             for value in values]) if values else pa.array([], pa.int64())
+
+
+def run_counts(values, column, count):
+    counts = pc.value_counts(values)
+    return pa.table({column: counts.field("values"), count: counts.field("counts")})
+
+
+def entity_names(dataset, entity_ids, runs=None):
+    """entity_id, entity and entity_type of each distinct id, as first written in run order.
+
+    Runs are read one at a time until every id is named, which for entities reported by several runs is
+    usually the first one."""
+    remaining = pc.unique(entity_ids)
+    tables = []
+    for _, fragment in fragments(dataset, runs):
+        if not len(remaining):
+            break
+        found = fragment.to_table(schema=dataset.schema, columns=["entity_id", "entity", "entity_type"],
+                                  filter=pc.field("entity_id").isin(remaining))
+        found = found.group_by("entity_id", use_threads=False).aggregate([("entity", "first"),
+                                                                          ("entity_type", "first")])
+        tables.append(found.rename_columns(["entity_id", "entity", "entity_type"]))
+        remaining = remaining.filter(pc.invert(pc.is_in(remaining, found["entity_id"])))
+    if not tables:
+        return pa.table({"entity_id": pa.array([], pa.int64()), "entity": pa.array([], pa.string()),
+                         "entity_type": pa.array([], pa.string())})
+    return pa.concat_tables(tables)
+
+
+def with_names(dataset, table, runs=None):
+    """table with the entity and entity_type of its entity_id column, keeping its row order."""
+    names = entity_names(dataset, table["entity_id"], runs)
+    rows = pc.index_in(table["entity_id"], value_set=names["entity_id"])
+    return table.append_column("entity", names["entity"].take(rows)).append_column(
+        "entity_type", names["entity_type"].take(rows))
+
+
+def list_runs(dataset, runs=None):
+    """One row per run: PMIDs covered, non-associations, model, temperature and strategy."""
+    rows = []
+    for run, fragment in fragments(dataset, runs):
+        table = fragment.to_table(schema=dataset.schema, columns=["pmid", "entity_id"])
+        settings = fragment.head(1, columns=["model", "temperature", "strategy"]).to_pylist()
+        rows.append({"run": run, "pmids": pc.count_distinct(table["pmid"]).as_py(),
+                     "non_associations": table.num_rows - table["entity_id"].null_count,
+                     **(settings[0] if settings else {"model": None, "temperature": None, "strategy": None})})
+    return pa.Table.from_pylist(rows, schema=pa.schema([
+        ("run", pa.string()), ("pmids", pa.int64()), ("non_associations", pa.int64()), ("model", pa.string()),
+        ("temperature", pa.float64()), ("strategy", pa.string())]))
+
+
+def recurrent(dataset, min_abstracts=2, runs=None, entity_type=None):
+    """Entities reported non-associated in at least min_abstracts distinct PMIDs, most reported first."""
+    expression = pc.field("entity_id").is_valid()
+    if entity_type:
+        expression &= pc.utf8_lower(pc.field("entity_type")) == entity_type.lower()
+    if runs:
+        table = dataset.to_table(columns=["entity_id", "pmid"], filter=expression & pc.field("run").isin(runs))
+    else:
+        table = dataset.to_table(columns=["entity_id", "pmid"], filter=expression)
+    counts = table.group_by(["entity_id", "pmid"]).aggregate([]).group_by("entity_id").aggregate([
+        ([], "count_all")]).rename_columns(["entity_id", "abstracts"])
+    counts = counts.filter(pc.field("abstracts") >= min_abstracts)
+    counts = counts.join(run_counts(per_run_unique(dataset, "entity_id", runs, expression), "entity_id", "runs"),
+                         "entity_id")
+    counts = with_names(dataset, counts.sort_by([("abstracts", "descending"), ("entity_id", "ascending")]), runs)
+    return counts.select(["entity", "entity_type", "abstracts", "runs", "entity_id"])
+
+
+def disagreements(dataset, runs=None):
+    """(PMID, entity) pairs reported by some but not all of the runs that covered the PMID."""
+    expression = pc.field("entity_id").is_valid()
+    if runs:
+        expression &= pc.field("run").isin(runs)
+    # Each run has one row per (PMID, entity), so its row count is the number of runs reporting it
+    reported = dataset.to_table(columns=["pmid", "entity_id"], filter=expression).group_by(
+        ["pmid", "entity_id"]).aggregate([([], "count_all")]).rename_columns(["pmid", "entity_id", "reporting"])
+    joined = reported.join(run_counts(per_run_unique(dataset, "pmid", runs), "pmid", "covering"), "pmid")
+    joined = joined.filter(pc.field("reporting") < pc.field("covering"))
+    joined = joined.append_column("agreement", pc.divide(pc.cast(joined["reporting"], pa.float64()),
+                                                         joined["covering"]))
+    joined = joined.sort_by([("pmid", "ascending"), ("reporting", "ascending"), ("entity_id", "ascending")])
+    return with_names(dataset, joined, runs).select(["pmid", "entity", "reporting", "covering", "agreement",
+                                                    "entity_id"])
+
+
+def ibd_type_disagreements(dataset, runs=None):
+    """PMIDs that the runs gave different IBD types, with the types given."""
+    types = [fragment.to_table(schema=dataset.schema, columns=["pmid", "ibd_type"]).group_by(
+        ["pmid", "ibd_type"]).aggregate([]) for _, fragment in fragments(dataset, runs)]
+    if not types:
+        return pa.table({"pmid": pa.array([], pa.int64()), "types": pa.array([], pa.int64()),
+                         "ibd_types": pa.array([], pa.list_(pa.string()))})
+    types = pa.concat_tables(types).group_by("pmid").aggregate([("ibd_type", "count_distinct"),
+                                                                 ("ibd_type", "distinct")])
+    types = types.rename_columns(["pmid", "types", "ibd_types"]).filter(pc.field("types") > 1)
+    return types.sort_by("pmid")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query the columnar results dataset: one row per "
+                                                 "run, PMID and non-associated entity.")
+    parser.add_argument("dataset", help="Dataset directory, e.g. results_dataset")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_parser = commands.add_parser("add", help="Add a Results.csv as a run")
+    add_parser.add_argument("results")
+    add_parser.add_argument("--run", help="Run name (defaults to the file's stem; an existing run of that name is replaced)")
+    add_parser.add_argument("--model")
+    add_parser.add_argument("--temperature", type=float)
+    add_parser.add_argument("--strategy")
+    tree_parser = commands.add_parser("add-tree", help="Add every replicate file of a Metrics_Calculator.py tree")
+    tree_parser.add_argument("main_folder")
+    runs_parser = commands.add_parser("runs", help="List the runs with their PMID and non-association counts")
+    recurrent_parser = commands.add_parser("recurrent", help="Entities reported non-associated in >= N abstracts")
+    recurrent_parser.add_argument("--min-abstracts", type=int, default=2)
+    recurrent_parser.add_argument("--type", help="Only entities of this type, e.g. gene or SNP")
+    disagree_parser = commands.add_parser("disagreements",
+                                          help="Entities (or with --ibd-type, IBD types) the runs disagree on")
+    disagree_parser.add_argument("--ibd-type", action="store_true")
+    for query_parser in (runs_parser, recurrent_parser, disagree_parser):
+        query_parser.add_argument("--runs", nargs="+", help="Only these runs (default: every run)")
+        query_parser.add_argument("--limit", type=int, default=50, help="Rows to print (0 prints all)")
+        query_parser.add_argument("--csv", help="Also write the full answer to this tab-separated file")
+    args = parser.parse_args(argv)
+    if pa is None:
+        parser.error("pyarrow is required: pip install pyarrow")
+
+    if args.command == "add":
+        export_run(args.dataset, args.results, args.run, args.model, args.temperature, args.strategy)
+        return
+    if args.command == "add-tree":
+        runs = add_tree(args.dataset, args.main_folder)
+        print(f"Added {len(runs)} runs from {args.main_folder} to {args.dataset}")
+        return
+
+    if not os.path.isdir(args.dataset):
+        parser.error(f"no results dataset at {args.dataset}")
+    start = time.perf_counter()
+    dataset = open_dataset(args.dataset)
+    if args.command == "runs":
+        answer = list_runs(dataset, args.runs)
+    elif args.command == "recurrent":
+        answer = recurrent(dataset, args.min_abstracts, args.runs, args.type)
+    elif args.ibd_type:
+        answer = ibd_type_disagreements(dataset, args.runs)
+    else:
+        answer = disagreements(dataset, args.runs)
+    seconds = time.perf_counter() - start
+
+    shown = answer if not args.limit else answer.slice(0, args.limit)
+    print(shown.to_pandas().to_string(index=False))
+    print(f"{answer.num_rows} rows in {seconds:.3f}s" + (f" (first {shown.num_rows} shown)"
+                                                         if shown.num_rows < answer.num_rows else ""))
+    if args.csv:
+        answer.to_pandas().to_csv(args.csv, sep='\t', index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import os
+import csv
+import time
+import sqlite3
+import argparse
+
+RESULT_HEADER = ["PMID", "IBD Type", "Non-Associations", "Non-Association Types"]
+
+# A PMID moves pending -> summarised -> extracted, or to failed with the error that stopped it. A failure
+# whose error was transient (rate limits, overload, timeouts) that outlasted every retry is also put on
+# the dead-letter queue: it is skipped by later runs until requeue_dead_letters() releases it.
+STATUSES = ("pending", "summarised", "extracted", "failed")
+
+
+class ResultsStore:
+    """Transactional per-PMID checkpoint store (SQLite in WAL mode).
+
+    Every state change is one committed transaction, so killing the process at any point leaves each
+    PMID either fully recorded or untouched. Results.csv/Summaries.csv are produced on demand with
+    export_tsv, in the same tab-separated layout the extractors have always written. WAL needs memory
+    shared between the processes using the file, so a store on a network filesystem is opened with
+    journal_mode="DELETE" instead.
+    """
+
+    def __init__(self, path="results.sqlite", journal_mode="WAL"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "pmid TEXT PRIMARY KEY, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT, "
+            "summary TEXT, "
+            "ibd_type TEXT, "
+            "non_associations TEXT, "
+            "non_association_types TEXT, "
+            "input_tokens INTEGER NOT NULL DEFAULT 0, "
+            "output_tokens INTEGER NOT NULL DEFAULT 0, "
+            "cache_write_tokens INTEGER NOT NULL DEFAULT 0, "
+            "cache_read_tokens INTEGER NOT NULL DEFAULT 0, "
+            "dead_letter INTEGER NOT NULL DEFAULT 0, "
+            "updated_at REAL NOT NULL)"
+        )
+        columns = {column[1] for column in self.conn.execute("PRAGMA table_info(results)")}
+        if "dead_letter" not in columns:
+            self.conn.execute("ALTER TABLE results ADD COLUMN dead_letter INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_status ON results (status)")
+        self.conn.commit()
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM results LIMIT 1").fetchone() is None
+
+    def get(self, pmid):
+        cursor = self.conn.execute("SELECT * FROM results WHERE pmid = ?", (pmid,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def finished_pmids(self, max_attempts=3):
+        """PMIDs a run should skip: extracted, failed max_attempts times, or dead-lettered."""
+        rows = self.conn.execute(
+            "SELECT pmid FROM results WHERE status = 'extracted' "
+            "OR (status = 'failed' AND (attempts >= ? OR dead_letter = 1))",
+            (max_attempts,)
+        )
+        return {pmid for (pmid,) in rows}
+
+    def start(self, pmid):
+        """Count a new attempt; a summary from an earlier attempt is kept for reuse."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO results (pmid, attempts, updated_at) VALUES (?, 1, ?) "
+                "ON CONFLICT (pmid) DO UPDATE SET attempts = attempts + 1, error = NULL, "
+                "status = CASE WHEN status = 'summarised' THEN 'summarised' ELSE 'pending' END, "
+                "updated_at = excluded.updated_at",
+                (pmid, time.time())
+            )
+
+    def add_usage(self, pmid, usage):
+        with self.conn:
+            self._add_usage(pmid, usage)
+
+    def _add_usage(self, pmid, usage):
+        if not usage:
+            return
+        self.conn.execute(
+            "UPDATE results SET input_tokens = input_tokens + ?, output_tokens = output_tokens + ?, "
+            "cache_write_tokens = cache_write_tokens + ?, cache_read_tokens = cache_read_tokens + ? "
+            "WHERE pmid = ?",
+            (usage.get("input_tokens", 0), usage.get("output_tokens", 0),
+             usage.get("cache_write_tokens", 0), usage.get("cache_read_tokens", 0), pmid)
+        )
+
+    def record_summary(self, pmid, summary, usage=None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO results (pmid, status, summary, updated_at) VALUES (?, 'summarised', ?, ?) "
+                "ON CONFLICT (pmid) DO UPDATE SET status = 'summarised', summary = excluded.summary, "
+                "updated_at = excluded.updated_at",
+                (pmid, summary, time.time())
+            )
+            self._add_usage(pmid, usage)
+
+    def record_extraction(self, pmid, row, usage=None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO results (pmid, status, ibd_type, non_associations, non_association_types, updated_at) "
+                "VALUES (?, 'extracted', ?, ?, ?, ?) "
+                "ON CONFLICT (pmid) DO UPDATE SET status = 'extracted', error = NULL, "
+                "ibd_type = excluded.ibd_type, non_associations = excluded.non_associations, "
+                "non_association_types = excluded.non_association_types, updated_at = excluded.updated_at",
+                (pmid, row["IBD Type"], row["Non-Associations"], row["Non-Association Types"], time.time())
+            )
+            self._add_usage(pmid, usage)
+
+    def record_failure(self, pmid, error, usage=None, dead_letter=False):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO results (pmid, status, error, attempts, dead_letter, updated_at) "
+                "VALUES (?, 'failed', ?, 1, ?, ?) "
+                "ON CONFLICT (pmid) DO UPDATE SET status = 'failed', error = excluded.error, "
+                "dead_letter = excluded.dead_letter, updated_at = excluded.updated_at",
+                (pmid, error, int(dead_letter), time.time())
+            )
+            self._add_usage(pmid, usage)
+
+    def dead_letters(self):
+        """(pmid, attempts, error) for every PMID on the dead-letter queue."""
+        return self.conn.execute(
+            "SELECT pmid, attempts, error FROM results WHERE dead_letter = 1 ORDER BY CAST(pmid AS INTEGER)"
+        ).fetchall()
+
+    def requeue_dead_letters(self):
+        """Release the dead-letter queue so the next run retries those PMIDs with a fresh attempt count."""
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE results SET dead_letter = 0, attempts = 0, updated_at = ? WHERE dead_letter = 1",
+                (time.time(),)
+            )
+        return cursor.rowcount
+
+    def counts(self):
+        counts = {status: 0 for status in STATUSES}
+        for status, count in self.conn.execute("SELECT status, COUNT(*) FROM results GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def usage_totals(self):
+        row = self.conn.execute(
+            "SELECT COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0), "
+            "COALESCE(SUM(cache_write_tokens), 0), COALESCE(SUM(cache_read_tokens), 0) FROM results"
+        ).fetchone()
+        return dict(zip(["input_tokens", "output_tokens", "cache_write_tokens", "cache_read_tokens"], row))
+
+    def import_tsv(self, results_csv, summary_csv=None):
+        """Load rows from an existing Results.csv (and Summaries.csv) so older runs resume from the store."""
+        imported = 0
+        with self.conn:
+            if summary_csv and os.path.isfile(summary_csv):
+                with open(summary_csv, 'r', newline='', encoding='utf-8') as csvfile:
+                    for row in csv.DictReader(csvfile, delimiter='\t'):
+                        self.conn.execute(
+                            "INSERT OR IGNORE INTO results (pmid, status, summary, updated_at) "
+                            "VALUES (?, 'summarised', ?, ?)", (row["PMID"], row["Summary"], time.time())
+                        )
+            if os.path.isfile(results_csv):
+                with open(results_csv, 'r', newline='', encoding='utf-8') as csvfile:
+                    for row in csv.DictReader(csvfile, delimiter='\t'):
+                        self.conn.execute(
+                            "INSERT INTO results (pmid, status, ibd_type, non_associations, "
+                            "non_association_types, updated_at) VALUES (?, 'extracted', ?, ?, ?, ?) "
+                            "ON CONFLICT (pmid) DO UPDATE SET status = 'extracted', ibd_type = excluded.ibd_type, "
+                            "non_associations = excluded.non_associations, "
+                            "non_association_types = excluded.non_association_types",
+                            (row["PMID"], row["IBD Type"], row["Non-Associations"], row["Non-Association Types"],
+                             time.time())
+                        )
+                        imported += 1
+        return imported
+
+    def export_tsv(self, results_csv, summary_csv=None):
+        """Write the extracted rows (and summaries) in the Results.csv/Summaries.csv layout.
+
+        Files are written to a temporary path and renamed, so a reader never sees a half-written export.
+        """
+        rows = self.conn.execute(
+            "SELECT pmid, ibd_type, non_associations, non_association_types FROM results "
+            "WHERE status = 'extracted' ORDER BY CAST(pmid AS INTEGER)"
+        )
+        write_tsv(results_csv, RESULT_HEADER, rows)
+        if summary_csv:
+            rows = self.conn.execute(
+                "SELECT pmid, summary FROM results WHERE summary IS NOT NULL ORDER BY CAST(pmid AS INTEGER)"
+            )
+            write_tsv(summary_csv, ["PMID", "Summary"], rows)
+
+    def close(self):
+        self.conn.close()
+
+
+def write_tsv(filename, header, rows):
+    """Write rows to a tab-separated file via a temporary file, so readers never see it half-written."""
+    # The temporary name is per process, since several shard workers may merge the same output at once
+    tmp_path = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile, delimiter='\t', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(tmp_path, filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect a results store or export it to Results.csv format.")
+    parser.add_argument("store", help="Results database, e.g. results.sqlite")
+    parser.add_argument("--export", help="Write the extracted rows to this tab-separated file")
+    parser.add_argument("--summaries", help="Also write the summaries to this tab-separated file")
+    parser.add_argument("--failed", action="store_true", help="List failed PMIDs with their errors")
+    parser.add_argument("--dead-letters", action="store_true",
+                        help="List PMIDs whose retries ran out on rate limits, overload or timeouts")
+    parser.add_argument("--requeue", action="store_true",
+                        help="Release the dead-letter queue so the next run retries those PMIDs")
+    args = parser.parse_args(argv)
+
+    store = ResultsStore(args.store)
+    for status, count in store.counts().items():
+        print(f"{status}: {count}")
+    dead_letters = store.dead_letters()
+    print(f"dead-lettered: {len(dead_letters)}")
+    if args.dead_letters:
+        for pmid, attempts, error in dead_letters:
+            print(f"PMID {pmid} (attempts: {attempts}): {error}")
+    if args.requeue:
+        print(f"Requeued {store.requeue_dead_letters()} dead-lettered PMIDs")
+    if args.failed:
+        for pmid, attempts, error in store.conn.execute(
+                "SELECT pmid, attempts, error FROM results WHERE status = 'failed' ORDER BY pmid"):
+            print(f"PMID {pmid} (attempts: {attempts}): {error}")
+    if args.export:
+        store.export_tsv(args.export, args.summaries)
+        print(f"Exported results to {args.export}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import json
+import time
+import heapq
+import argparse
+
+# Public list prices in USD per million tokens: (input, output, prompt-cache write, prompt-cache read).
+# Check them against your account before budgeting a run; models not listed are reported without a cost.
+PRICES = {
+    "claude-3-5-sonnet-20240620": (3.00, 15.00, 3.75, 0.30),
+    "claude-3-5-sonnet-20241022": (3.00, 15.00, 3.75, 0.30),
+    "claude-3-5-haiku-20241022": (0.80, 4.00, 1.00, 0.08),
+    "claude-3-haiku-20240307": (0.25, 1.25, 0.30, 0.03),
+    "gpt-4o": (2.50, 10.00, 0.00, 1.25),
+    "gpt-4o-mini": (0.15, 0.60, 0.00, 0.075),
+    "mock": (0.00, 0.00, 0.00, 0.00)
+}
+BATCH_DISCOUNT = 0.5  # Message Batches are billed at half the list price
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cache_write_tokens", "cache_read_tokens")
+# queue_wait: time spent waiting on the rate limiter; backoff: time asleep between retries;
+# ttfb: request sent to response headers (or first streamed byte); latency: the answering request;
+# total: the whole call including every retry
+TIMING_FIELDS = ("queue_wait", "backoff", "ttfb", "latency", "total")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def estimate_cost(model, usage, batch=False):
+    prices = PRICES.get(model)
+    if prices is None:
+        return None
+    cost = sum(usage.get(field, 0) * price for field, price in zip(TOKEN_FIELDS, prices)) / 1e6
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+class TraceSummary:
+    """Running totals over trace records, so summarising never needs the whole trace in memory."""
+
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self.run = {}
+        self.started = None
+        self.last = None
+        self.earlier_seconds = 0.0  # Time spent in earlier sessions of a resumed run
+        self.sessions = 0
+        self.timings = {}
+        self.calls = {}
+        self.retries = {}
+        self.usage = {}
+        self.pmid_seconds = {}
+        self.pmids = {}
+
+    def add(self, record):
+        event = record.get("event")
+        if event == "run":
+            # A resumed run appends to the same trace; the gap between sessions is not counted as run time
+            if self.started is not None:
+                self.earlier_seconds += self.last - self.started
+            self.run = {key: value for key, value in record.items() if key not in ("event", "time")}
+            self.started = record["time"]
+            self.sessions += 1
+        if self.started is None:
+            self.started = record["time"]
+        self.last = record["time"]
+
+        if event == "call":
+            stage, outcome = record["stage"], record["outcome"]
+            outcomes = self.calls.setdefault(stage, {})
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            self.retries[stage] = self.retries.get(stage, 0) + record.get("retries", 0)
+            if outcome == "ok":
+                timings = self.timings.setdefault(stage, {field: [] for field in TIMING_FIELDS})
+                for field in TIMING_FIELDS:
+                    if record.get(field) is not None:
+                        timings[field].append(record[field])
+            self._add_usage(record["model"], False, record)
+            if record.get("pmid") is not None:
+                self.pmid_seconds[record["pmid"]] = self.pmid_seconds.get(record["pmid"], 0.0) + record["total"]
+        elif event == "batch":
+            self._add_usage(record["model"], True, record)
+        elif event == "pmid":
+            self.pmids[record["outcome"]] = self.pmids.get(record["outcome"], 0) + 1
+
+    def _add_usage(self, model, batch, record):
+        usage = self.usage.setdefault((model, batch), dict.fromkeys(TOKEN_FIELDS, 0))
+        for field in TOKEN_FIELDS:
+            usage[field] += record.get(field, 0)
+
+    def summary(self):
+        seconds = self.earlier_seconds + ((self.last - self.started) if self.started is not None else 0.0)
+        finished = sum(self.pmids.values())
+        stages = {}
+        for stage, outcomes in self.calls.items():
+            stages[stage] = {"calls": outcomes, "retries": self.retries.get(stage, 0)}
+            for field, values in self.timings.get(stage, {}).items():
+                values = sorted(values)
+                if values:
+                    stages[stage][field] = {f"p{q}": percentile(values, q) for q in PERCENTILES}
+                    stages[stage][field]["mean"] = sum(values) / len(values)
+        costs = []
+        for (model, batch), usage in sorted(self.usage.items()):
+            costs.append({"model": model, "batch": batch, **usage, "cost_usd": estimate_cost(model, usage, batch)})
+        slowest = heapq.nlargest(self.slowest, self.pmid_seconds.items(), key=lambda item: item[1])
+        return {
+            "run": self.run,
+            "sessions": self.sessions,
+            "wall_seconds": seconds,
+            "pmids": self.pmids,
+            "pmids_per_minute": finished / (seconds / 60) if seconds > 0 else None,
+            "stages": stages,
+            "cost": costs,
+            "cost_usd": (sum(row["cost_usd"] for row in costs)
+                         if all(row["cost_usd"] is not None for row in costs) else None),
+            "slowest_pmids": [{"pmid": pmid, "seconds": seconds} for pmid, seconds in slowest]
+        }
+
+
+def print_summary(summary):
+    sessions = f" over {summary['sessions']} sessions" if summary.get("sessions", 0) > 1 else ""
+    print(f"Run took {summary['wall_seconds']:.1f}s{sessions}; PMIDs: "
+          + (", ".join(f"{count} {outcome}" for outcome, count in summary["pmids"].items()) or "none"))
+    if summary["pmids_per_minute"] is not None:
+        print(f"Throughput: {summary['pmids_per_minute']:.1f} PMIDs/min")
+    for stage, stats in summary["stages"].items():
+        calls = ", ".join(f"{count} {outcome}" for outcome, count in stats["calls"].items())
+        print(f"{stage} calls: {calls}; {stats['retries']} retries")
+        for field in TIMING_FIELDS:
+            if field in stats:
+                print(f"  {field:<10} " + "  ".join(f"p{q} {stats[field][f'p{q}']:.2f}s" for q in PERCENTILES))
+    for row in summary["cost"]:
+        cost = "unknown price" if row["cost_usd"] is None else f"${row['cost_usd']:.4f}"
+        cached = (f"{row['cache_write_tokens']} cache write, {row['cache_read_tokens']} cache read, "
+                  if row['cache_write_tokens'] or row['cache_read_tokens'] else "")
+        print(f"Estimated cost for {row['model']}{' (batch)' if row['batch'] else ''}: {cost} "
+              f"({row['input_tokens']} input, {cached}{row['output_tokens']} output tokens)")
+    if summary["slowest_pmids"]:
+        print("Slowest PMIDs: " + ", ".join(f"{row['pmid']} ({row['seconds']:.1f}s)"
+                                            for row in summary["slowest_pmids"]))
+
+
+class RunTrace:
+    """Structured telemetry for one extraction run.
+
+    Every LLM call (summary, extraction or combined stage) and every finished PMID is appended to a JSONL
+    trace as it happens; report() prints the run summary and writes it as JSON. A resumed run appends to
+    the trace after a new run record, so 'python run_trace.py <trace.jsonl>' rebuilds the summary of every
+    session together, while report() covers the current one.
+    """
+
+    def __init__(self, path=None, report_path=None, slowest=10):
+        self.path = path
+        self.report_path = report_path
+        self.file = open(path, 'a', encoding='utf-8', buffering=1) if path else None
+        self.totals = TraceSummary(slowest)
+
+    def write(self, event, **fields):
+        record = {"event": event, "time": time.time(), **fields}
+        self.totals.add(record)
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+
+    def start(self, **settings):
+        self.write("run", **settings)
+
+    def call(self, pmid, stage, model, outcome, completion, retries=0, **timings):
+        self.write("call", pmid=pmid, stage=stage, model=model, outcome=outcome, retries=retries,
+                   **{field: timings.get(field) for field in TIMING_FIELDS},
+                   **{field: getattr(completion, field) for field in TOKEN_FIELDS},
+                   error=completion.error)
+
+    def batch(self, model, usage):
+        self.write("batch", model=model, **{field: usage.get(field, 0) for field in TOKEN_FIELDS})
+
+    def pmid(self, pmid, outcome):
+        self.write("pmid", pmid=pmid, outcome=outcome)
+
+    def summary(self):
+        return self.totals.summary()
+
+    def report(self):
+        summary = self.summary()
+        print_summary(summary)
+        if self.report_path:
+            with open(self.report_path, 'w', encoding='utf-8') as file:
+                json.dump(summary, file, indent=2)
+            print(f"Run report written to {self.report_path}")
+        return summary
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise a run trace: latency percentiles per stage, "
+                                                 "throughput, estimated cost and the slowest PMIDs.")
+    parser.add_argument("trace", help="JSONL trace written by an extraction run")
+    parser.add_argument("--json", help="Also write the summary to this JSON file")
+    parser.add_argument("--slowest", type=int, default=10, help="Number of slowest PMIDs to list")
+    args = parser.parse_args(argv)
+
+    totals = TraceSummary(args.slowest)
+    with open(args.trace, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                totals.add(json.loads(line))
+    summary = totals.summary()
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(summary, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+
+from results_store import ResultsStore, RESULT_HEADER, write_tsv
+
+# Splits a run over many worker processes on one host that share a coordinator. The sorted
+# PMIDs of the corpus are cut into fixed-size shards once, by whichever worker starts first; every worker
+# then repeatedly leases a shard, extracts it into that shard's own results store and marks it done. A
+# lease lasts lease_seconds and is renewed in the background while the shard is processed; a lease whose
+# worker died or stalled expires and the shard is handed to the next worker that asks, which resumes from
+# the shard's results store, so PMIDs the first worker finished are not extracted again. A worker that
+# finds its lease taken over stops before its next PMID. Shards are contiguous PMID ranges, so merging
+# the shard stores in shard order gives one Results.csv in PMID order, byte-identical however the shards
+# were spread over workers.
+#
+# The coordinator is a SQLite file (<name>.sqlite), or any other path, which is used as a directory of
+# plain lease files for shared filesystems (such as NFS) on which SQLite's locking cannot be trusted.
+# Either way the shard stores are kept in <coordinator stem>_shards/ next to it. They are SQLite files
+# too, opened without WAL in directory mode, so the workers of one run must still all be on one host.
+SHARD_SIZE = 500
+LEASE_SECONDS = 300
+
+
+def plan_shards(pmids, shard_size=SHARD_SIZE):
+    """Cut PMIDs, in numeric order, into lists of at most shard_size."""
+    pmids = sorted(pmids, key=int)
+    return [pmids[start:start + shard_size] for start in range(0, len(pmids), shard_size)]
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class SQLiteCoordinator:
+    """Shard plan and leases in one SQLite table; each claim is a single IMMEDIATE transaction."""
+
+    store_journal_mode = "WAL"
+
+    def __init__(self, path):
+        self.path = path
+        self.shard_dir = os.path.splitext(path)[0] + "_shards"
+        os.makedirs(self.shard_dir, exist_ok=True)
+        # Autocommit mode, so claim() can take the write lock before it reads
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS shards ("
+            "shard INTEGER PRIMARY KEY, "
+            "pmids TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "worker TEXT, "
+            "expires_at REAL, "
+            "claims INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def plan(self, shards):
+        """Record the shard plan unless another worker already has; returns the number of shards."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.conn.execute("SELECT 1 FROM shards LIMIT 1").fetchone() is None:
+                self.conn.executemany("INSERT INTO shards (shard, pmids) VALUES (?, ?)",
+                                      ((shard, "\n".join(pmids)) for shard, pmids in enumerate(shards)))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return self.conn.execute("SELECT COUNT(*) FROM shards").fetchone()[0]
+
+    def pmids(self, shard):
+        return self.conn.execute("SELECT pmids FROM shards WHERE shard = ?", (shard,)).fetchone()[0].split("\n")
+
+    def claim(self, worker, lease_seconds=LEASE_SECONDS):
+        """Lease the first pending or expired shard to worker; returns its number, or None when none is left."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT shard FROM shards WHERE status = 'pending' OR (status = 'leased' AND expires_at < ?) "
+                "ORDER BY shard LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE shards SET status = 'leased', worker = ?, expires_at = ?, claims = claims + 1 "
+                    "WHERE shard = ?", (worker, now + lease_seconds, row[0])
+                )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return None if row is None else row[0]
+
+    def renew(self, shard, worker, lease_seconds=LEASE_SECONDS):
+        """Extend worker's lease on shard; False if the lease has been taken over."""
+        cursor = self.conn.execute(
+            "UPDATE shards SET expires_at = ? WHERE shard = ? AND status = 'leased' AND worker = ?",
+            (time.time() + lease_seconds, shard, worker)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, shard, worker):
+        cursor = self.conn.execute(
+            "UPDATE shards SET status = 'done', expires_at = NULL WHERE shard = ? AND status = 'leased' "
+            "AND worker = ?", (shard, worker)
+        )
+        return cursor.rowcount == 1
+
+    def release(self, shard, worker):
+        """Give a shard back straight away, e.g. after an error, instead of waiting for its lease to expire."""
+        self.conn.execute(
+            "UPDATE shards SET status = 'pending', worker = NULL, expires_at = NULL "
+            "WHERE shard = ? AND status = 'leased' AND worker = ?", (shard, worker)
+        )
+
+    def reopen(self, shard):
+        """Put a finished shard back in the queue, e.g. after its dead-lettered PMIDs were requeued."""
+        self.conn.execute("UPDATE shards SET status = 'pending', worker = NULL, expires_at = NULL WHERE shard = ?",
+                          (shard,))
+
+    def status(self):
+        """(shard, status, worker, expires_at, claims) for every shard; status is pending, leased, expired or done."""
+        now = time.time()
+        rows = []
+        for shard, status, worker, expires_at, claims in self.conn.execute(
+                "SELECT shard, status, worker, expires_at, claims FROM shards ORDER BY shard"):
+            if status == 'leased' and expires_at < now:
+                status = 'expired'
+            rows.append((shard, status, worker, expires_at, claims))
+        return rows
+
+    def close(self):
+        self.conn.close()
+
+
+class DirectoryCoordinator:
+    """Shard plan and leases as files in a shared directory, relying only on exclusive create and rename.
+
+    A lease is a file leases/<shard>.<generation> holding its worker and expiry; the highest generation is
+    the current lease. Taking over an expired lease creates the next generation with link(), which fails if
+    the file exists, so exactly one worker wins, and the worker that lost it sees the newer generation when
+    it next renews. Shard stores are opened with a rollback journal, since WAL's shared memory does not work
+    on a network filesystem; SQLite's locks still do not reach across hosts, so the workers must share one.
+    """
+
+    store_journal_mode = "DELETE"
+
+    def __init__(self, path):
+        self.path = path
+        self.shard_dir = path.rstrip(os.sep) + "_shards"
+        for directory in (path, self.shard_dir, os.path.join(path, "leases"), os.path.join(path, "done")):
+            os.makedirs(directory, exist_ok=True)
+        self.plan_dir = os.path.join(path, "plan")
+
+    def plan(self, shards):
+        if not os.path.isdir(self.plan_dir):
+            # Written aside and renamed into place, so a plan is either complete or absent
+            tmp_dir = os.path.join(self.path, f"plan.{uuid.uuid4().hex}.tmp")
+            os.makedirs(tmp_dir)
+            for shard, pmids in enumerate(shards):
+                with open(os.path.join(tmp_dir, f"{shard:05d}.pmids"), 'w', encoding='utf-8') as file:
+                    file.write("\n".join(pmids))
+            try:
+                os.rename(tmp_dir, self.plan_dir)
+            except OSError:
+                # Another worker planned first
+                for name in os.listdir(tmp_dir):
+                    os.remove(os.path.join(tmp_dir, name))
+                os.rmdir(tmp_dir)
+        return len(self._shards())
+
+    def _shards(self):
+        if not os.path.isdir(self.plan_dir):
+            return []
+        return sorted(int(name.split(".")[0]) for name in os.listdir(self.plan_dir))
+
+    def pmids(self, shard):
+        with open(os.path.join(self.plan_dir, f"{shard:05d}.pmids"), 'r', encoding='utf-8') as file:
+            return file.read().split("\n")
+
+    def _done(self, shard):
+        return os.path.exists(os.path.join(self.path, "done", f"{shard:05d}"))
+
+    def _lease(self, shard):
+        """(generation, worker, expires_at) of the current lease on shard, or None."""
+        prefix = f"{shard:05d}."
+        generations = [int(name[len(prefix):]) for name in os.listdir(os.path.join(self.path, "leases"))
+                       if name.startswith(prefix) and name[len(prefix):].isdigit()]
+        if not generations:
+            return None
+        generation = max(generations)
+        with open(self._lease_path(shard, generation), 'r', encoding='utf-8') as file:
+            lease = json.load(file)
+        return generation, lease["worker"], lease["expires_at"]
+
+    def _lease_path(self, shard, generation):
+        return os.path.join(self.path, "leases", f"{shard:05d}.{generation}")
+
+    def _write_lease(self, path, worker, lease_seconds, exclusive):
+        """Write a lease file whole; exclusive=True raises FileExistsError if it already exists."""
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"worker": worker, "expires_at": time.time() + lease_seconds}, file)
+        if not exclusive:
+            os.replace(tmp_path, path)
+            return
+        # link() fails if the target exists, also over NFS, unlike a rename
+        try:
+            os.link(tmp_path, path)
+        finally:
+            os.remove(tmp_path)
+
+    def claim(self, worker, lease_seconds=LEASE_SECONDS):
+        for shard in self._shards():
+            if self._done(shard):
+                continue
+            lease = self._lease(shard)
+            if lease is not None and lease[2] >= time.time():
+                continue
+            generation = 0 if lease is None else lease[0] + 1
+            try:
+                self._write_lease(self._lease_path(shard, generation), worker, lease_seconds, exclusive=True)
+            except FileExistsError:
+                continue
+            return shard
+        return None
+
+    def _holds(self, shard, worker):
+        lease = self._lease(shard)
+        return lease is not None and lease[1] == worker and not self._done(shard)
+
+    def renew(self, shard, worker, lease_seconds=LEASE_SECONDS):
+        lease = self._lease(shard)
+        if lease is None or lease[1] != worker:
+            return False
+        self._write_lease(self._lease_path(shard, lease[0]), worker, lease_seconds, exclusive=False)
+        # A takeover between the check and the write created a newer generation, which wins
+        return self._holds(shard, worker)
+
+    def complete(self, shard, worker):
+        if not self._holds(shard, worker):
+            return False
+        with open(os.path.join(self.path, "done", f"{shard:05d}"), 'w', encoding='utf-8') as file:
+            file.write(worker)
+        return True
+
+    def release(self, shard, worker):
+        lease = self._lease(shard)
+        if lease is not None and lease[1] == worker:
+            # Expire it rather than delete it, so generations keep increasing
+            self._write_lease(self._lease_path(shard, lease[0]), worker, -1, exclusive=False)
+
+    def reopen(self, shard):
+        lease = self._lease(shard)
+        if lease is not None:
+            self._write_lease(self._lease_path(shard, lease[0]), lease[1], -1, exclusive=False)
+        done_path = os.path.join(self.path, "done", f"{shard:05d}")
+        if os.path.exists(done_path):
+            os.remove(done_path)
+
+    def status(self):
+        now = time.time()
+        rows = []
+        for shard in self._shards():
+            lease = self._lease(shard)
+            claims = 0 if lease is None else lease[0] + 1
+            if self._done(shard):
+                rows.append((shard, 'done', lease[1] if lease else None, None, claims))
+            elif lease is None:
+                rows.append((shard, 'pending', None, None, 0))
+            else:
+                rows.append((shard, 'leased' if lease[2] >= now else 'expired', lease[1], lease[2], claims))
+        return rows
+
+    def close(self):
+        pass
+
+
+def open_coordinator(path):
+    """A SQLite coordinator for a .sqlite/.db path, otherwise a directory coordinator."""
+    if os.path.splitext(path)[1] in (".sqlite", ".db"):
+        return SQLiteCoordinator(path)
+    return DirectoryCoordinator(path)
+
+
+def shard_paths(coordinator, shard):
+    """Results store, Results.csv, Summaries.csv and batch state file of one shard."""
+    stem = os.path.join(coordinator.shard_dir, f"shard_{shard:05d}")
+    return stem + ".sqlite", stem + "_Results.csv", stem + "_Summaries.csv", stem + "_batch_state.json"
+
+
+class Lease:
+    """Renews a shard lease every lease_seconds / 3 on a background thread until stopped or lost."""
+
+    def __init__(self, coordinator_path, shard, worker, lease_seconds=LEASE_SECONDS):
+        self.shard = shard
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.held = True
+        self.stopped = threading.Event()
+        # SQLite connections belong to the thread that opened them, so the heartbeat opens its own
+        self.thread = threading.Thread(target=self._renew, args=(coordinator_path,), daemon=True)
+        self.thread.start()
+
+    def _renew(self, coordinator_path):
+        # A renewal that fails (a locked or unreachable coordinator) is retried on the next heartbeat; once
+        # the lease has expired without one succeeding, another worker may have taken the shard, so stop
+        expires_at = time.time() + self.lease_seconds
+        coordinator = None
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                try:
+                    if coordinator is None:
+                        coordinator = open_coordinator(coordinator_path)
+                    renewed = coordinator.renew(self.shard, self.worker, self.lease_seconds)
+                except Exception as e:
+                    if time.time() < expires_at:
+                        print(f"Could not renew the lease on shard {self.shard}: {e}. Retrying.")
+                        continue
+                    print(f"Could not renew the lease on shard {self.shard} before it expired: {e}. "
+                          f"Stopping it after the PMIDs in flight")
+                    self.held = False
+                    return
+                if not renewed:
+                    print(f"Lease on shard {self.shard} was taken over; stopping it after the PMIDs in flight")
+                    self.held = False
+                    return
+                expires_at = time.time() + self.lease_seconds
+        finally:
+            if coordinator is not None:
+                coordinator.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class ShardCorpus:
+    """The PMIDs of one shard of a corpus; stops handing out PMIDs once the shard's lease is lost."""
+
+    def __init__(self, corpus, pmids, lease):
+        self.corpus = corpus
+        self.shard_pmids = [pmid for pmid in pmids if pmid in corpus]
+        self.pmid_set = set(self.shard_pmids)
+        self.lease = lease
+
+    def __len__(self):
+        return len(self.shard_pmids)
+
+    def __contains__(self, pmid):
+        return pmid in self.pmid_set
+
+    def get(self, pmid):
+        return self.corpus.get(pmid)
+
+    def pmids(self):
+        for pmid in self.shard_pmids:
+            if not self.lease.held:
+                return
+            yield pmid
+
+    def __iter__(self):
+        for pmid in self.pmids():
+            yield pmid, self.get(pmid)
+
+    def close(self):
+        pass
+
+
+def run_worker(pipeline, coordinator_path, corpus, mode='concurrent', worker=None, shard_size=SHARD_SIZE,
+               lease_seconds=LEASE_SECONDS):
+    """Lease and extract shards of corpus with pipeline until none are left; returns the shards this worker did.
+
+    The pipeline's results store and output files are switched to each shard's own before it is run. A
+    shard is run again while it has PMIDs that failed fewer than max_attempts times, then marked done.
+    """
+    worker = worker or default_worker_id()
+    coordinator = open_coordinator(coordinator_path)
+    shards = coordinator.plan(plan_shards(corpus.pmids(), shard_size))
+    print(f"Worker {worker}: {shards} shards in {coordinator_path}")
+    completed = []
+    try:
+        while True:
+            shard = coordinator.claim(worker, lease_seconds)
+            if shard is None:
+                break
+            store_path, output_csv, summary_csv, batch_state = shard_paths(coordinator, shard)
+            lease = Lease(coordinator_path, shard, worker, lease_seconds)
+            pipeline.results_store = ResultsStore(store_path, coordinator.store_journal_mode)
+            pipeline.output_csv = output_csv
+            pipeline.summary_csv = summary_csv if pipeline.summary_csv else None
+            shard_corpus = ShardCorpus(corpus, coordinator.pmids(shard), lease)
+            try:
+                for _ in range(pipeline.max_attempts):
+                    pipeline.run_corpus(shard_corpus, mode, batch_state)
+                    if next(pipeline.pending_pmids(shard_corpus), None) is None:
+                        break
+            except BaseException:
+                lease.stop()
+                coordinator.release(shard, worker)
+                raise
+            finally:
+                pipeline.results_store.close()
+            lease.stop()
+            if lease.held and coordinator.complete(shard, worker):
+                completed.append(shard)
+                print(f"Worker {worker}: finished shard {shard}")
+    finally:
+        coordinator.close()
+    return completed
+
+
+def requeue_dead_letters(coordinator_path):
+    """Requeue the dead-lettered PMIDs of every shard and reopen the finished shards that had any."""
+    coordinator = open_coordinator(coordinator_path)
+    requeued = 0
+    try:
+        for shard, state, *_ in coordinator.status():
+            store_path = shard_paths(coordinator, shard)[0]
+            if not os.path.isfile(store_path):
+                continue
+            store = ResultsStore(store_path, coordinator.store_journal_mode)
+            count = store.requeue_dead_letters()
+            store.close()
+            if count and state == 'done':
+                coordinator.reopen(shard)
+            requeued += count
+    finally:
+        coordinator.close()
+    return requeued
+
+
+def merge(coordinator_path, results_csv, summary_csv=None, partial=False):
+    """Write the extracted rows (and summaries) of every shard to one Results.csv, in PMID order.
+
+    Refuses while shards are unfinished unless partial=True; returns the number of rows written.
+    """
+    coordinator = open_coordinator(coordinator_path)
+    try:
+        status = coordinator.status()
+        unfinished = [shard for shard, state, *_ in status if state != 'done']
+        if unfinished and not partial:
+            raise ValueError(f"{len(unfinished)} of {len(status)} shards are unfinished")
+        stores = [shard_paths(coordinator, shard)[0] for shard, *_ in status]
+        journal_mode = coordinator.store_journal_mode
+    finally:
+        coordinator.close()
+    stores = [path for path in stores if os.path.isfile(path)]
+
+    def rows(query):
+        for path in stores:
+            store = ResultsStore(path, journal_mode)
+            try:
+                yield from store.conn.execute(query)
+            finally:
+                store.close()
+
+    written = 0
+
+    def counted(query):
+        nonlocal written
+        for row in rows(query):
+            written += 1
+            yield row
+
+    # Shards hold consecutive PMID ranges, so shard order is PMID order
+    write_tsv(results_csv, RESULT_HEADER, counted(
+        "SELECT pmid, ibd_type, non_associations, non_association_types FROM results "
+        "WHERE status = 'extracted' ORDER BY CAST(pmid AS INTEGER)"))
+    if summary_csv:
+        write_tsv(summary_csv, ["PMID", "Summary"], rows(
+            "SELECT pmid, summary FROM results WHERE summary IS NOT NULL ORDER BY CAST(pmid AS INTEGER)"))
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect a sharded run's coordinator or merge its shards. "
+                                                 "Workers are started with 'IBD_Extractor.py --coordinator'.")
+    parser.add_argument("coordinator", help="Coordinator SQLite file or shared directory")
+    parser.add_argument("--merge", help="Write every shard's extracted rows to this tab-separated file")
+    parser.add_argument("--summaries", help="Also merge the summaries into this tab-separated file")
+    parser.add_argument("--partial", action="store_true", help="Merge even though some shards are unfinished")
+    parser.add_argument("--shards", action="store_true", help="List every shard with its lease")
+    parser.add_argument("--requeue-dead-letters", action="store_true",
+                        help="Requeue every shard's dead-lettered PMIDs so the next workers retry them")
+    args = parser.parse_args(argv)
+
+    if args.requeue_dead_letters:
+        print(f"Requeued {requeue_dead_letters(args.coordinator)} dead-lettered PMIDs")
+    coordinator = open_coordinator(args.coordinator)
+    status = coordinator.status()
+    coordinator.close()
+    counts = {}
+    for _, state, *_ in status:
+        counts[state] = counts.get(state, 0) + 1
+    print(f"{len(status)} shards: " + (", ".join(f"{count} {state}" for state, count in counts.items()) or "none"))
+    if args.shards:
+        for shard, state, worker, expires_at, claims in status:
+            lease = f", lease until {time.ctime(expires_at)}" if expires_at else ""
+            print(f"Shard {shard}: {state}{f' by {worker}' if worker else ''} (claims: {claims}){lease}")
+    if args.merge:
+        print(f"Merged {merge(args.coordinator, args.merge, args.summaries, args.partial)} rows into {args.merge}")
+
+
+if __name__ == "__main__":
+    main()